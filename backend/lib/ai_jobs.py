@@ -0,0 +1,287 @@
+"""
+AI generation job queue
+Generations are enqueued in db.ai_jobs and processed by a bounded pool of
+workers instead of inside the request. Jobs are claimed with a lease in plan
+priority order (ultra, then pro, then free; oldest first within a plan),
+retried with exponential backoff on transient failures, and kept for a few
+days so clients can poll or subscribe for their result.
+
+Waiting and running jobs carry `pending: true`, which a partial unique index
+uses so that a user has at most one pending job per generation. Jobs whose
+worker died are requeued until they run out of attempts, then failed and
+their credit reservation released.
+"""
+import asyncio
+import logging
+import os
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from .credit_ledger import credit_ledger
+from .metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+# Higher goes first
+PLAN_PRIORITY = {"ultra": 2, "pro": 1, "free": 0}
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class JobRejected(Exception):
+    """Raised by a job handler for failures that retrying cannot fix"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+class GenerationQueue:
+    """MongoDB-backed priority queue of AI generation jobs, with its worker pool"""
+
+    def __init__(self, concurrency: int = 4, max_attempts: int = 3, backoff: float = 5,
+                 lease_seconds: int = 300, poll_interval: float = 1, retention_days: int = 7,
+                 max_pending_per_user: int = 5):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_days = retention_days
+        self.max_pending_per_user = max_pending_per_user
+        self._db = None
+        self._handler: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None
+        self._tasks = []
+        self._wake = asyncio.Event()
+        self.wait_time = LatencyStats()
+        self.run_time = LatencyStats()
+        self.counters = {"enqueued": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "retried": 0,
+                         "requeued": 0}
+
+    def configure(self, db, handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]) -> None:
+        """
+        Args:
+            db: Database holding the ai_jobs collection
+            handler: Runs one job and returns the fields to store on it
+                (content, ...); raises JobRejected for permanent failures,
+                anything else is retried
+        """
+        self._db = db
+        self._handler = handler
+
+    async def enqueue(self, user: Dict[str, Any], application_id: str, generation_type: str,
+                      force: bool = False) -> Dict[str, Any]:
+        """
+        Queue a generation, or return the user's pending job for the same content
+
+        Returns:
+            The job document
+
+        Raises:
+            JobRejected: if the user already has max_pending_per_user jobs waiting
+        """
+        db = self._db
+        pending = {"user_id": user["user_id"], "status": {"$in": ["queued", "running"]}}
+        same = {**pending, "application_id": application_id, "generation_type": generation_type}
+        existing = await db.ai_jobs.find_one(same, {"_id": 0})
+        if existing:
+            self.counters["deduplicated"] += 1
+            return existing
+        if await db.ai_jobs.count_documents(pending) >= self.max_pending_per_user:
+            raise JobRejected("Trop de générations en attente, réessayez dans quelques instants")
+
+        now = _iso(_now())
+        plan = user.get("subscription_plan", "free")
+        job = {
+            "job_id": f"job_{uuid.uuid4().hex[:12]}",
+            "user_id": user["user_id"],
+            "application_id": application_id,
+            "generation_type": generation_type,
+            "force": force,
+            "plan": plan,
+            "priority": PLAN_PRIORITY.get(plan, 0),
+            "status": "queued",
+            "pending": True,
+            "attempts": 0,
+            "created_at": now,
+            "available_at": now,
+            "lease_until": None
+        }
+        try:
+            await db.ai_jobs.insert_one(job)
+        except DuplicateKeyError:
+            # Same generation enqueued concurrently: the unique index kept the other one
+            existing = await db.ai_jobs.find_one(same, {"_id": 0})
+            if existing:
+                self.counters["deduplicated"] += 1
+                return existing
+            raise
+        job.pop("_id", None)
+        # Concurrent enqueues all pass the count above; the ones beyond the limit withdraw
+        if await db.ai_jobs.count_documents(pending) > self.max_pending_per_user:
+            await db.ai_jobs.delete_one({"job_id": job["job_id"], "status": "queued"})
+            raise JobRejected("Trop de générations en attente, réessayez dans quelques instants")
+        self.counters["enqueued"] += 1
+        self._wake.set()
+        return job
+
+    async def get(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """A user's job, with its queue position while it waits"""
+        job = await self._db.ai_jobs.find_one({"job_id": job_id, "user_id": user_id}, {"_id": 0, "expires_at": 0})
+        if job and job["status"] == "queued":
+            job["position"] = await self._db.ai_jobs.count_documents({"status": "queued", "$or": [
+                {"priority": {"$gt": job["priority"]}},
+                {"priority": job["priority"], "created_at": {"$lt": job["created_at"]}}
+            ]}) + 1
+        return job
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        """Lease the highest priority job that is due"""
+        now = _now()
+        return await self._db.ai_jobs.find_one_and_update(
+            {"status": "queued", "available_at": {"$lte": _iso(now)}},
+            {"$set": {"status": "running", "started_at": _iso(now),
+                      "lease_until": _iso(now + timedelta(seconds=self.lease_seconds))},
+             "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _requeue_expired(self) -> None:
+        """Jobs whose worker died mid-run go back to the queue, or fail once out of attempts"""
+        db = self._db
+        now = _iso(_now())
+        expired = {"status": "running", "lease_until": {"$lt": now}}
+        async for job in db.ai_jobs.find({**expired, "attempts": {"$gte": self.max_attempts}}, {"_id": 0}):
+            # Conditional, so a job reaped concurrently is only failed once
+            if await self._finish(job, {"status": "failed", "error": "Erreur lors de la génération"}, expired):
+                self.counters["failed"] += 1
+                logger.error(f"AI job {job['job_id']} abandoned after {job['attempts']} attempts")
+                await credit_ledger.release_ref(job["job_id"], reason="generation job abandoned")
+        result = await db.ai_jobs.update_many(
+            expired,
+            {"$set": {"status": "queued", "available_at": now, "lease_until": None}}
+        )
+        self.counters["requeued"] += result.modified_count
+
+    async def _finish(self, job: Dict[str, Any], update: Dict[str, Any],
+                      condition: Optional[Dict[str, Any]] = None) -> bool:
+        now = _now()
+        result = await self._db.ai_jobs.update_one(
+            {"job_id": job["job_id"], **(condition or {})},
+            {"$set": {**update, "finished_at": _iso(now), "lease_until": None,
+                      "expires_at": now + timedelta(days=self.retention_days)},
+             "$unset": {"pending": ""}}
+        )
+        return result.modified_count > 0
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        started = datetime.fromisoformat(job["started_at"])
+        self.wait_time.record((started - datetime.fromisoformat(job["created_at"])).total_seconds() * 1000)
+        try:
+            with self.run_time.time():
+                result = await self._handler(job)
+        except JobRejected as e:
+            self.counters["failed"] += 1
+            await self._finish(job, {"status": "failed", "error": str(e)})
+        except Exception as e:
+            if job["attempts"] >= self.max_attempts:
+                self.counters["failed"] += 1
+                logger.error(f"AI job {job['job_id']} failed after {job['attempts']} attempts: {e}")
+                await self._finish(job, {"status": "failed", "error": "Erreur lors de la génération"})
+                return
+            # Exponential backoff with jitter, so a rate limit is not hit again in lockstep
+            delay = self.backoff * 2 ** (job["attempts"] - 1) * random.uniform(0.5, 1.5)
+            self.counters["retried"] += 1
+            logger.warning(f"AI job {job['job_id']} attempt {job['attempts']} failed, retrying in {delay:.0f}s: {e}")
+            await self._db.ai_jobs.update_one(
+                {"job_id": job["job_id"]},
+                {"$set": {"status": "queued", "lease_until": None, "last_error": str(e),
+                          "available_at": _iso(_now() + timedelta(seconds=delay))}}
+            )
+        else:
+            self.counters["succeeded"] += 1
+            await self._finish(job, {**result, "status": "succeeded"})
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except PyMongoError as e:
+                logger.warning(f"AI job claim failed: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                continue
+            try:
+                await self._process(job)
+            except PyMongoError as e:
+                # The lease expires and the job is requeued
+                logger.warning(f"AI job {job['job_id']} could not be updated: {e}")
+
+    async def _reaper(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            try:
+                await self._requeue_expired()
+            except PyMongoError as e:
+                logger.warning(f"AI job requeue failed: {e}")
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+            self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def stats(self) -> Dict[str, Any]:
+        depth = {}
+        oldest = None
+        if self._db is not None:
+            try:
+                async for row in self._db.ai_jobs.aggregate([
+                    {"$match": {"status": "queued"}},
+                    {"$group": {"_id": "$plan", "n": {"$sum": 1}, "oldest": {"$min": "$created_at"}}}
+                ]):
+                    depth[row["_id"]] = row["n"]
+                    oldest = min(oldest or row["oldest"], row["oldest"])
+            except PyMongoError as e:
+                logger.warning(f"AI queue depth unavailable: {e}")
+        return {
+            **self.counters,
+            "workers": self.concurrency,
+            "running": any(not task.done() for task in self._tasks),
+            "queued": depth,
+            "oldest_queued_seconds": round((_now() - datetime.fromisoformat(oldest)).total_seconds(), 1)
+            if oldest else 0.0,
+            "wait": self.wait_time.stats(),
+            "run": self.run_time.stats()
+        }
+
+
+# Singleton instance
+generation_queue = GenerationQueue(
+    concurrency=int(os.environ.get('AI_JOBS_CONCURRENCY', 4)),
+    max_attempts=int(os.environ.get('AI_JOBS_MAX_ATTEMPTS', 3)),
+    backoff=float(os.environ.get('AI_JOBS_BACKOFF', 5)),
+    lease_seconds=int(os.environ.get('AI_JOBS_LEASE_SECONDS', 300)),
+    retention_days=int(os.environ.get('AI_JOBS_RETENTION_DAYS', 7)),
+    max_pending_per_user=int(os.environ.get('AI_JOBS_MAX_PENDING_PER_USER', 5))
+)
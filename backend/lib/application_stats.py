@@ -0,0 +1,149 @@
+"""
+Per-user application counters
+Keeps one counters document per user in db.application_stats, updated with
+$inc on every create, delete and status change, so /api/stats is a single
+indexed point read. The counters can always be rebuilt from db.applications.
+
+Counters missing on first read are backfilled from the raw collection. The
+backfill first upserts a placeholder, so increments landing meanwhile bump
+its version, and only stores its counts if the version did not move.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from pymongo import ReplaceOne, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+APPLICATION_STATUSES = ["todo", "applied", "interview", "offer", "rejected"]
+
+
+def _empty_counts() -> Dict[str, int]:
+    return {"total": 0, **{status: 0 for status in APPLICATION_STATUSES}}
+
+
+async def compute(db, user_id: str) -> Dict[str, int]:
+    """Count a user's applications by status with a $group aggregation"""
+    counts = _empty_counts()
+    pipeline = [
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$status", "n": {"$sum": 1}}}
+    ]
+    async for row in db.applications.aggregate(pipeline):
+        counts["total"] += row["n"]
+        if row["_id"] in APPLICATION_STATUSES:
+            counts[row["_id"]] = row["n"]
+    return counts
+
+
+async def get(db, user_id: str, attempts: int = 3) -> Dict[str, int]:
+    """
+    Return a user's counters, backfilling them from the raw collection the
+    first time they are requested
+    """
+    projection = {"_id": 0, "user_id": 0, "updated_at": 0}
+    doc = await db.application_stats.find_one({"user_id": user_id}, projection)
+    if doc is not None and not doc.get("backfill"):
+        return {key: doc.get(key, 0) for key in _empty_counts()}
+
+    counts = _empty_counts()
+    for _ in range(attempts):
+        # The placeholder exists before counting, so an increment landing
+        # during compute() bumps its version instead of being lost
+        doc = await db.application_stats.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": {**_empty_counts(), "backfill": True, "version": 0,
+                              "updated_at": datetime.now(timezone.utc).isoformat()}},
+            projection=projection,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if not doc.get("backfill"):
+            return {key: doc.get(key, 0) for key in _empty_counts()}
+        counts = await compute(db, user_id)
+        result = await db.application_stats.update_one(
+            {"user_id": user_id, "backfill": True, "version": doc.get("version", 0)},
+            {"$set": {**counts, "updated_at": datetime.now(timezone.utc).isoformat()}, "$unset": {"backfill": ""}}
+        )
+        if result.modified_count:
+            return counts
+    # Still racing with writes: these counts are exact as of compute(), the next read backfills again
+    return counts
+
+
+async def _increment(db, user_id: str, deltas: Dict[str, int]) -> None:
+    deltas = {key: value for key, value in deltas.items() if value}
+    if not deltas:
+        return
+    # No upsert: a user without counters gets them backfilled by get(); the
+    # version tells a backfill in progress that its count is already stale
+    await db.application_stats.update_one(
+        {"user_id": user_id},
+        {"$inc": {**deltas, "version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+
+
+async def record_created(db, user_id: str, status: Optional[str]) -> None:
+    deltas = {"total": 1}
+    if status in APPLICATION_STATUSES:
+        deltas[status] = 1
+    await _increment(db, user_id, deltas)
+
+
+async def record_deleted(db, user_id: str, status: Optional[str]) -> None:
+    deltas = {"total": -1}
+    if status in APPLICATION_STATUSES:
+        deltas[status] = -1
+    await _increment(db, user_id, deltas)
+
+
+async def record_status_change(db, user_id: str, old_status: Optional[str], new_status: Optional[str]) -> None:
+    if old_status == new_status:
+        return
+    deltas = {}
+    if old_status in APPLICATION_STATUSES:
+        deltas[old_status] = -1
+    if new_status in APPLICATION_STATUSES:
+        deltas[new_status] = 1
+    await _increment(db, user_id, deltas)
+
+
+async def rebuild(db, user_id: Optional[str] = None, batch_size: int = 1000) -> int:
+    """
+    Recompute counters from db.applications, for one user or for everyone
+
+    Returns:
+        Number of counters documents written
+    """
+    started_at = datetime.now(timezone.utc).isoformat()
+    match = {"user_id": user_id} if user_id else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"user_id": "$user_id", "status": "$status"}, "n": {"$sum": 1}}}
+    ]
+
+    per_user: Dict[str, Dict[str, int]] = {}
+    async for row in db.applications.aggregate(pipeline, allowDiskUse=True):
+        counts = per_user.setdefault(row["_id"]["user_id"], _empty_counts())
+        counts["total"] += row["n"]
+        status = row["_id"].get("status")
+        if status in APPLICATION_STATUSES:
+            counts[status] += row["n"]
+
+    if user_id and user_id not in per_user:
+        per_user[user_id] = _empty_counts()
+
+    ops = [
+        ReplaceOne({"user_id": uid}, {"user_id": uid, **counts, "updated_at": started_at}, upsert=True)
+        for uid, counts in per_user.items()
+    ]
+    for i in range(0, len(ops), batch_size):
+        await db.application_stats.bulk_write(ops[i:i + batch_size], ordered=False)
+
+    if not user_id:
+        # Users whose applications are all gone
+        await db.application_stats.delete_many({"updated_at": {"$lt": started_at}})
+
+    logger.info(f"Rebuilt application stats for {len(ops)} user(s)")
+    return len(ops)
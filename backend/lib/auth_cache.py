@@ -0,0 +1,63 @@
+"""
+Authentication cache
+Keeps decoded JWT claims and user documents in memory so that authenticated
+routes don't hit MongoDB on every request
+"""
+import hashlib
+import os
+import time
+from typing import Any, Dict, Optional
+
+from .cache import TTLCache
+
+
+class AuthCache:
+    """User document cache keyed by user_id plus decoded-token cache keyed by token hash"""
+
+    def __init__(self, user_maxsize: int = 10000, user_ttl: float = 30.0,
+                 token_maxsize: int = 10000, token_ttl: float = 300.0):
+        self.users = TTLCache(maxsize=user_maxsize, ttl=user_ttl)
+        self.tokens = TTLCache(maxsize=token_maxsize, ttl=token_ttl)
+
+    @staticmethod
+    def _token_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get_claims(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return previously decoded claims for this token, if still cached"""
+        return self.tokens.get(self._token_key(token))
+
+    def set_claims(self, token: str, claims: Dict[str, Any]) -> None:
+        """Cache decoded claims, never beyond the token's own expiry"""
+        ttl = self.tokens.ttl
+        exp = claims.get("exp")
+        if exp is not None:
+            ttl = min(ttl, float(exp) - time.time())
+        self.tokens.set(self._token_key(token), claims, ttl=ttl)
+
+    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        user = self.users.get(user_id)
+        # Hand out a copy so a route can't mutate the cached document
+        return dict(user) if user is not None else None
+
+    def set_user(self, user_id: str, user: Dict[str, Any]) -> None:
+        self.users.set(user_id, dict(user))
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop a cached user; call after every write to db.users"""
+        self.users.pop(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": self.users.stats(),
+            "tokens": self.tokens.stats()
+        }
+
+
+# Singleton instance
+auth_cache = AuthCache(
+    user_maxsize=int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000)),
+    user_ttl=float(os.environ.get('AUTH_USER_CACHE_TTL', 30)),
+    token_maxsize=int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 10000)),
+    token_ttl=float(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+)
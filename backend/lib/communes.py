@@ -0,0 +1,215 @@
+"""
+French commune reference index
+Resolves free-text locations ("Saint-Étienne", "st etienne", "33000",
+"Bordeaux (33)", "Gironde", "2A") to a department and, for communes, to
+coordinates. The reference data is bundled in data/communes.tsv.gz and loaded
+on first use into parallel sorted arrays searched with bisect; lookups are
+accent-, case-, hyphen- and apostrophe-insensitive, with prefix completion and
+a fuzzy fallback for typos.
+
+data/communes.tsv.gz: one commune per line, tab-separated
+    name, department code, latitude, longitude, population
+built from the GeoNames cities1000 extract (CC BY 4.0), i.e. every commune of
+about 1000 inhabitants or more. Postal codes resolve by rule for all others.
+"""
+import difflib
+import gzip
+import heapq
+import logging
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from .text import fold
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = Path(__file__).parent / "data" / "communes.tsv.gz"
+
+DEPARTMENTS = {
+    "01": "Ain", "02": "Aisne", "03": "Allier", "04": "Alpes-de-Haute-Provence", "05": "Hautes-Alpes",
+    "06": "Alpes-Maritimes", "07": "Ardèche", "08": "Ardennes", "09": "Ariège", "10": "Aube",
+    "11": "Aude", "12": "Aveyron", "13": "Bouches-du-Rhône", "14": "Calvados", "15": "Cantal",
+    "16": "Charente", "17": "Charente-Maritime", "18": "Cher", "19": "Corrèze", "2A": "Corse-du-Sud",
+    "2B": "Haute-Corse", "21": "Côte-d'Or", "22": "Côtes-d'Armor", "23": "Creuse", "24": "Dordogne",
+    "25": "Doubs", "26": "Drôme", "27": "Eure", "28": "Eure-et-Loir", "29": "Finistère",
+    "30": "Gard", "31": "Haute-Garonne", "32": "Gers", "33": "Gironde", "34": "Hérault",
+    "35": "Ille-et-Vilaine", "36": "Indre", "37": "Indre-et-Loire", "38": "Isère", "39": "Jura",
+    "40": "Landes", "41": "Loir-et-Cher", "42": "Loire", "43": "Haute-Loire", "44": "Loire-Atlantique",
+    "45": "Loiret", "46": "Lot", "47": "Lot-et-Garonne", "48": "Lozère", "49": "Maine-et-Loire",
+    "50": "Manche", "51": "Marne", "52": "Haute-Marne", "53": "Mayenne", "54": "Meurthe-et-Moselle",
+    "55": "Meuse", "56": "Morbihan", "57": "Moselle", "58": "Nièvre", "59": "Nord",
+    "60": "Oise", "61": "Orne", "62": "Pas-de-Calais", "63": "Puy-de-Dôme", "64": "Pyrénées-Atlantiques",
+    "65": "Hautes-Pyrénées", "66": "Pyrénées-Orientales", "67": "Bas-Rhin", "68": "Haut-Rhin", "69": "Rhône",
+    "70": "Haute-Saône", "71": "Saône-et-Loire", "72": "Sarthe", "73": "Savoie", "74": "Haute-Savoie",
+    "75": "Paris", "76": "Seine-Maritime", "77": "Seine-et-Marne", "78": "Yvelines", "79": "Deux-Sèvres",
+    "80": "Somme", "81": "Tarn", "82": "Tarn-et-Garonne", "83": "Var", "84": "Vaucluse",
+    "85": "Vendée", "86": "Vienne", "87": "Haute-Vienne", "88": "Vosges", "89": "Yonne",
+    "90": "Territoire de Belfort", "91": "Essonne", "92": "Hauts-de-Seine", "93": "Seine-Saint-Denis",
+    "94": "Val-de-Marne", "95": "Val-d'Oise", "971": "Guadeloupe", "972": "Martinique", "973": "Guyane",
+    "974": "La Réunion", "975": "Saint-Pierre-et-Miquelon", "976": "Mayotte",
+}
+
+_SEPARATORS = re.compile(r"[\s\-'’.,;/()]+")
+_ABBREVIATIONS = {"st": "saint", "ste": "sainte"}
+# Trailing words that do not name the commune: "Paris 15e", "Lyon 3eme arrondissement", "Cedex"
+_QUALIFIERS = re.compile(r"(?:\s+(?:\d+(?:e|er|eme)?|arrondissement|arr|cedex))+$")
+_POSTAL_CODE = re.compile(r"\b(\d{5})\b")
+_DEPARTMENT_CODE = re.compile(r"^(?:\d{2,3}|2[ab])$")
+
+
+class Commune(NamedTuple):
+    """A resolved location; name and coordinates are None for a bare department"""
+    name: Optional[str]
+    department: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    population: int = 0
+
+
+def commune_key(text: str) -> str:
+    """Lookup key: folded, separators collapsed, abbreviations expanded"""
+    words = _SEPARATORS.sub(" ", fold(text or "")).split()
+    return " ".join(_ABBREVIATIONS.get(word, word) for word in words)
+
+
+def department_from_postal_code(code: str) -> Optional[str]:
+    """Department of a 5-digit postal code (Corsica and overseas included)"""
+    if len(code) != 5 or not code.isdigit():
+        return None
+    if code.startswith("20"):
+        return "2A" if code < "20200" else "2B"
+    if code.startswith("97"):
+        return code[:3] if code[:3] in DEPARTMENTS else None
+    return code[:2] if code[:2] in DEPARTMENTS else None
+
+
+class CommuneIndex:
+    """Sorted-array index over the bundled commune reference"""
+
+    def __init__(self, path: Path = DATA_FILE):
+        self.path = path
+        self._keys: Optional[List[str]] = None
+        self._names: List[str] = []
+        self._departments = array("H")
+        self._latitudes = array("f")
+        self._longitudes = array("f")
+        self._populations = array("L")
+        self._department_codes = sorted(DEPARTMENTS)
+        self._department_keys = {commune_key(name): code for code, name in DEPARTMENTS.items()}
+
+    def _load(self) -> None:
+        rows = []
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    name, department, latitude, longitude, population = line.rstrip("\n").split("\t")
+                    rows.append((commune_key(name), name, department, float(latitude), float(longitude),
+                                 int(population)))
+        except OSError as e:
+            logger.error(f"Commune reference unavailable ({self.path}): {e}")
+        rows.sort()
+
+        codes = {code: i for i, code in enumerate(self._department_codes)}
+        self._names = [row[1] for row in rows]
+        self._departments = array("H", (codes[row[2]] for row in rows))
+        self._latitudes = array("f", (row[3] for row in rows))
+        self._longitudes = array("f", (row[4] for row in rows))
+        self._populations = array("L", (row[5] for row in rows))
+        self._keys = [row[0] for row in rows]
+        logger.info(f"Loaded {len(rows)} communes")
+
+    def _commune(self, i: int) -> Commune:
+        return Commune(self._names[i], self._department_codes[self._departments[i]],
+                       round(self._latitudes[i], 5), round(self._longitudes[i], 5), self._populations[i])
+
+    def _range(self, lo_key: str, hi_key: str) -> range:
+        if self._keys is None:
+            self._load()
+        return range(bisect_left(self._keys, lo_key), bisect_right(self._keys, hi_key))
+
+    def _best(self, rows: range, department: Optional[str] = None) -> Optional[Commune]:
+        """Most populous commune among rows, within department if given"""
+        best = None
+        for i in rows:
+            if department and self._department_codes[self._departments[i]] != department:
+                continue
+            if best is None or self._populations[i] > self._populations[best]:
+                best = i
+        return self._commune(best) if best is not None else None
+
+    def __len__(self) -> int:
+        if self._keys is None:
+            self._load()
+        return len(self._keys)
+
+    def lookup(self, name: str, department: Optional[str] = None) -> Optional[Commune]:
+        """Exact (normalized) name match, the most populous one if the name is shared"""
+        key = commune_key(name)
+        return self._best(self._range(key, key), department) if key else None
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Commune]:
+        """Communes whose normalized name starts with prefix, most populous first"""
+        key = commune_key(prefix)
+        if not key:
+            return []
+        rows = self._range(key, key + "\x7f")
+        return [self._commune(i) for i in heapq.nlargest(limit, rows, key=self._populations.__getitem__)]
+
+    def fuzzy(self, name: str, department: Optional[str] = None, cutoff: float = 0.85) -> Optional[Commune]:
+        """Closest name among those sharing the first two letters, for typos"""
+        key = commune_key(name)
+        if not key:
+            return None
+        rows = self._range(key[:2], key[:2] + "\x7f")
+        keys = self._keys[rows.start:rows.stop]
+        for match in difflib.get_close_matches(key, keys, n=3, cutoff=cutoff):
+            commune = self._best(self._range(match, match), department)
+            if commune:
+                return commune
+        return None
+
+    def resolve(self, location: str) -> Optional[Commune]:
+        """
+        Resolve a free-text location
+
+        Args:
+            location: Commune name, postal code, department code or name,
+                or a combination such as "Bordeaux 33000"
+
+        Returns:
+            The commune (or bare department) it designates, or None
+        """
+        return _resolve(self, (location or "").strip())
+
+
+@lru_cache(maxsize=4096)
+def _resolve(index: CommuneIndex, location: str) -> Optional[Commune]:
+    if not location:
+        return None
+
+    postal = _POSTAL_CODE.search(location)
+    department = department_from_postal_code(postal.group(1)) if postal else None
+    key = commune_key(_POSTAL_CODE.sub(" ", location))
+    key = _QUALIFIERS.sub("", key).strip()
+
+    if not department and _DEPARTMENT_CODE.match(key):
+        code = key.upper().zfill(2)
+        return Commune(None, code) if code in DEPARTMENTS else None
+    if key:
+        commune = index.lookup(key, department)
+        if commune:
+            return commune
+        if not department and key in index._department_keys:
+            return Commune(None, index._department_keys[key])
+        commune = index.fuzzy(key, department)
+        if commune:
+            return commune
+    return Commune(None, department) if department else None
+
+
+# Singleton instance
+communes = CommuneIndex()
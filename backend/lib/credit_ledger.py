@@ -0,0 +1,243 @@
+"""
+Credit ledger
+Credits are spent in two steps. A request first reserves them with a single
+conditional update that only matches while the balance covers the amount, so
+concurrent requests can never overspend. It then commits the reservation once
+the work succeeded, or releases it (credits given back) when it failed.
+
+Every movement (reservation, commit, release, refund, plan grant) is appended to
+db.credit_ledger, which is never updated in place. Ultra plans are unlimited
+and do not touch the ledger.
+"""
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from .auth_cache import auth_cache
+
+logger = logging.getLogger(__name__)
+
+UNLIMITED_PLANS = ("ultra",)
+
+
+class InsufficientCredits(Exception):
+    """The balance does not cover the reservation"""
+
+    def __init__(self, field: str, needed: int, balance: int):
+        super().__init__(f"{field}: {balance} < {needed}")
+        self.field = field
+        self.needed = needed
+        self.balance = balance
+
+
+class Reservation(NamedTuple):
+    reservation_id: str
+    user_id: str
+    field: str
+    amount: int
+    # Every balance moved, e.g. the per-type counter and the legacy ai_credits total
+    fields: Dict[str, int]
+    balance: int
+    unlimited: bool = False
+    # Id of the paid-for object, recorded on every entry of the reservation
+    ref: Optional[str] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+class CreditLedger:
+    """Atomic reservations against the credit balances on db.users"""
+
+    def __init__(self, stale_after: float = 3600):
+        self.stale_after = stale_after
+        self._db = None
+        self.counters = {"reserved": 0, "committed": 0, "released": 0, "rejected": 0, "granted": 0,
+                         "refunded": 0}
+
+    def configure(self, db) -> None:
+        self._db = db
+
+    async def _append(self, reservation_id: Optional[str], user_id: str, entry_type: str,
+                      deltas: Dict[str, int], reason: str, ref: Optional[str] = None,
+                      balance: Optional[int] = None, **extra: Any) -> None:
+        await self._db.credit_ledger.insert_one({
+            "entry_id": f"cl_{uuid.uuid4().hex[:16]}",
+            "reservation_id": reservation_id,
+            "user_id": user_id,
+            "type": entry_type,
+            "deltas": deltas,
+            "balance": balance,
+            "reason": reason,
+            "ref": ref,
+            "created_at": _iso(_now()),
+            **extra
+        })
+
+    async def reserve(self, user: Dict[str, Any], field: str, amount: int, reason: str,
+                      ref: Optional[str] = None, also: tuple = ()) -> Reservation:
+        """
+        Take `amount` credits from `field` if the balance covers them
+
+        Args:
+            user: User document (only user_id and subscription_plan are read)
+            field: Balance to draw from, e.g. "spontaneous_credits"
+            amount: Credits to reserve
+            reason: What the credits pay for, stored in the ledger
+            ref: Id of the paid-for object (application, batch...)
+            also: Balances decremented alongside, without a guard
+
+        Raises:
+            InsufficientCredits: if the balance is lower than `amount`
+        """
+        user_id = user["user_id"]
+        reservation_id = f"res_{uuid.uuid4().hex[:16]}"
+        if user.get("subscription_plan") in UNLIMITED_PLANS:
+            return Reservation(reservation_id, user_id, field, amount, {}, 0, unlimited=True, ref=ref)
+
+        fields = {name: amount for name in (field, *also)}
+        # The balance before the update: the one after may no longer match the filter
+        previous = await self._db.users.find_one_and_update(
+            {"user_id": user_id, field: {"$gte": amount}},
+            {"$inc": {name: -value for name, value in fields.items()}},
+            projection={"_id": 0, field: 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        if previous is None:
+            self.counters["rejected"] += 1
+            current = await self._db.users.find_one({"user_id": user_id}, {"_id": 0, field: 1})
+            raise InsufficientCredits(field, amount, (current or {}).get(field, 0))
+        auth_cache.invalidate_user(user_id)
+        self.counters["reserved"] += 1
+
+        reservation = Reservation(reservation_id, user_id, field, amount, fields, previous[field] - amount,
+                                  ref=ref)
+        await self._append(reservation_id, user_id, "reserve", {name: -value for name, value in fields.items()},
+                           reason, ref, balance=reservation.balance)
+        return reservation
+
+    async def commit(self, reservation: Reservation, used: Optional[int] = None, reason: str = "") -> int:
+        """
+        Settle a reservation, giving back the part that was not used
+
+        Args:
+            reservation: From reserve()
+            used: Credits actually spent, at most the reserved amount (all by default)
+
+        Returns:
+            The balance after settlement (0 for unlimited plans)
+        """
+        used = reservation.amount if used is None else max(0, min(used, reservation.amount))
+        if reservation.unlimited:
+            return 0
+        if used < reservation.amount:
+            balance = await self._give_back(reservation, reservation.amount - used, "release", reason)
+        else:
+            balance = reservation.balance
+        self.counters["committed"] += 1
+        await self._append(reservation.reservation_id, reservation.user_id, "commit", {}, reason,
+                           reservation.ref, balance=balance)
+        return balance
+
+    async def release(self, reservation: Reservation, reason: str = "") -> None:
+        """Give the whole reservation back (the paid-for work failed)"""
+        if reservation.unlimited:
+            return
+        await self._give_back(reservation, reservation.amount, "release", reason)
+
+    async def _give_back(self, reservation: Reservation, amount: int, entry_type: str, reason: str) -> int:
+        deltas = {name: amount for name in reservation.fields}
+        updated = await self._db.users.find_one_and_update(
+            {"user_id": reservation.user_id},
+            {"$inc": deltas},
+            projection={"_id": 0, reservation.field: 1},
+            return_document=ReturnDocument.AFTER
+        )
+        auth_cache.invalidate_user(reservation.user_id)
+        self.counters["released"] += 1
+        balance = (updated or {}).get(reservation.field, 0)
+        await self._append(reservation.reservation_id, reservation.user_id, entry_type, deltas, reason,
+                           reservation.ref, balance=balance)
+        return balance
+
+    async def refund(self, user_id: str, field: str, amount: int, reason: str, ref: Optional[str] = None) -> None:
+        """Give back credits committed for work that later failed (e.g. an undeliverable email)"""
+        await self._db.users.update_one({"user_id": user_id}, {"$inc": {field: amount}})
+        auth_cache.invalidate_user(user_id)
+        self.counters["refunded"] += 1
+        await self._append(None, user_id, "refund", {field: amount}, reason, ref)
+
+    async def grant(self, user_id: str, balances: Dict[str, int], reason: str, ref: Optional[str] = None,
+                    plan: Optional[str] = None) -> None:
+        """Reset balances to a plan's allowance (e.g. after a payment)"""
+        update = dict(balances)
+        if plan:
+            update["subscription_plan"] = plan
+        await self._db.users.update_one({"user_id": user_id}, {"$set": update})
+        auth_cache.invalidate_user(user_id)
+        self.counters["granted"] += 1
+        await self._append(None, user_id, "grant", {}, reason, ref, balances=balances)
+
+    async def _release_open(self, match: Dict[str, Any], reason: str, cutoff: Optional[str] = None) -> int:
+        """Release the reservations matching `match` that were neither committed nor released"""
+        open_reservations: List[Dict[str, Any]] = []
+        settled = {"types": ["reserve"]}
+        if cutoff:
+            settled["first.created_at"] = {"$lt": cutoff}
+        async for row in self._db.credit_ledger.aggregate([
+            {"$match": {"reservation_id": {"$ne": None}, **match}},
+            {"$sort": {"created_at": 1}},
+            {"$group": {"_id": "$reservation_id", "types": {"$push": "$type"}, "first": {"$first": "$$ROOT"}}},
+            {"$match": settled}
+        ]):
+            open_reservations.append(row["first"])
+
+        for entry in open_reservations:
+            fields = {name: -delta for name, delta in entry["deltas"].items()}
+            field = next(iter(fields))
+            reservation = Reservation(entry["reservation_id"], entry["user_id"], field, fields[field], fields,
+                                      entry.get("balance") or 0, ref=entry.get("ref"))
+            try:
+                await self._give_back(reservation, reservation.amount, "release", reason)
+            except PyMongoError as e:
+                logger.warning(f"Could not release reservation {reservation.reservation_id}: {e}")
+        return len(open_reservations)
+
+    async def release_stale(self) -> int:
+        """
+        Release reservations left open by a crashed worker
+
+        Returns:
+            Number of reservations released
+        """
+        now = _now()
+        cutoff = _iso(now - timedelta(seconds=self.stale_after))
+        horizon = _iso(now - timedelta(seconds=self.stale_after * 24))
+        return await self._release_open({"created_at": {"$gte": horizon}}, "stale reservation", cutoff=cutoff)
+
+    async def release_ref(self, ref: str, reason: str) -> int:
+        """
+        Release the open reservations paying for `ref`, e.g. a job abandoned
+        by a crashed worker, without waiting for them to go stale
+
+        Returns:
+            Number of reservations released
+        """
+        return await self._release_open({"ref": ref}, reason)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
+
+
+# Singleton instance
+credit_ledger = CreditLedger(stale_after=float(os.environ.get('CREDIT_RESERVATION_STALE_AFTER', 3600)))
@@ -1,63 +1,174 @@
 """
 France Travail OAuth2 Authentication
 Handles token management for France Travail APIs (Pôle Emploi)
+
+Refreshes are single-flight: concurrent callers wait on one in-flight token
+request. A background task renews the token before it expires, and the token
+can optionally be shared across uvicorn workers through MongoDB, with a lease
+so that only one worker talks to the token endpoint at a time.
 """
 import httpx
 import os
+import asyncio
+import socket
+import time
 from datetime import datetime, timedelta
 import logging
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from .http_clients import http_clients
 
 logger = logging.getLogger(__name__)
 
 
 class FranceTravailAuth:
     """OAuth2 client credentials flow for France Travail APIs"""
-    
+
     TOKEN_URL = "https://entreprise.francetravail.fr/connexion/oauth2/access_token?realm=/partenaire"
     SCOPES = "o2dsoffre api_offresdemploiv2"
-    
+    # Seconds shaved off expires_in as a safety margin
+    EXPIRY_MARGIN = 60
+    # Background task renews the token this many seconds before self.expiry
+    REFRESH_LEAD = 120
+    # How long a worker may hold the shared refresh lease
+    LEASE_SECONDS = 30
+    SHARED_TOKEN_ID = "francetravail"
+
     def __init__(self):
         self.client_id = os.getenv('FRANCETRAVAIL_CLIENT_ID')
         self.client_secret = os.getenv('FRANCETRAVAIL_CLIENT_SECRET')
         self.token = None
         self.expiry = None
-    
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._collection = None
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.refreshes = 0
+        self.shared_hits = 0
+
+    def configure(self, db=None, shared: bool = False) -> None:
+        """Share token state across workers through db.oauth_tokens when enabled"""
+        self._collection = db.oauth_tokens if (db is not None and shared) else None
+
+    def _is_valid(self, lead: float = 0) -> bool:
+        return bool(self.token and self.expiry and datetime.now() + timedelta(seconds=lead) < self.expiry)
+
+    def _adopt(self, token: str, expires_at: float) -> None:
+        self.token = token
+        self.expiry = datetime.fromtimestamp(expires_at)
+
     async def get_token(self) -> str:
         """Get a valid access token, refreshing if necessary"""
         # Return cached token if still valid
-        if self.token and self.expiry and datetime.now() < self.expiry:
+        if self._is_valid():
             return self.token
-        
+
         if not self.client_id or not self.client_secret:
             logger.warning("France Travail credentials not configured")
             raise ValueError("France Travail API credentials not configured")
-        
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.TOKEN_URL,
-                    data={
-                        "grant_type": "client_credentials",
-                        "client_id": self.client_id,
-                        "client_secret": self.client_secret,
-                        "scope": self.SCOPES
-                    },
-                    headers={"Content-Type": "application/x-www-form-urlencoded"}
-                )
-                
-                if response.status_code != 200:
-                    logger.error(f"France Travail OAuth error: {response.status_code} - {response.text}")
-                    raise Exception(f"OAuth failed: {response.status_code}")
-                
-                data = response.json()
-                self.token = data["access_token"]
-                # Set expiry 60 seconds before actual expiry for safety margin
-                expires_in = data.get("expires_in", 1500)
-                self.expiry = datetime.now() + timedelta(seconds=expires_in - 60)
-                
-                logger.info("France Travail token refreshed successfully")
+
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if self._is_valid():
                 return self.token
-                
+            await self._refresh()
+            return self.token
+
+    async def _refresh(self, lead: float = 0) -> None:
+        """
+        Obtain a new token, via the shared Mongo state when configured.
+        The caller holds the lock; a shared token is adopted only if it is
+        still valid `lead` seconds from now.
+        """
+        if self._collection is None:
+            await self._request_token()
+            return
+
+        try:
+            if await self._load_shared(lead):
+                return
+            if await self._acquire_lease():
+                try:
+                    await self._request_token()
+                finally:
+                    await self._store_shared()
+                return
+            # Another worker holds the lease: wait for it to publish a token
+            deadline = time.time() + self.LEASE_SECONDS
+            while time.time() < deadline:
+                await asyncio.sleep(0.5)
+                if await self._load_shared(lead):
+                    return
+        except PyMongoError as e:
+            logger.warning(f"Shared France Travail token unavailable, refreshing locally: {e}")
+
+        await self._request_token()
+
+    async def _load_shared(self, lead: float = 0) -> bool:
+        doc = await self._collection.find_one({"_id": self.SHARED_TOKEN_ID})
+        if doc and doc.get("access_token") and doc.get("expires_at", 0) > time.time() + lead:
+            self._adopt(doc["access_token"], doc["expires_at"])
+            self.shared_hits += 1
+            return True
+        return False
+
+    async def _acquire_lease(self) -> bool:
+        now = time.time()
+        try:
+            doc = await self._collection.find_one_and_update(
+                {"_id": self.SHARED_TOKEN_ID, "$or": [
+                    {"lease_until": {"$lt": now}},
+                    {"lease_until": None}
+                ]},
+                {"$set": {"lease_owner": self._worker_id, "lease_until": now + self.LEASE_SECONDS}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The document exists and its lease is held by another worker
+            return False
+        return bool(doc and doc.get("lease_owner") == self._worker_id)
+
+    async def _store_shared(self) -> None:
+        update = {"lease_until": None}
+        if self._is_valid():
+            update.update({"access_token": self.token, "expires_at": self.expiry.timestamp()})
+        await self._collection.update_one(
+            {"_id": self.SHARED_TOKEN_ID, "lease_owner": self._worker_id},
+            {"$set": update}
+        )
+
+    async def _request_token(self) -> None:
+        """Call the token endpoint and update the cached token"""
+        try:
+            client = http_clients.get("francetravail_oauth")
+            response = await client.post(
+                self.TOKEN_URL,
+                data={
+                    "grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "scope": self.SCOPES
+                },
+                headers={"Content-Type": "application/x-www-form-urlencoded"}
+            )
+
+            if response.status_code != 200:
+                logger.error(f"France Travail OAuth error: {response.status_code} - {response.text}")
+                raise Exception(f"OAuth failed: {response.status_code}")
+
+            data = response.json()
+            self.token = data["access_token"]
+            # Set expiry 60 seconds before actual expiry for safety margin
+            expires_in = data.get("expires_in", 1500)
+            self.expiry = datetime.now() + timedelta(seconds=expires_in - self.EXPIRY_MARGIN)
+            self.refreshes += 1
+
+            logger.info("France Travail token refreshed successfully")
+
         except httpx.HTTPError as e:
             logger.error(f"HTTP error during France Travail auth: {e}")
             raise
@@ -65,6 +176,52 @@ class FranceTravailAuth:
             logger.error(f"Error getting France Travail token: {e}")
             raise
 
+    async def _refresh_loop(self) -> None:
+        retry_delay = 5
+        while True:
+            if self.expiry:
+                wait = (self.expiry - datetime.now()).total_seconds() - self.REFRESH_LEAD
+                await asyncio.sleep(max(wait, 1))
+
+            try:
+                async with self._lock:
+                    if not self._is_valid(lead=self.REFRESH_LEAD):
+                        await self._refresh(lead=self.REFRESH_LEAD)
+                retry_delay = 5
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Background France Travail token refresh failed: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 300)
+
+    def start_background_refresh(self) -> None:
+        """Keep the token warm so no user request pays the token round trip"""
+        if not self.client_id or not self.client_secret:
+            logger.info("France Travail credentials not configured, background token refresh disabled")
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop_background_refresh(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    def stats(self) -> dict:
+        return {
+            "valid": self._is_valid(),
+            "expires_in_seconds": int((self.expiry - datetime.now()).total_seconds()) if self.expiry else None,
+            "refreshes": self.refreshes,
+            "shared": self._collection is not None,
+            "shared_hits": self.shared_hits,
+            "background_refresh": self._refresh_task is not None and not self._refresh_task.done()
+        }
+
 
 # Singleton instance
 auth = FranceTravailAuth()
@@ -0,0 +1,155 @@
+"""
+AI generation cache
+Content-addressed cache of generated CVs and cover letters, keyed by the
+SHA-256 of the exact system prompt, user prompt and model id. Regenerating
+for an unchanged application and profile returns the stored text instead of
+a new model call. Two tiers: an in-process LRU in front of a MongoDB
+collection whose entries expire by age (TTL index) and which is trimmed to a
+maximum size, least recently used first.
+"""
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import PyMongoError
+
+from .cache import SingleFlight, TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCache:
+    """Two-tier cache of generated texts"""
+
+    def __init__(self, memory_size: int = 500, ttl: float = 7 * 24 * 3600, max_entries: int = 50000,
+                 trim_every: int = 100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.trim_every = trim_every
+        self._memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self._flights = SingleFlight()
+        self._collection = None
+        self._writes = 0
+        self.counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "forced": 0, "coalesced": 0,
+                         "stored": 0, "trimmed": 0}
+
+    def configure(self, db=None) -> None:
+        """Enable the shared MongoDB tier (db.generation_cache)"""
+        self._collection = db.generation_cache if db is not None else None
+
+    @staticmethod
+    def key(system_prompt: str, user_prompt: str, model: str) -> str:
+        payload = json.dumps([system_prompt, user_prompt, model], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        content = self._memory.get(key)
+        if content is not None:
+            self.counters["memory_hits"] += 1
+            return content
+        if self._collection is None:
+            return None
+        now = datetime.now(timezone.utc)
+        try:
+            doc = await self._collection.find_one_and_update(
+                {"_id": key, "expires_at": {"$gt": now}},
+                {"$set": {"last_used_at": now}},
+                projection={"content": 1, "expires_at": 1}
+            )
+        except PyMongoError as e:
+            logger.warning(f"Generation cache read failed: {e}")
+            return None
+        if not doc:
+            return None
+        expires_at = doc["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        self._memory.set(key, doc["content"], ttl=(expires_at - now).total_seconds())
+        self.counters["mongo_hits"] += 1
+        return doc["content"]
+
+    async def set(self, key: str, content: str) -> None:
+        self._memory.set(key, content)
+        self.counters["stored"] += 1
+        if self._collection is None:
+            return
+        now = datetime.now(timezone.utc)
+        try:
+            await self._collection.replace_one(
+                {"_id": key},
+                {"content": content, "created_at": now, "last_used_at": now,
+                 "expires_at": now + timedelta(seconds=self.ttl)},
+                upsert=True
+            )
+            self._writes += 1
+            if self._writes % self.trim_every == 0:
+                await self._trim()
+        except PyMongoError as e:
+            logger.warning(f"Generation cache write failed: {e}")
+
+    async def _trim(self) -> None:
+        """Drop the least recently used entries beyond max_entries"""
+        excess = await self._collection.estimated_document_count() - self.max_entries
+        if excess <= 0:
+            return
+        cursor = self._collection.find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess)
+        ids = [doc["_id"] async for doc in cursor]
+        result = await self._collection.delete_many({"_id": {"$in": ids}})
+        self.counters["trimmed"] += result.deleted_count
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[str]],
+                              force: bool = False) -> Tuple[str, bool]:
+        """
+        Return the cached text for `key`, calling `generate` on a miss
+
+        Args:
+            key: Cache key from GenerationCache.key
+            generate: Coroutine factory calling the model; it must raise on
+                failure so that errors are never cached
+            force: Skip the lookup and regenerate, replacing the entry
+
+        Returns:
+            (content, cached). Callers sharing another caller's in-flight
+            generation also get cached=True: only one model call was paid.
+        """
+        if force:
+            self.counters["forced"] += 1
+        else:
+            content = await self.get(key)
+            if content is not None:
+                return content, True
+            self.counters["misses"] += 1
+
+        owner = not self._flights.in_flight(key)
+
+        async def generate_and_store() -> str:
+            content = await generate()
+            await self.set(key, content)
+            return content
+
+        content = await self._flights.run(key, generate_and_store)
+        if not owner:
+            self.counters["coalesced"] += 1
+        return content, not owner
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.counters["memory_hits"] + self.counters["mongo_hits"] + self.counters["coalesced"]
+        lookups = self.counters["memory_hits"] + self.counters["mongo_hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "model_calls_saved": hits,
+            "memory": self._memory.stats(),
+            "shared": self._collection is not None
+        }
+
+
+# Singleton instance
+generation_cache = GenerationCache(
+    memory_size=int(os.environ.get('GENERATION_CACHE_SIZE', 500)),
+    ttl=float(os.environ.get('GENERATION_CACHE_TTL', 7 * 24 * 3600)),
+    max_entries=int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', 50000))
+)
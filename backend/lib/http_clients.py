@@ -0,0 +1,130 @@
+"""
+Shared outbound HTTP clients
+One pooled httpx.AsyncClient per integration, created at application startup
+and closed on shutdown, so calls reuse keep-alive TCP/TLS connections
+"""
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Per-integration settings. Each integration talks to a single host, so the
+# pool limits below are effectively per-host limits.
+INTEGRATIONS: Dict[str, Dict[str, Any]] = {
+    "francetravail_oauth": {"timeout": 30.0, "connect_timeout": 5.0, "max_connections": 4},
+    "francetravail_offers": {"timeout": 15.0, "connect_timeout": 5.0, "max_connections": 20},
+    "labonneboite": {"timeout": 15.0, "connect_timeout": 5.0, "max_connections": 20},
+    "emergent_auth": {"timeout": 10.0, "connect_timeout": 5.0, "max_connections": 10},
+}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HttpClientRegistry:
+    """Application-scoped registry of pooled httpx clients"""
+
+    def __init__(self, integrations: Dict[str, Dict[str, Any]], http2: bool = False,
+                 keepalive_expiry: float = 30.0):
+        self.integrations = integrations
+        self.http2 = http2 and _http2_available()
+        if http2 and not self.http2:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed, using HTTP/1.1")
+        self.keepalive_expiry = keepalive_expiry
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        spec = self.integrations.get(name, {})
+        max_connections = int(spec.get("max_connections", 10))
+        counters = self._counters.setdefault(
+            name, {"requests": 0, "errors": 0, "total_ms": 0.0}
+        )
+
+        async def on_request(request: httpx.Request):
+            request.extensions["started_at"] = time.perf_counter()
+
+        async def on_response(response: httpx.Response):
+            started_at = response.request.extensions.get("started_at")
+            counters["requests"] += 1
+            if started_at is not None:
+                counters["total_ms"] += (time.perf_counter() - started_at) * 1000
+            if response.status_code >= 500:
+                counters["errors"] += 1
+
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(spec.get("timeout", 15.0), connect=spec.get("connect_timeout", 5.0)),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            http2=self.http2,
+            event_hooks={"request": [on_request], "response": [on_response]}
+        )
+
+    async def start(self) -> None:
+        """Create every registered client; called from the FastAPI lifespan hook"""
+        for name in self.integrations:
+            self.get(name)
+        logger.info(f"HTTP client registry started ({len(self._clients)} clients, http2={self.http2})")
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the shared client for an integration, creating it on first use"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(name)
+            self._clients[name] = client
+        return client
+
+    async def close(self) -> None:
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    @staticmethod
+    def _pool_stats(client: httpx.AsyncClient) -> Optional[Dict[str, int]]:
+        # httpcore keeps its connection pool on the transport; not a public API
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        return {
+            "connections": len(connections),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "active": sum(1 for c in connections if not c.is_idle() and not c.is_closed())
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for name, spec in self.integrations.items():
+            counters = self._counters.get(name, {"requests": 0, "errors": 0, "total_ms": 0.0})
+            client = self._clients.get(name)
+            requests = counters["requests"]
+            result[name] = {
+                "open": client is not None and not client.is_closed,
+                "requests": requests,
+                "errors": counters["errors"],
+                "avg_ms": round(counters["total_ms"] / requests, 2) if requests else 0.0,
+                "timeout_seconds": spec.get("timeout"),
+                "max_connections": spec.get("max_connections"),
+                "pool": self._pool_stats(client) if client is not None else None
+            }
+        return {"http2": self.http2, "clients": result}
+
+
+# Singleton instance
+http_clients = HttpClientRegistry(
+    INTEGRATIONS,
+    http2=os.environ.get('HTTP2_ENABLED', 'false').lower() == 'true',
+    keepalive_expiry=float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', 30))
+)
@@ -0,0 +1,287 @@
+"""
+MongoDB index management
+Declarative index spec applied at startup, plus a verification pass that runs
+explain() on every route's query shape and rejects collection scans
+"""
+import logging
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# collection -> indexes. `unique` is set wherever the code assumes uniqueness.
+INDEX_SPECS: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "applications": [
+        {"keys": [("application_id", ASCENDING)], "unique": True},
+        # Keyset pagination order for GET /applications, optionally filtered by status
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING), ("application_id", DESCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING),
+                  ("application_id", DESCENDING)]},
+    ],
+    "profiles": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "payment_transactions": [
+        {"keys": [("session_id", ASCENDING)], "unique": True},
+    ],
+    "application_stats": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "timeline_rollups": [
+        {"keys": [("user_id", ASCENDING), ("date", ASCENDING)], "unique": True},
+    ],
+    "timeline_rollup_state": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "offer_cache": [
+        # Entries are dropped by MongoDB once their stale window has passed
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "spontaneous_applications": [
+        # One application per company: re-sending is reported as a duplicate, not charged
+        {"keys": [("user_id", ASCENDING), ("company_id", ASCENDING)], "unique": True},
+        # Delivery worker: due queued rows oldest first, its claimed batch, expired leases
+        {"keys": [("status", ASCENDING), ("available_at", ASCENDING)]},
+        {"keys": [("claim_id", ASCENDING)], "sparse": True},
+        {"keys": [("status", ASCENDING), ("lease_until", ASCENDING)]},
+    ],
+    "companies": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "recommendations": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+        # Recommendation engine: dirty feeds first, then stale feeds of active users
+        {"keys": [("dirty", ASCENDING)]},
+        {"keys": [("computed_at", ASCENDING), ("last_read_at", ASCENDING)]},
+    ],
+    "offers": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        # Offer harvester: index sync and expiry of offers no longer returned
+        {"keys": [("last_seen_at", DESCENDING)]},
+    ],
+    "generation_cache": [
+        # Age-based expiry; the size cap trims least recently used entries first
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+        {"keys": [("last_used_at", ASCENDING)]},
+    ],
+    "ai_jobs": [
+        {"keys": [("job_id", ASCENDING)], "unique": True},
+        # Generation queue claim: due queued jobs by plan priority, oldest first
+        {"keys": [("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING),
+                  ("available_at", ASCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("status", ASCENDING)]},
+        # One pending job per content: concurrent enqueues of the same generation collapse
+        {"keys": [("user_id", ASCENDING), ("application_id", ASCENDING), ("generation_type", ASCENDING)],
+         "unique": True, "partialFilterExpression": {"pending": True}},
+        {"keys": [("status", ASCENDING), ("lease_until", ASCENDING)]},
+        # Finished jobs are dropped after their retention period
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "credit_ledger": [
+        {"keys": [("entry_id", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING)]},
+        # Stale reservation sweep
+        {"keys": [("created_at", ASCENDING)]},
+        # Reservations of an abandoned AI job
+        {"keys": [("ref", ASCENDING)]},
+    ],
+    "harvest_runs": [
+        {"keys": [("run_id", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING), ("started_at", DESCENDING)]},
+        {"keys": [("started_at", DESCENDING)]},
+    ],
+}
+
+# Query shapes issued by the routes in server.py; sample values only matter
+# for their type.
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    {"route": "POST /auth/register, /auth/login", "collection": "users",
+     "filter": {"email": "user@example.com"}},
+    {"route": "get_current_user", "collection": "users",
+     "filter": {"user_id": "user_x"}},
+    {"route": "GET /applications", "collection": "applications",
+     "filter": {"user_id": "user_x", "$or": [
+         {"created_at": {"$lt": "2025-01-01T00:00:00+00:00"}},
+         {"created_at": "2025-01-01T00:00:00+00:00", "application_id": {"$lt": "app_x"}}
+     ]},
+     "sort": [("created_at", DESCENDING), ("application_id", DESCENDING)]},
+    {"route": "GET /applications?status=", "collection": "applications",
+     "filter": {"user_id": "user_x", "status": {"$in": ["todo", "applied"]}},
+     "sort": [("created_at", DESCENDING), ("application_id", DESCENDING)]},
+    {"route": "GET|PUT|DELETE /applications/{id}", "collection": "applications",
+     "filter": {"application_id": "app_x", "user_id": "user_x"}},
+    {"route": "GET|POST /profile", "collection": "profiles",
+     "filter": {"user_id": "user_x"}},
+    {"route": "GET /payments/status/{session_id}", "collection": "payment_transactions",
+     "filter": {"session_id": "cs_x"}},
+    {"route": "GET /stats", "collection": "application_stats",
+     "filter": {"user_id": "user_x"}},
+    {"route": "GET /stats (backfill)", "collection": "applications",
+     "pipeline": [{"$match": {"user_id": "user_x"}}, {"$group": {"_id": "$status", "n": {"$sum": 1}}}]},
+    {"route": "GET /stats/timeline (closed days)", "collection": "timeline_rollups",
+     "pipeline": [{"$match": {"user_id": "user_x", "date": {"$gte": "2025-01-01", "$lte": "2025-03-31"}}},
+                  {"$group": {"_id": "$day", "todo": {"$sum": "$todo"}}}]},
+    {"route": "GET /stats/timeline (rollup placeholders)", "collection": "timeline_rollups",
+     "filter": {"user_id": "user_x", "backfill": True}},
+    {"route": "GET /stats/timeline (first application)", "collection": "applications",
+     "filter": {"user_id": "user_x"}, "sort": [("created_at", ASCENDING)]},
+    {"route": "GET /stats/timeline (today)", "collection": "applications",
+     "pipeline": [{"$match": {"user_id": "user_x", "created_at": {"$gte": "2025-03-31"}}},
+                  {"$group": {"_id": "$status", "n": {"$sum": 1}}}]},
+    {"route": "POST /spontaneous/send", "collection": "spontaneous_applications",
+     "filter": {"user_id": "user_x", "company_id": {"$in": ["company_x", "company_y"]}}},
+    {"route": "GET /recommendations", "collection": "recommendations",
+     "filter": {"user_id": "user_x"}},
+    {"route": "recommendation engine (claim)", "collection": "recommendations",
+     "filter": {"$or": [
+         {"dirty": True},
+         {"computed_at": {"$lt": "2025-01-01T00:00:00+00:00"},
+          "last_read_at": {"$gte": "2024-12-18T00:00:00+00:00"}}
+     ]},
+     "sort": [("dirty", DESCENDING), ("computed_at", ASCENDING)]},
+    {"route": "POST /ai/jobs", "collection": "ai_jobs",
+     "filter": {"user_id": "user_x", "status": {"$in": ["queued", "running"]}}},
+    {"route": "GET /ai/jobs/{id}", "collection": "ai_jobs",
+     "filter": {"job_id": "job_x", "user_id": "user_x"}},
+    {"route": "generation queue (claim)", "collection": "ai_jobs",
+     "filter": {"status": "queued", "available_at": {"$lte": "2025-01-01T00:00:00+00:00"}},
+     "sort": [("priority", DESCENDING), ("created_at", ASCENDING)]},
+    {"route": "generation queue (expired leases)", "collection": "ai_jobs",
+     "filter": {"status": "running", "lease_until": {"$lt": "2025-01-01T00:00:00+00:00"}}},
+    {"route": "credit ledger (reserve, release)", "collection": "users",
+     "filter": {"user_id": "user_x", "ai_cv_credits": {"$gte": 1}}},
+    {"route": "credit ledger (stale reservations)", "collection": "credit_ledger",
+     "pipeline": [{"$match": {"reservation_id": {"$ne": None}, "created_at": {"$gte": "2025-01-01T00:00:00+00:00"}}},
+                  {"$sort": {"created_at": 1}},
+                  {"$group": {"_id": "$reservation_id", "types": {"$push": "$type"}}}]},
+    {"route": "generation queue (abandoned job credits)", "collection": "credit_ledger",
+     "pipeline": [{"$match": {"reservation_id": {"$ne": None}, "ref": "job_x"}},
+                  {"$sort": {"created_at": 1}},
+                  {"$group": {"_id": "$reservation_id", "types": {"$push": "$type"}}}]},
+    {"route": "spontaneous delivery (claim)", "collection": "spontaneous_applications",
+     "filter": {"status": "queued", "available_at": {"$lte": "2025-01-01T00:00:00+00:00"}},
+     "sort": [("available_at", ASCENDING)]},
+    {"route": "spontaneous delivery (claimed batch)", "collection": "spontaneous_applications",
+     "filter": {"claim_id": "claim_x"}},
+    {"route": "spontaneous delivery (expired leases)", "collection": "spontaneous_applications",
+     "filter": {"status": "sending", "lease_until": {"$lt": "2025-01-01T00:00:00+00:00"}}},
+    {"route": "spontaneous delivery (companies)", "collection": "companies",
+     "filter": {"id": {"$in": ["company_x", "company_y"]}}},
+    {"route": "GET /offers/{id}", "collection": "offers",
+     "filter": {"id": "offer_x"}},
+    {"route": "offer harvester (index sync, expiry)", "collection": "offers",
+     "filter": {"last_seen_at": {"$gte": "2025-01-01T00:00:00+00:00"}},
+     "sort": [("last_seen_at", DESCENDING)]},
+    {"route": "offer harvester (last run)", "collection": "harvest_runs",
+     "filter": {"status": "completed"},
+     "sort": [("started_at", DESCENDING)]},
+]
+
+
+class IndexVerificationError(Exception):
+    """Raised when a route's query shape is not served by an index"""
+
+
+def _index_name(keys) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def _models(specs: List[Dict[str, Any]]) -> List[IndexModel]:
+    models = []
+    for spec in specs:
+        options = {k: v for k, v in spec.items() if k != "keys"}
+        options.setdefault("name", _index_name(spec["keys"]))
+        models.append(IndexModel(spec["keys"], **options))
+    return models
+
+
+async def ensure_indexes(db) -> Dict[str, List[str]]:
+    """
+    Create every index in INDEX_SPECS (a no-op for indexes that already exist)
+
+    Indexes are created one by one so that a failure, e.g. duplicate data
+    under a unique constraint, is logged without blocking the others.
+
+    Returns:
+        Dict of collection -> names of indexes that failed to build
+    """
+    failed: Dict[str, List[str]] = {}
+    for collection, specs in INDEX_SPECS.items():
+        for model in _models(specs):
+            try:
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                name = model.document["name"]
+                logger.error(f"Could not create index {collection}.{name}: {e}")
+                failed.setdefault(collection, []).append(name)
+    logger.info("MongoDB indexes ensured" + (f" ({sum(map(len, failed.values()))} failed)" if failed else ""))
+    return failed
+
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Flatten the stage names of an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key, value in plan.items():
+            if key in ("inputStage", "queryPlan", "winningPlan"):
+                stages.extend(_plan_stages(value))
+            elif key in ("inputStages", "stages"):
+                for child in value:
+                    stages.extend(_plan_stages(child))
+            elif key == "$cursor":
+                stages.extend(_plan_stages(value.get("queryPlanner", {}).get("winningPlan", {})))
+    return stages
+
+
+async def explain_shape(db, shape: Dict[str, Any]) -> List[str]:
+    """Return the winning plan stages for one query shape"""
+    collection = db[shape["collection"]]
+    if "pipeline" in shape:
+        result = await db.command(
+            "explain",
+            {"aggregate": shape["collection"], "pipeline": shape["pipeline"], "cursor": {}},
+            verbosity="queryPlanner"
+        )
+        if "queryPlanner" in result:
+            return _plan_stages(result["queryPlanner"].get("winningPlan", {}))
+        # Multi-stage pipelines report the pushed-down query under stages[0].$cursor
+        return _plan_stages(result)
+
+    cursor = collection.find(shape["filter"])
+    if shape.get("sort"):
+        cursor = cursor.sort(shape["sort"])
+    result = await cursor.explain()
+    return _plan_stages(result.get("queryPlanner", {}).get("winningPlan", {}))
+
+
+async def verify_query_plans(db) -> List[Dict[str, Any]]:
+    """
+    Explain every registered query shape and fail on collection scans
+
+    Returns:
+        One report entry per shape (route, collection, stages)
+
+    Raises:
+        IndexVerificationError: if any shape's winning plan contains COLLSCAN
+    """
+    report = []
+    offenders = []
+    for shape in QUERY_SHAPES:
+        stages = await explain_shape(db, shape)
+        report.append({"route": shape["route"], "collection": shape["collection"], "stages": stages})
+        if "COLLSCAN" in stages:
+            offenders.append(f"{shape['route']} ({shape['collection']})")
+        elif "SORT" in stages:
+            logger.warning(f"In-memory sort for {shape['route']} on {shape['collection']}")
+
+    if offenders:
+        raise IndexVerificationError("COLLSCAN in query plan for: " + ", ".join(offenders))
+    return report
@@ -2,19 +2,256 @@
 Jobs API Integration via France Travail
 Fetch real job offers from France Travail (Pôle Emploi) API
 """
-import httpx
+import asyncio
 import logging
-from typing import List, Dict, Any
+import re
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+from .communes import communes
+from .skill_matcher import get_matcher
 
 logger = logging.getLogger(__name__)
 
 # France Travail Offers API
 FRANCETRAVAIL_OFFERS_URL = "https://api.francetravail.io/partenaire/offresdemploi/v2/offres/search"
 
+# The API serves at most 150 offers per request, and no index past 3149
+RANGE_SIZE_MAX = 150
+RANGE_INDEX_MAX = 3149
+PAGE_CONCURRENCY = 3
+
+# "offres 0-149/1234"
+_CONTENT_RANGE = re.compile(r"(\d+)-(\d+)/(\d+)")
+
+
+CONTRACT_LABELS = {
+    "CDI": "CDI",
+    "CDD": "CDD",
+    "MIS": "Intérim",
+    "SAI": "Saisonnier",
+    "LIB": "Libéral",
+    "REP": "Franchise",
+    "DIN": "CDI Intérimaire"
+}
+
+
+def resolve_department(location: str) -> Optional[str]:
+    """
+    Department code for a commune, postal code, department code or name
+    
+    Returns:
+        The department code, or None when the location is unknown (the
+        search then covers all of France rather than silently Paris)
+    """
+    commune = communes.resolve(location)
+    if commune is None:
+        logger.info(f"Unknown location {location!r}, searching nationwide")
+        return None
+    return commune.department
+
+
+def normalize_offer(job: Dict[str, Any], location: str, description_limit: Optional[int] = 500) -> Dict[str, Any]:
+    """Map a France Travail offer to the format served to the frontend"""
+    # Extract company info
+    entreprise = job.get("entreprise", {})
+    company_name = entreprise.get("nom", "Entreprise confidentielle")
+    
+    # Extract location info
+    lieu = job.get("lieuTravail", {})
+    job_location = lieu.get("libelle", location)
+    
+    # Extract salary info
+    salaire = job.get("salaire", {})
+    salary_text = ""
+    if salaire:
+        libelle = salaire.get("libelle", "")
+        if libelle:
+            salary_text = libelle
+    
+    # Extract contract type
+    type_contrat = job.get("typeContrat", "")
+    type_label = CONTRACT_LABELS.get(type_contrat, type_contrat)
+    
+    description = job.get("description") or ""
+    if description_limit is not None:
+        description = description[:description_limit]
+    
+    return {
+        "title": job.get("intitule", ""),
+        "company": company_name,
+        "location": job_location,
+        "url": f"https://candidat.francetravail.fr/offres/recherche/detail/{job.get('id', '')}",
+        "source": "France Travail",
+        "description": description,
+        "salary": salary_text,
+        "type": type_label,
+        "experience": job.get("experienceLibelle", ""),
+        "published_at": job.get("dateCreation", ""),
+        "rome_code": job.get("romeCode", ""),
+        "id": job.get("id", "")
+    }
+
+
+async def _request_range(keywords: Optional[str], department: Optional[str], start: int, end: int,
+                         rome: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    Fetch one range of raw offers
+    
+    Returns:
+        The raw results and the total number of matches from Content-Range
+        (None if the header is missing)
+    
+    Raises:
+        Exception: on authentication failure or a non-success status
+    """
+    from .francetravail_oauth import auth
+    from .http_clients import http_clients
+    
+    token = await auth.get_token()
+    
+    params = {"range": f"{start}-{end}"}
+    if keywords:
+        params["motsCles"] = keywords
+    if department:
+        params["departement"] = department
+    if rome:
+        params["codeROME"] = rome
+    
+    client = http_clients.get("francetravail_offers")
+    response = await client.get(
+        FRANCETRAVAIL_OFFERS_URL,
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json"
+        },
+        params=params
+    )
+    
+    # 204 means no match at all
+    if response.status_code == 204:
+        return [], 0
+    # 200 or 206 (partial content) are both success
+    if response.status_code not in [200, 206]:
+        raise Exception(f"Offers API returned {response.status_code}")
+    
+    match = _CONTENT_RANGE.search(response.headers.get("Content-Range", ""))
+    total = int(match.group(3)) if match else None
+    return response.json().get("resultats", []), total
+
+
+async def search_offers(keywords: str, department: Optional[str], location: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Query the France Travail offers API directly (no cache, no fallback)
+    
+    Raises:
+        Exception: on authentication failure or a non-success status, so
+            that failures are never cached
+    """
+    results, _ = await _request_range(keywords, department, 0, limit - 1)
+    offers = [normalize_offer(job, location) for job in results]
+    
+    logger.info(f"Found {len(offers)} job offers from France Travail")
+    return offers
+
+
+async def iter_offers(keywords: Optional[str], department: Optional[str], location: str, max_results: int = 450,
+                      concurrency: int = PAGE_CONCURRENCY, rome: Optional[str] = None,
+                      description_limit: Optional[int] = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Page through every match of a search, yielding pages as they arrive
+    
+    The first range gives the total from Content-Range; the remaining ranges
+    (at most RANGE_SIZE_MAX offers each) are then requested concurrently,
+    under a semaphore, and yielded in completion order. Offers are
+    deduplicated by id across pages.
+    
+    Args:
+        keywords: Search keywords
+        department: Department code, or None to search all of France
+        location: Location label used when an offer has none
+        max_results: Stop after this many matches
+        concurrency: Maximum number of ranges in flight
+        rome: Only offers of this ROME code
+        description_limit: Truncate descriptions (None keeps them whole)
+    
+    Yields:
+        Lists of normalized offers, never empty
+    
+    Raises:
+        Exception: if the first range fails; later failed ranges are
+            logged and skipped
+    """
+    page_size = min(RANGE_SIZE_MAX, max_results)
+    results, total = await _request_range(keywords, department, 0, page_size - 1, rome)
+    seen = set()
+    
+    def fresh(raw: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        page = []
+        for job in raw:
+            offer_id = job.get("id")
+            if offer_id in seen:
+                continue
+            seen.add(offer_id)
+            page.append(normalize_offer(job, location, description_limit))
+        return page
+    
+    first = fresh(results)
+    if first:
+        yield first
+    
+    last = min(total if total is not None else len(results), max_results, RANGE_INDEX_MAX + 1) - 1
+    ranges = [(start, min(start + page_size - 1, last)) for start in range(page_size, last + 1, page_size)]
+    if not ranges:
+        return
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def fetch(start: int, end: int) -> List[Dict[str, Any]]:
+        async with semaphore:
+            try:
+                page, _ = await _request_range(keywords, department, start, end, rome)
+                return page
+            except Exception as e:
+                logger.warning(f"France Travail range {start}-{end} failed: {e}")
+                return []
+    
+    tasks = [asyncio.create_task(fetch(start, end)) for start, end in ranges]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            page = fresh(await completed)
+            if page:
+                yield page
+    finally:
+        # The consumer may stop early; do not leave requests running
+        for task in tasks:
+            task.cancel()
+    
+    logger.info(f"Paged {len(seen)} of {total} job offers from France Travail")
+
+
+async def cached_search(keywords: str, location: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Fetch job offers from France Travail API, through the shared offer cache
+    
+    Raises:
+        Exception: if the API fails and the search is not cached (no mock data)
+    """
+    from .offer_cache import offer_cache
+    from .ranking import offer_index
+    
+    department = resolve_department(location)
+    offers = await offer_cache.get_or_fetch(
+        offer_cache.key(keywords, department, limit),
+        lambda: search_offers(keywords, department, location, limit)
+    )
+    # Feed the local ranking index; already indexed offers only get their age refreshed
+    offer_index.add(offers, department)
+    return offers
+
 
 async def fetch_francetravail(keywords: str, location: str, limit: int = 20) -> List[Dict[str, Any]]:
     """
-    Fetch job offers from France Travail API
+    Fetch job offers from France Travail API, through the shared offer cache
     
     Args:
         keywords: Search keywords (job title, skills)
@@ -22,112 +259,10 @@ async def fetch_francetravail(keywords: str, location: str, limit: int = 20) ->
         limit: Max number of results
     
     Returns:
-        List of job offers
+        List of job offers, or mock offers when the API is unavailable
     """
     try:
-        from .francetravail_oauth import auth
-        
-        token = await auth.get_token()
-        
-        # Map common city names to department codes
-        dept_mapping = {
-            "paris": "75",
-            "lyon": "69",
-            "marseille": "13",
-            "toulouse": "31",
-            "nice": "06",
-            "nantes": "44",
-            "strasbourg": "67",
-            "montpellier": "34",
-            "bordeaux": "33",
-            "lille": "59",
-            "rennes": "35",
-            "reims": "51",
-            "saint-etienne": "42",
-            "le havre": "76",
-            "toulon": "83"
-        }
-        
-        # Determine department from location
-        location_lower = location.lower().strip()
-        department = dept_mapping.get(location_lower)
-        
-        # If not found in mapping, check if it's already a department code
-        if not department:
-            if location.isdigit() and len(location) <= 3:
-                department = location.zfill(2)
-            else:
-                department = "75"  # Default to Paris
-        
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                FRANCETRAVAIL_OFFERS_URL,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Accept": "application/json"
-                },
-                params={
-                    "motsCles": keywords,
-                    "departement": department,
-                    "range": f"0-{limit-1}"
-                }
-            )
-            
-            # 200 or 206 (partial content) are both success
-            if response.status_code in [200, 206]:
-                data = response.json()
-                results = data.get("resultats", [])
-                
-                offers = []
-                for job in results:
-                    # Extract company info
-                    entreprise = job.get("entreprise", {})
-                    company_name = entreprise.get("nom", "Entreprise confidentielle")
-                    
-                    # Extract location info
-                    lieu = job.get("lieuTravail", {})
-                    job_location = lieu.get("libelle", location)
-                    
-                    # Extract salary info
-                    salaire = job.get("salaire", {})
-                    salary_text = ""
-                    if salaire:
-                        libelle = salaire.get("libelle", "")
-                        if libelle:
-                            salary_text = libelle
-                    
-                    # Extract contract type
-                    type_contrat = job.get("typeContrat", "")
-                    type_label = {
-                        "CDI": "CDI",
-                        "CDD": "CDD",
-                        "MIS": "Intérim",
-                        "SAI": "Saisonnier",
-                        "LIB": "Libéral",
-                        "REP": "Franchise",
-                        "DIN": "CDI Intérimaire"
-                    }.get(type_contrat, type_contrat)
-                    
-                    offers.append({
-                        "title": job.get("intitule", ""),
-                        "company": company_name,
-                        "location": job_location,
-                        "url": f"https://candidat.francetravail.fr/offres/recherche/detail/{job.get('id', '')}",
-                        "source": "France Travail",
-                        "description": job.get("description", "")[:500] if job.get("description") else "",
-                        "salary": salary_text,
-                        "type": type_label,
-                        "experience": job.get("experienceLibelle", ""),
-                        "published_at": job.get("dateCreation", ""),
-                        "id": job.get("id", "")
-                    })
-                
-                logger.info(f"Found {len(offers)} job offers from France Travail")
-                return offers
-            else:
-                logger.warning(f"France Travail Offers API error: {response.status_code}")
-                return get_mock_jobs(keywords, location)
-                
+        return await cached_search(keywords, location, limit)
     except Exception as e:
         logger.error(f"France Travail Offers API error: {e}")
         return get_mock_jobs(keywords, location)
@@ -152,14 +287,8 @@ def match_score(skills: List[str], description: str) -> int:
     if not skills or not description:
         return 50
     
-    description_lower = description.lower()
-    matches = sum(1 for skill in skills if skill.lower() in description_lower)
-    
-    if len(skills) == 0:
-        return 50
-    
-    score = int((matches / len(skills)) * 100)
-    return min(max(score, 10), 100)  # Minimum 10%, max 100%
+    # Accent-insensitive, word-bounded, synonym-aware; compiled once per skill list
+    return get_matcher(skills).score(description)
 
 
 def get_mock_jobs(keywords: str, location: str) -> List[Dict[str, Any]]:
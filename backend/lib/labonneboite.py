@@ -2,9 +2,14 @@
 La Bonne Boîte API Integration via France Travail
 Search for companies open to spontaneous applications
 """
-import httpx
 import logging
-from typing import List, Dict, Any
+import os
+from typing import Dict, Any, Optional
+
+from .cache import SingleFlight, TTLCache
+from .communes import Commune, communes
+from .metrics import LatencyStats
+from .text import normalize_key
 
 logger = logging.getLogger(__name__)
 
@@ -12,10 +17,138 @@ logger = logging.getLogger(__name__)
 LABONNEBOITE_API_URL = "https://api.francetravail.io/partenaire/labonneboite/v1/company/"
 
 
+# Upstream searches are made at one of these radii (km) and cached; smaller
+# requests are answered by filtering a larger cached result on distance when
+# that cannot drop companies (see _covers), else searched at their own radius.
+RADIUS_BUCKETS = (5, 10, 30, 50, 100)
+# Companies requested per upstream call, so that filtered buckets stay full
+FETCH_COUNT = 100
+# Companies returned per search, as before caching
+RESULT_COUNT = 20
+
+# La Bonne Boîte scores are recomputed periodically, not in real time
+_cache = TTLCache(
+    maxsize=int(os.environ.get('LABONNEBOITE_CACHE_SIZE', 5000)),
+    ttl=float(os.environ.get('LABONNEBOITE_CACHE_TTL', 24 * 3600))
+)
+_flights = SingleFlight()
+_counters = {"hits": 0, "misses": 0, "filtered_hits": 0}
+_upstream = LatencyStats()
+
+
+def radius_bucket(radius: int) -> int:
+    """Smallest cached radius covering the requested one"""
+    for bucket in RADIUS_BUCKETS:
+        if radius <= bucket:
+            return bucket
+    return radius
+
+
+def _covers(result: Dict[str, Any], radius: int) -> bool:
+    """
+    Whether filtering a cached result on `radius` gives the same page as a
+    search at that radius. The result holds at most FETCH_COUNT companies
+    sorted by score, not distance, so once capped nearby companies may be
+    missing from it unless it still yields a full page within the radius.
+    """
+    companies = result["companies"]
+    return (len(companies) < FETCH_COUNT
+            or sum(1 for c in companies if c.get("distance", 0) <= radius) >= RESULT_COUNT)
+
+
+def _cached_covering(commune: str, rome: str, radius: int) -> Optional[Dict[str, Any]]:
+    """Cached result for the exact radius, or for a bucket covering it that can stand in"""
+    for bucket in sorted({radius, *(b for b in RADIUS_BUCKETS if b >= radius)}):
+        result = _cache.get((commune, rome, bucket))
+        if result is None:
+            continue
+        if bucket == radius:
+            return result
+        if _covers(result, radius):
+            _counters["filtered_hits"] += 1
+            return result
+    return None
+
+
+def _within(result: Dict[str, Any], radius: int, location: str) -> Dict[str, Any]:
+    companies = [dict(c) for c in result["companies"] if c.get("distance", 0) <= radius][:RESULT_COUNT]
+    return {**result, "companies": companies, "total": len(companies), "location": location}
+
+
+def _place_params(location: str, commune: Optional[Commune]) -> Dict[str, Any]:
+    """Coordinates of the resolved commune, or the raw text when unknown"""
+    if commune is not None and commune.latitude is not None:
+        return {"latitude": commune.latitude, "longitude": commune.longitude}
+    return {"commune": location}
+
+
+async def _fetch_companies(location: str, commune: Optional[Commune], rome: str, radius: int) -> Dict[str, Any]:
+    """Call La Bonne Boîte directly; raises on failure so errors are never cached"""
+    from .francetravail_oauth import auth
+    from .http_clients import http_clients
+    
+    token = await auth.get_token()
+    
+    client = http_clients.get("labonneboite")
+    with _upstream.time():
+        response = await client.get(
+            LABONNEBOITE_API_URL,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/json"
+            },
+            params={
+                **_place_params(location, commune),
+                "rome_codes": rome,
+                "distance": radius,
+                "sort": "score",
+                "count": FETCH_COUNT
+            }
+        )
+    
+    if response.status_code != 200:
+        raise Exception(f"La Bonne Boîte returned {response.status_code} - {response.text}")
+    
+    data = response.json()
+    companies = data.get("companies", [])
+    
+    # Format companies for frontend
+    formatted_companies = []
+    for company in companies:
+        formatted_companies.append({
+            "id": company.get("siret", str(hash(company.get("name", "")))),
+            "name": company.get("name", "Entreprise"),
+            "siret": company.get("siret", ""),
+            "naf": company.get("naf", ""),
+            "address": company.get("address", ""),
+            "city": company.get("city", location),
+            "headcount": company.get("headcount_text", "Non communiqué"),
+            "hiring_score": int(company.get("stars", 3) * 20),  # Convert 0-5 stars to 0-100
+            "contact_mode": company.get("contact_mode", "email"),
+            "email": company.get("email", ""),
+            "website": company.get("website", ""),
+            "sector": company.get("naf_text", ""),
+            "distance": company.get("distance", 0)
+        })
+    
+    logger.info(f"Found {len(formatted_companies)} companies via La Bonne Boîte")
+    return {
+        "companies": formatted_companies,
+        "total": len(formatted_companies),
+        "location": location,
+        "source": "France Travail - La Bonne Boîte"
+    }
+
+
 async def search_companies(location: str, rome: str = "M1805", radius: int = 10) -> Dict[str, Any]:
     """
     Search companies via La Bonne Boîte API (France Travail)
     
+    The location is resolved against the commune index, so "St Etienne"
+    and "Saint-Étienne" share a cache entry and the search is centered on
+    the commune's coordinates. Results are cached per (commune, ROME code,
+    radius bucket) and concurrent identical searches share one upstream call.
+    
     Args:
         location: City name or postal code
         rome: ROME code (e.g., M1805 = Développeur informatique)
@@ -24,63 +157,55 @@ async def search_companies(location: str, rome: str = "M1805", radius: int = 10)
     Returns:
         Dict with companies list
     """
-    try:
-        from .francetravail_oauth import auth
+    resolved = communes.resolve(location)
+    if resolved is not None and resolved.name is not None:
+        commune = f"{normalize_key(resolved.name)}|{resolved.department}"
+    else:
+        commune = normalize_key(location)
+    rome = rome.strip().upper()
+    
+    cached = _cached_covering(commune, rome, radius)
+    if cached is not None:
+        _counters["hits"] += 1
+        return _within(cached, radius, location)
+    
+    _counters["misses"] += 1
+    bucket = radius_bucket(radius)
+    if bucket != radius and _cache.get((commune, rome, bucket)) is not None:
+        # The bucket is cached but capped short of a page within the radius
+        bucket = radius
+    
+    async def fetch(bucket: int) -> Dict[str, Any]:
+        key = (commune, rome, bucket)
         
-        token = await auth.get_token()
+        async def fetch_and_store():
+            result = await _fetch_companies(location, resolved, rome, bucket)
+            _cache.set(key, result)
+            return result
         
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(
-                LABONNEBOITE_API_URL,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Accept": "application/json"
-                },
-                params={
-                    "commune": location,
-                    "rome_codes": rome,
-                    "distance": radius,
-                    "sort": "score",
-                    "count": 20
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                companies = data.get("companies", [])
-                
-                # Format companies for frontend
-                formatted_companies = []
-                for company in companies:
-                    formatted_companies.append({
-                        "id": company.get("siret", str(hash(company.get("name", "")))),
-                        "name": company.get("name", "Entreprise"),
-                        "siret": company.get("siret", ""),
-                        "naf": company.get("naf", ""),
-                        "address": company.get("address", ""),
-                        "city": company.get("city", location),
-                        "headcount": company.get("headcount_text", "Non communiqué"),
-                        "hiring_score": int(company.get("stars", 3) * 20),  # Convert 0-5 stars to 0-100
-                        "contact_mode": company.get("contact_mode", "email"),
-                        "website": company.get("website", ""),
-                        "sector": company.get("naf_text", ""),
-                        "distance": company.get("distance", 0)
-                    })
-                
-                logger.info(f"Found {len(formatted_companies)} companies via La Bonne Boîte")
-                return {
-                    "companies": formatted_companies,
-                    "total": len(formatted_companies),
-                    "location": location,
-                    "source": "France Travail - La Bonne Boîte"
-                }
-            else:
-                logger.warning(f"La Bonne Boîte API error: {response.status_code} - {response.text}")
-                return get_mock_companies(location)
-                
+        return await _flights.run(key, fetch_and_store)
+    
+    try:
+        result = await fetch(bucket)
+        if bucket != radius and not _covers(result, radius):
+            result = await fetch(radius)
     except Exception as e:
         logger.error(f"La Bonne Boîte API error: {e}")
         return get_mock_companies(location)
+    
+    return _within(result, radius, location)
+
+
+def cache_stats() -> Dict[str, Any]:
+    lookups = _counters["hits"] + _counters["misses"]
+    return {
+        **_counters,
+        "hit_rate": round(_counters["hits"] / lookups, 4) if lookups else 0.0,
+        "coalesced": _flights.coalesced,
+        "size": len(_cache),
+        "ttl_seconds": _cache.ttl,
+        "upstream": _upstream.stats()
+    }
 
 
 def get_mock_companies(location: str) -> Dict[str, Any]:
@@ -0,0 +1,428 @@
+"""
+LLM gateway
+Every model call for CV and cover letter generation goes through here. Calls
+have a deadline, transient failures are retried a bounded number of times
+with jittered backoff, and a circuit breaker per model fails fast while the
+provider is degraded instead of letting requests pile up behind it. When a
+secondary model is configured, a completion that has not answered after a
+latency threshold is hedged to it and the first answer wins.
+
+The provider is chosen with LLM_PROVIDER: "live" (LlmChat for completions,
+litellm for token streams) or "fake", a local stand-in with configurable
+latency and error rates for load tests without network access.
+
+EMERGENT_LLM_KEY is only accepted by LlmChat's endpoint, so token streaming
+needs its own credentials: LLM_API_KEY for the provider's API, and/or
+LLM_API_BASE for an OpenAI-compatible proxy. Without either, streams are
+served as one chunk from the completion.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from .metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """The model cannot answer right now (circuit open, or every attempt failed)"""
+
+    def __init__(self, message: str, retry_after: int = 0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMTimeout(LLMUnavailable):
+    """The call's deadline passed before the model answered"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single probe through: its success
+    closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.counters = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 0
+        return max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at) + 0.999))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.counters["rejected"] += 1
+        return False
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.threshold:
+            if self.opened_at is None or self._probing:
+                self.counters["opened"] += 1
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self) -> None:
+        """A call that was let through ended without a verdict (cancelled)"""
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "state": self.state, "consecutive_failures": self.failures}
+
+
+class LiveProvider:
+    """The hosted models: LlmChat for completions, litellm for token streams"""
+
+    name = "live"
+
+    async def complete(self, model: str, system_prompt: str, user_prompt: str, session_id: str) -> str:
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+        provider, _, model_name = model.partition("/")
+        chat = LlmChat(
+            api_key=os.environ.get('EMERGENT_LLM_KEY'),
+            session_id=session_id,
+            system_message=system_prompt
+        )
+        chat.with_model(provider, model_name)
+        return await chat.send_message(UserMessage(text=user_prompt))
+
+    async def stream(self, model: str, system_prompt: str, user_prompt: str,
+                     session_id: str) -> AsyncIterator[str]:
+        """
+        Text chunks as the model produces them. Falls back to a single chunk
+        from complete() when litellm is not installed, LLM_API_KEY and
+        LLM_API_BASE are both unset, or the stream fails before its first
+        token. Closing the generator (e.g. on client disconnect) closes the
+        upstream stream.
+        """
+        api_key = os.environ.get('LLM_API_KEY')
+        api_base = os.environ.get('LLM_API_BASE')
+        litellm = None
+        if api_key or api_base:
+            try:
+                import litellm
+            except ImportError:
+                pass
+
+        response = None
+        started = False
+        if litellm is not None:
+            try:
+                response = await litellm.acompletion(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    stream=True,
+                    api_key=api_key or None,
+                    api_base=api_base or None,
+                    user=session_id
+                )
+                async for chunk in response:
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        started = True
+                        yield text
+                return
+            except Exception as e:
+                if started:
+                    raise
+                logger.warning(f"Streaming completion unavailable, falling back to a single response: {e}")
+            finally:
+                close = getattr(response, "aclose", None)
+                if close is not None:
+                    try:
+                        await close()
+                    except Exception:
+                        pass
+
+        yield await self.complete(model, system_prompt, user_prompt, session_id)
+
+
+class FakeProvider:
+    """
+    Offline stand-in for load tests. Each call takes `latency` seconds
+    (± `jitter`), fails with probability `error_rate` and never answers with
+    probability `stall_rate`; streams emit words at `tokens_per_second`.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency: float = 1.0, jitter: float = 0.5, error_rate: float = 0.0,
+                 stall_rate: float = 0.0, tokens_per_second: float = 50, words: int = 300):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.tokens_per_second = tokens_per_second
+        self.words = words
+
+    async def _wait(self) -> None:
+        roll = random.random()
+        if roll < self.stall_rate:
+            await asyncio.Event().wait()
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if roll < self.stall_rate + self.error_rate:
+            raise RuntimeError("Fake provider error")
+
+    def _text(self, model: str, user_prompt: str) -> str:
+        return f"[{model}] " + " ".join(["lorem"] * self.words) + f" ({len(user_prompt)} caractères)"
+
+    async def complete(self, model: str, system_prompt: str, user_prompt: str, session_id: str) -> str:
+        await self._wait()
+        return self._text(model, user_prompt)
+
+    async def stream(self, model: str, system_prompt: str, user_prompt: str,
+                     session_id: str) -> AsyncIterator[str]:
+        await self._wait()
+        for word in self._text(model, user_prompt).split(" "):
+            yield word + " "
+            await asyncio.sleep(1 / self.tokens_per_second)
+
+
+class LLMGateway:
+    """Deadlines, retries, circuit breaking and hedging around an LLM provider"""
+
+    def __init__(self, provider, model: str = "openai/gpt-4o", hedge_model: Optional[str] = None,
+                 hedge_after: float = 8, timeout: float = 60, attempt_timeout: float = 45,
+                 first_token_timeout: float = 20, max_retries: int = 2, backoff: float = 0.5,
+                 breaker_threshold: int = 5, breaker_reset: float = 30):
+        self.provider = provider
+        self.model = model
+        self.hedge_model = hedge_model or None
+        self.hedge_after = hedge_after
+        self.timeout = timeout
+        self.attempt_timeout = attempt_timeout
+        self.first_token_timeout = first_token_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._breaker_args = (breaker_threshold, breaker_reset)
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latency = LatencyStats()
+        self.counters = {"calls": 0, "streams": 0, "retries": 0, "timeouts": 0, "failures": 0,
+                         "short_circuited": 0, "hedged": 0, "hedge_wins": 0}
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(*self._breaker_args)
+        return self.breakers[model]
+
+    async def _call(self, model: str, system_prompt: str, user_prompt: str, session_id: str,
+                    timeout: float) -> str:
+        """One attempt on one model, recorded by its breaker"""
+        breaker = self.breaker(model)
+        if not breaker.allow():
+            self.counters["short_circuited"] += 1
+            raise LLMUnavailable(f"Circuit open for {model}", retry_after=breaker.retry_after())
+        try:
+            content = await asyncio.wait_for(
+                self.provider.complete(model, system_prompt, user_prompt, session_id), timeout
+            )
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            breaker.failure()
+            raise LLMTimeout(f"{model} did not answer within {timeout:.0f}s")
+        except Exception:
+            breaker.failure()
+            raise
+        breaker.success()
+        return content
+
+    async def _hedged(self, system_prompt: str, user_prompt: str, session_id: str, timeout: float) -> str:
+        """Primary call, plus the hedge model if the primary is slower than hedge_after"""
+        if self.hedge_model and self.breaker(self.model).state == "open":
+            # Primary known to be down: go straight to the secondary
+            return await self._call(self.hedge_model, system_prompt, user_prompt, session_id, timeout)
+        primary = asyncio.create_task(self._call(self.model, system_prompt, user_prompt, session_id, timeout))
+        pending = {primary}
+        # Every exit, including the caller being cancelled, cancels the calls still running
+        try:
+            if not self.hedge_model or self.hedge_after >= timeout:
+                return await primary
+
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return primary.result()
+            self.counters["hedged"] += 1
+            hedge = asyncio.create_task(self._call(
+                self.hedge_model, system_prompt, user_prompt, session_id, timeout - self.hedge_after
+            ))
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    # The primary's error is the one reported if both fail
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, system_prompt: str, user_prompt: str, session_id: str) -> str:
+        """
+        Whole completion within the gateway's deadline
+
+        Raises:
+            LLMTimeout: if no attempt answered before the deadline
+            LLMUnavailable: if the circuit is open or every attempt failed
+        """
+        self.counters["calls"] += 1
+        deadline = time.monotonic() + self.timeout
+        attempt = 0
+        with self.latency.time():
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    return await self._hedged(
+                        system_prompt, user_prompt, session_id, min(self.attempt_timeout, remaining)
+                    )
+                except LLMTimeout as e:
+                    self.counters["timeouts"] += 1
+                    error = e
+                except LLMUnavailable:
+                    # Circuit open: retrying now cannot succeed
+                    self.counters["failures"] += 1
+                    raise
+                except Exception as e:
+                    error = e
+                    logger.warning(f"LLM call attempt {attempt + 1} failed: {e}")
+
+                # Full jitter, so that failed callers do not retry in lockstep
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                attempt += 1
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline - 1:
+                    self.counters["failures"] += 1
+                    if isinstance(error, LLMTimeout):
+                        raise error
+                    raise LLMUnavailable(f"LLM call failed after {attempt} attempts: {error}") from error
+                self.counters["retries"] += 1
+                await asyncio.sleep(delay)
+
+    async def stream(self, system_prompt: str, user_prompt: str, session_id: str) -> AsyncIterator[str]:
+        """
+        Completion as text chunks from the primary model. Not retried or
+        hedged, since chunks may already have been sent: the first chunk must
+        arrive within first_token_timeout, each next one within
+        attempt_timeout, and the whole stream within the deadline.
+
+        Raises:
+            LLMTimeout: if a chunk or the whole stream is late
+            LLMUnavailable: if the circuit is open
+        """
+        self.counters["streams"] += 1
+        breaker = self.breaker(self.model)
+        if not breaker.allow():
+            self.counters["short_circuited"] += 1
+            raise LLMUnavailable(f"Circuit open for {self.model}", retry_after=breaker.retry_after())
+
+        chunks = self.provider.stream(self.model, system_prompt, user_prompt, session_id)
+        deadline = time.monotonic() + self.timeout
+        wait = self.first_token_timeout
+        verdict = False
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    text = await asyncio.wait_for(chunks.__anext__(), min(wait, remaining))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    self.counters["timeouts"] += 1
+                    verdict = True
+                    breaker.failure()
+                    raise LLMTimeout(f"{self.model} stream stalled")
+                wait = self.attempt_timeout
+                yield text
+            verdict = True
+            breaker.success()
+        except LLMTimeout:
+            raise
+        except Exception:
+            verdict = True
+            self.counters["failures"] += 1
+            breaker.failure()
+            raise
+        finally:
+            if not verdict:
+                breaker.release()
+            try:
+                await chunks.aclose()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "provider": self.provider.name,
+            "model": self.model,
+            "hedge_model": self.hedge_model,
+            "latency": self.latency.stats(),
+            "breakers": {model: breaker.stats() for model, breaker in self.breakers.items()}
+        }
+
+
+def _provider():
+    if os.environ.get('LLM_PROVIDER', 'live').lower() == 'fake':
+        return FakeProvider(
+            latency=float(os.environ.get('LLM_FAKE_LATENCY', 1.0)),
+            jitter=float(os.environ.get('LLM_FAKE_JITTER', 0.5)),
+            error_rate=float(os.environ.get('LLM_FAKE_ERROR_RATE', 0)),
+            stall_rate=float(os.environ.get('LLM_FAKE_STALL_RATE', 0)),
+            tokens_per_second=float(os.environ.get('LLM_FAKE_TOKENS_PER_SECOND', 50))
+        )
+    return LiveProvider()
+
+
+# Singleton instance
+llm_gateway = LLMGateway(
+    _provider(),
+    model=os.environ.get('LLM_MODEL', 'openai/gpt-4o'),
+    hedge_model=os.environ.get('LLM_HEDGE_MODEL'),
+    hedge_after=float(os.environ.get('LLM_HEDGE_AFTER', 8)),
+    timeout=float(os.environ.get('LLM_TIMEOUT', 60)),
+    attempt_timeout=float(os.environ.get('LLM_ATTEMPT_TIMEOUT', 45)),
+    first_token_timeout=float(os.environ.get('LLM_FIRST_TOKEN_TIMEOUT', 20)),
+    max_retries=int(os.environ.get('LLM_MAX_RETRIES', 2)),
+    backoff=float(os.environ.get('LLM_RETRY_BACKOFF', 0.5)),
+    breaker_threshold=int(os.environ.get('LLM_BREAKER_THRESHOLD', 5)),
+    breaker_reset=float(os.environ.get('LLM_BREAKER_RESET', 30))
+)
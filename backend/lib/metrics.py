@@ -0,0 +1,53 @@
+"""
+Lightweight in-process metrics
+Latency recorders exposed through /api/metrics
+"""
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict
+
+
+class LatencyStats:
+    """Count, mean, max and percentiles over a sliding window of samples (ms)"""
+
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms: float) -> None:
+        self._samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    @contextmanager
+    def time(self):
+        """Record the duration of the block; exceptions count as errors"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.errors += 1
+            raise
+        finally:
+            self.record((time.perf_counter() - started_at) * 1000)
+
+    def _percentile(self, ordered, pct: float) -> float:
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self._percentile(ordered, 0.50), 2),
+            "p95_ms": round(self._percentile(ordered, 0.95), 2),
+            "max_ms": round(self.max_ms, 2)
+        }
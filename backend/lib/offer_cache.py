@@ -0,0 +1,143 @@
+"""
+Shared offer search cache
+Two tiers: an in-process LRU in front of a MongoDB collection with a TTL
+index, keyed by normalized (keywords, department, range). Fresh entries are
+served directly; stale entries are served immediately while one background
+refresh runs; concurrent misses for the same key share one upstream call.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from .cache import SingleFlight, TTLCache
+from .metrics import LatencyStats
+from .text import normalize_key
+
+logger = logging.getLogger(__name__)
+
+Offers = List[Dict[str, Any]]
+
+
+class OfferCache:
+    """Stale-while-revalidate cache for France Travail offer searches"""
+
+    def __init__(self, memory_size: int = 2000, fresh_ttl: float = 900, stale_ttl: float = 6 * 3600):
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        # Memory entries live for the whole stale window; freshness is tracked per entry
+        self._memory = TTLCache(maxsize=memory_size, ttl=stale_ttl)
+        self._flights = SingleFlight()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._collection = None
+        self.upstream = LatencyStats()
+        self.counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "stale_served": 0,
+                         "background_refreshes": 0, "refresh_failures": 0}
+
+    def configure(self, db=None) -> None:
+        """Enable the shared MongoDB tier (db.offer_cache)"""
+        self._collection = db.offer_cache if db is not None else None
+
+    @staticmethod
+    def key(keywords: str, department: Optional[str], limit: int) -> str:
+        words = " ".join(sorted(normalize_key(keywords).split()))
+        return f"{words}|{department or ''}|0-{limit - 1}"
+
+    async def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            self.counters["memory_hits"] += 1
+            return entry
+        if self._collection is None:
+            return None
+        try:
+            doc = await self._collection.find_one({"_id": key})
+        except PyMongoError as e:
+            logger.warning(f"Offer cache read failed: {e}")
+            return None
+        if not doc or doc["stale_until"] <= time.time():
+            return None
+        entry = {"offers": doc["offers"], "fresh_until": doc["fresh_until"], "stale_until": doc["stale_until"]}
+        self._memory.set(key, entry, ttl=entry["stale_until"] - time.time())
+        self.counters["mongo_hits"] += 1
+        return entry
+
+    async def _fetch(self, key: str, fetcher: Callable[[], Awaitable[Offers]]) -> Offers:
+        with self.upstream.time():
+            offers = await fetcher()
+        now = time.time()
+        entry = {"offers": offers, "fresh_until": now + self.fresh_ttl, "stale_until": now + self.stale_ttl}
+        self._memory.set(key, entry)
+        if self._collection is not None:
+            try:
+                await self._collection.replace_one(
+                    {"_id": key},
+                    {**entry, "expires_at": datetime.fromtimestamp(entry["stale_until"], timezone.utc)},
+                    upsert=True
+                )
+            except PyMongoError as e:
+                logger.warning(f"Offer cache write failed: {e}")
+        return offers
+
+    def _refresh_in_background(self, key: str, fetcher: Callable[[], Awaitable[Offers]]) -> None:
+        if key in self._refreshing or self._flights.in_flight(key):
+            return
+
+        async def refresh():
+            try:
+                await self._flights.run(key, lambda: self._fetch(key, fetcher))
+            except Exception as e:
+                self.counters["refresh_failures"] += 1
+                logger.warning(f"Background offer refresh failed for {key}: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self.counters["background_refreshes"] += 1
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    async def get_or_fetch(self, key: str, fetcher: Callable[[], Awaitable[Offers]]) -> Offers:
+        """
+        Return cached offers for `key`, calling `fetcher` on a miss
+
+        Args:
+            key: Cache key from OfferCache.key
+            fetcher: Coroutine factory performing the upstream search; it
+                must raise on failure so that errors are never cached
+
+        Returns:
+            A fresh copy of the offers list, safe for the caller to mutate
+        """
+        entry = await self._load(key)
+        if entry is not None:
+            if entry["fresh_until"] <= time.time():
+                self.counters["stale_served"] += 1
+                self._refresh_in_background(key, fetcher)
+            offers = entry["offers"]
+        else:
+            self.counters["misses"] += 1
+            offers = await self._flights.run(key, lambda: self._fetch(key, fetcher))
+        return [dict(offer) for offer in offers]
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.counters["memory_hits"] + self.counters["mongo_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "coalesced": self._flights.coalesced,
+            "memory": self._memory.stats(),
+            "shared": self._collection is not None,
+            "upstream": self.upstream.stats()
+        }
+
+
+# Singleton instance
+offer_cache = OfferCache(
+    memory_size=int(os.environ.get('OFFER_CACHE_SIZE', 2000)),
+    fresh_ttl=float(os.environ.get('OFFER_CACHE_FRESH_TTL', 900)),
+    stale_ttl=float(os.environ.get('OFFER_CACHE_STALE_TTL', 6 * 3600))
+)
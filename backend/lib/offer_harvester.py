@@ -0,0 +1,278 @@
+"""
+France Travail offer harvester
+Periodically pulls the offers matching what users are looking for (each
+profile's title in its department, plus any configured ROME codes in those
+departments) and upserts them, with full descriptions, into db.offers. Offers
+that stop appearing are expired and every run records its throughput in
+db.harvest_runs.
+
+Every worker keeps its in-memory ranking index in sync with db.offers, so that
+recommendations for harvested departments and offer detail views are served
+from local data. Only workers started with HARVEST_ENABLED=true harvest.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from .ranking import offer_index
+from .text import normalize_key
+
+logger = logging.getLogger(__name__)
+
+# Offers are served and indexed with the same preview length as live searches
+DESCRIPTION_PREVIEW = 500
+
+# (keywords, ROME code, department); keywords or ROME code may be None
+Target = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+class OfferHarvester:
+    """Scheduled bulk ingestion of France Travail offers into db.offers"""
+
+    def __init__(self, enabled: bool = False, interval: float = 6 * 3600, sync_interval: float = 600,
+                 rome_codes: Sequence[str] = (), max_targets: int = 200, max_per_target: int = 1050,
+                 expire_after: float = 48 * 3600, concurrency: int = 2, batch_size: int = 500):
+        self.enabled = enabled
+        self.interval = interval
+        self.sync_interval = sync_interval
+        self.rome_codes = [code.strip().upper() for code in rome_codes if code.strip()]
+        self.max_targets = max_targets
+        self.max_per_target = max_per_target
+        self.expire_after = expire_after
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._synced_at = ""
+        self._last_run: Optional[Dict[str, Any]] = None
+        self.counters = {"runs": 0, "failed_runs": 0, "synced": 0}
+
+    def configure(self, db) -> None:
+        self._db = db
+
+    async def targets(self) -> List[Target]:
+        """Searches to run: profile titles by department, then ROME codes in those departments"""
+        from .jobs_api import resolve_department
+
+        demand: Counter = Counter()
+        titles: Dict[Tuple[str, Optional[str]], str] = {}
+        async for profile in self._db.profiles.find({}, {"_id": 0, "title": 1, "location": 1}):
+            title = (profile.get("title") or "").strip()
+            if not title:
+                continue
+            department = resolve_department(profile.get("location") or "")
+            key = (normalize_key(title), department)
+            demand[key] += 1
+            titles.setdefault(key, title)
+
+        # Most requested searches first, so a cap drops the long tail
+        targets: List[Target] = [(titles[key], None, key[1]) for key, _ in demand.most_common(self.max_targets)]
+        departments = sorted({department for _, department in demand if department})
+        for rome in self.rome_codes:
+            for department in departments or [None]:
+                targets.append((None, rome, department))
+        return targets
+
+    async def _write(self, offers: List[Dict[str, Any]], department: Optional[str], run_id: str,
+                     seen_at: str, totals: Dict[str, int]) -> None:
+        """Upsert one batch by offer id; unordered so one bad document does not stop the rest"""
+        requests = [
+            UpdateOne(
+                {"id": offer["id"]},
+                {"$set": {**offer, "department": department, "last_seen_at": seen_at, "run_id": run_id},
+                 "$setOnInsert": {"first_seen_at": seen_at}},
+                upsert=True
+            )
+            for offer in offers
+        ]
+        try:
+            result = await self._db.offers.bulk_write(requests, ordered=False)
+            totals["upserted"] += result.upserted_count
+            totals["modified"] += result.modified_count
+        except BulkWriteError as e:
+            totals["upserted"] += e.details.get("nUpserted", 0)
+            totals["modified"] += e.details.get("nModified", 0)
+            totals["write_errors"] += len(e.details.get("writeErrors", []))
+            logger.warning(f"Offer harvest batch had {len(e.details.get('writeErrors', []))} write errors")
+
+        await offer_index.add_in_chunks(({**offer, "description": offer["description"][:DESCRIPTION_PREVIEW]}
+                                         for offer in offers), department)
+
+    async def _harvest(self, target: Target, run_id: str, seen_at: str, seen: set,
+                       totals: Dict[str, int]) -> None:
+        from .communes import DEPARTMENTS
+        from .jobs_api import iter_offers
+
+        keywords, rome, department = target
+        label = DEPARTMENTS.get(department, "France") if department else "France"
+        batch: List[Dict[str, Any]] = []
+        async for page in iter_offers(keywords, department, label, max_results=self.max_per_target,
+                                      rome=rome, description_limit=None):
+            for offer in page:
+                # Overlapping searches return the same offer; write it once per run
+                if not offer["id"] or offer["id"] in seen:
+                    continue
+                seen.add(offer["id"])
+                batch.append(offer)
+            totals["fetched"] += len(page)
+            if len(batch) >= self.batch_size:
+                await self._write(batch, department, run_id, seen_at, totals)
+                batch = []
+        if batch:
+            await self._write(batch, department, run_id, seen_at, totals)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """
+        Harvest every target, expire offers no longer returned and record the run
+
+        Returns:
+            The harvest_runs record of this run
+        """
+        db = self._db
+        started = _now()
+        run_id = f"harvest_{uuid.uuid4().hex[:12]}"
+        await db.harvest_runs.insert_one({"run_id": run_id, "status": "running", "started_at": _iso(started)})
+
+        targets = await self.targets()
+        totals = {"fetched": 0, "upserted": 0, "modified": 0, "write_errors": 0, "failed_targets": 0}
+        seen: set = set()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        clock = time.perf_counter()
+
+        async def harvest(target: Target) -> None:
+            async with semaphore:
+                try:
+                    await self._harvest(target, run_id, _iso(started), seen, totals)
+                except Exception as e:
+                    totals["failed_targets"] += 1
+                    logger.warning(f"Offer harvest failed for {target}: {e}")
+
+        await asyncio.gather(*(harvest(target) for target in targets))
+        duration = time.perf_counter() - clock
+
+        # An offer missing from every run for expire_after has been withdrawn.
+        # Skip expiry when nothing came back at all: the API is down, not empty.
+        expired = 0
+        if totals["fetched"]:
+            cutoff = _iso(started - timedelta(seconds=self.expire_after))
+            expired = (await db.offers.delete_many({"last_seen_at": {"$lt": cutoff}})).deleted_count
+
+        record = {
+            "run_id": run_id,
+            "status": "failed" if targets and totals["failed_targets"] == len(targets) else "completed",
+            "started_at": _iso(started),
+            "finished_at": _iso(_now()),
+            "duration_seconds": round(duration, 3),
+            "targets": len(targets),
+            "departments": sorted({department for _, _, department in targets if department}),
+            **totals,
+            "expired": expired,
+            "offers_per_second": round(totals["fetched"] / duration, 1) if duration else 0.0
+        }
+        await db.harvest_runs.update_one({"run_id": run_id}, {"$set": record})
+        self.counters["runs"] += 1
+        if record["status"] == "failed":
+            self.counters["failed_runs"] += 1
+        self._last_run = record
+        logger.info(
+            f"Harvested {totals['fetched']} offers from {len(targets)} searches in {duration:.1f}s "
+            f"({record['offers_per_second']}/s): {totals['upserted']} new, {expired} expired"
+        )
+        return record
+
+    async def sync_index(self) -> int:
+        """Index offers harvested since the last sync, by any worker"""
+        db = self._db
+        self._last_run = await db.harvest_runs.find_one(
+            {"status": "completed"}, {"_id": 0}, sort=[("started_at", -1)]
+        ) or self._last_run
+
+        # $gte: offers of a run still in progress share its timestamp
+        query = {"last_seen_at": {"$gte": self._synced_at}} if self._synced_at else {}
+        by_department: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        count = 0
+        cursor = db.offers.find(query, {"_id": 0}).sort("last_seen_at", -1).limit(offer_index.max_docs)
+        async for offer in cursor:
+            if count == 0:
+                self._synced_at = offer["last_seen_at"]
+            offer["description"] = (offer.get("description") or "")[:DESCRIPTION_PREVIEW]
+            by_department.setdefault(offer.get("department"), []).append(offer)
+            count += 1
+        # Up to max_docs offers at startup: index them in chunks, not in one blocking call
+        for department, offers in by_department.items():
+            await offer_index.add_in_chunks(offers, department)
+        self.counters["synced"] += count
+        return count
+
+    def covers(self, department: Optional[str]) -> bool:
+        """Whether a recent harvest run searched this department"""
+        run = self._last_run
+        if not department or not run or run.get("status") != "completed":
+            return False
+        fresh = run.get("finished_at", "") >= _iso(_now() - timedelta(seconds=self.interval * 2))
+        return fresh and department in run.get("departments", [])
+
+    async def _due(self) -> bool:
+        """No run started within the interval, by this worker or another"""
+        latest = await self._db.harvest_runs.find_one({}, {"started_at": 1}, sort=[("started_at", -1)])
+        return not latest or latest["started_at"] < _iso(_now() - timedelta(seconds=self.interval))
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                if self.enabled and await self._due():
+                    await self.run_once()
+                await self.sync_index()
+            except PyMongoError as e:
+                logger.warning(f"Offer harvester pass failed: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "last_run": self._last_run
+        }
+
+
+# Singleton instance
+offer_harvester = OfferHarvester(
+    enabled=os.environ.get('HARVEST_ENABLED', 'false').lower() == 'true',
+    interval=float(os.environ.get('HARVEST_INTERVAL', 6 * 3600)),
+    sync_interval=float(os.environ.get('HARVEST_SYNC_INTERVAL', 600)),
+    rome_codes=os.environ.get('HARVEST_ROME_CODES', '').split(','),
+    max_targets=int(os.environ.get('HARVEST_MAX_TARGETS', 200)),
+    max_per_target=int(os.environ.get('HARVEST_MAX_PER_TARGET', 1050)),
+    expire_after=float(os.environ.get('HARVEST_EXPIRE_AFTER', 48 * 3600)),
+    concurrency=int(os.environ.get('HARVEST_CONCURRENCY', 2))
+)
@@ -0,0 +1,102 @@
+"""
+Password hashing off the event loop
+Runs bcrypt in a dedicated worker pool with bounded admission, so a burst of
+logins can't stall every other coroutine on the worker
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing queue is full and the caller should retry later"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Password hashing pool saturated")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """bcrypt hashing on a thread or process pool with a bounded wait queue"""
+
+    def __init__(self, workers: int = 4, queue_size: int = 32,
+                 use_processes: bool = False, retry_after: int = 1):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+        self.retry_after = retry_after
+        self._executor: Optional[Executor] = None
+        self._in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="bcrypt"
+                )
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        # Admission is checked synchronously on the event loop, so no lock is needed
+        if self._in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            logger.warning("Password hashing pool saturated, rejecting request")
+            raise HashingPoolSaturated(self.retry_after)
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._in_flight -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(_verify, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "executor": "process" if self.use_processes else "thread",
+            "in_flight": self._in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+
+# Singleton instance
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 4)),
+    queue_size=int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', 32)),
+    use_processes=os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread') == 'process',
+    retry_after=int(os.environ.get('PASSWORD_HASH_RETRY_AFTER', 1))
+)
@@ -0,0 +1,310 @@
+"""
+Token-budgeted prompt assembly for AI generations
+The profile part of the prompt is pre-rendered into a digest when the profile
+is saved. At generation time the prompt is fitted to the plan's input token
+budget: job offer boilerplate (company presentation, benefits, legal notices)
+is dropped first, then the experiences least related to the offer, then the
+offer text itself is shortened. Tokens are counted with tiktoken, or
+estimated at four characters per token when its encoding is unavailable.
+"""
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .ranking import tokenize
+from .text import fold
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "o200k_base"  # gpt-4o
+DIGEST_VERSION = 1
+
+# Input tokens (system + user prompt) allowed per generation
+PLAN_TOKEN_BUDGETS = {
+    "free": int(os.environ.get('PROMPT_BUDGET_FREE', 2500)),
+    "pro": int(os.environ.get('PROMPT_BUDGET_PRO', 5000)),
+    "ultra": int(os.environ.get('PROMPT_BUDGET_ULTRA', 8000)),
+}
+# Experiences kept whatever the budget, most relevant first
+MIN_EXPERIENCES = 2
+
+COVER_LETTER_SYSTEM_PROMPT = """Tu es un expert RH français spécialisé dans la rédaction de lettres de motivation professionnelles et convaincantes.
+Tu dois rédiger une lettre de motivation en français, parfaitement structurée, qui:
+- Fait le pont entre le parcours du candidat et le poste visé
+- Met en avant les expériences et compétences les plus pertinentes
+- Est professionnelle mais authentique
+- Respecte le format standard français (objet, formules de politesse)
+- Fait environ 300-400 mots"""
+
+CV_SYSTEM_PROMPT = """Tu es un expert RH français spécialisé dans l'optimisation de CV.
+Tu dois créer un CV structuré en texte qui:
+- Met en avant les éléments les plus pertinents pour le poste
+- Est clair et bien organisé
+- Utilise des verbes d'action
+- Quantifie les réalisations quand possible"""
+
+COVER_LETTER_TEMPLATE = """Rédige une lettre de motivation pour le poste suivant:
+
+POSTE: {job_title}
+ENTREPRISE: {company_name}
+DESCRIPTION DU POSTE:
+{job_description}
+
+PROFIL DU CANDIDAT:
+Nom: {name}
+Titre: {title}
+Résumé: {summary}
+
+EXPÉRIENCES PROFESSIONNELLES:
+{experiences}
+
+FORMATION:
+{education}
+
+COMPÉTENCES: {skills}
+
+Rédige maintenant une lettre de motivation percutante et personnalisée."""
+
+CV_TEMPLATE = """Crée un CV optimisé pour le poste suivant:
+
+POSTE VISÉ: {job_title} chez {company_name}
+
+INFORMATIONS DU CANDIDAT:
+Nom: {name}
+Email: {email}
+Téléphone: {phone}
+Localisation: {location}
+LinkedIn: {linkedin_url}
+
+Titre professionnel: {title}
+Résumé: {summary}
+
+EXPÉRIENCES:
+{experiences}
+
+FORMATION:
+{education}
+
+COMPÉTENCES: {skills}
+
+Génère un CV structuré et optimisé pour cette candidature."""
+
+# Paragraphs opening with one of these headings carry no information about the job
+_BOILERPLATE_HEADING = re.compile(
+    r"^\W*(qui sommes[ -]nous|a propos|about us|l'entreprise|notre entreprise|presentation de l'entreprise|"
+    r"nos avantages|les avantages|avantages|ce que nous (vous )?offrons|pourquoi nous rejoindre|"
+    r"pourquoi (nous )?rejoindre|rejoignez[ -]nous|processus de recrutement|deroulement du recrutement)\b"
+)
+# Sentences of legal or recruitment-process boilerplate, wherever they appear
+_BOILERPLATE_SENTENCE = re.compile(
+    r"(egalite des chances|situation de handicap|travailleurs handicapes|toutes les candidatures|"
+    r"diversite|rgpd|donnees personnelles|conformement a la (loi|reglementation)|"
+    r"sans discrimination)"
+)
+_SENTENCES = re.compile(r"(?<=[.!?])\s+")
+
+
+class Prompt(NamedTuple):
+    system: str
+    user: str
+    input_tokens: int
+    trimmed_tokens: int
+    budget: int
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """tiktoken encoding, or None to estimate (not installed, or its data cannot be downloaded)"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, estimating prompt tokens from length: {e}")
+        return None
+
+
+def load_tokenizer() -> bool:
+    """Load the encoding ahead of the first generation; True if tiktoken is used"""
+    return _encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Text cut to at most max_tokens, on a word boundary, with an ellipsis when cut"""
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding()
+    if encoding is None:
+        if len(text) <= max_tokens * 4:
+            return text
+        cut = text[:max_tokens * 4 - 1]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens - 1])
+    return cut.rsplit(" ", 1)[0].rstrip() + "…"
+
+
+def render_digest(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pre-rendered profile sections, stored with the profile on save
+
+    Args:
+        profile: Profile document or ProfileCreate dump
+
+    Returns:
+        Digest with one rendered line per experience (with its token count
+        and terms for relevance), and the rendered education and skills
+    """
+    experiences = []
+    for exp in profile.get("experiences", []):
+        text = f"- {exp['title']} chez {exp['company']} ({exp['start_date']} - {exp.get('end_date', 'Présent')}): {exp['description']}"
+        experiences.append({
+            "text": text,
+            "tokens": count_tokens(text) + 1,
+            "terms": sorted(set(tokenize(f"{exp['title']} {exp['description']}"))),
+            "current": bool(exp.get("current")) or not exp.get("end_date")
+        })
+    education = "".join(
+        f"- {edu['degree']} à {edu['institution']} ({edu['start_date']} - {edu.get('end_date', '')})\n"
+        for edu in profile.get("education", [])
+    )
+    return {
+        "version": DIGEST_VERSION,
+        "experiences": experiences,
+        "education": education,
+        "skills": ", ".join(profile.get("skills", []))
+    }
+
+
+def strip_boilerplate(description: str) -> str:
+    """Job description without company presentation, benefits and legal paragraphs"""
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", description):
+        folded = fold(paragraph.strip())
+        if not folded or _BOILERPLATE_HEADING.match(folded):
+            continue
+        sentences = [s for s in _SENTENCES.split(paragraph.strip()) if not _BOILERPLATE_SENTENCE.search(fold(s))]
+        if sentences:
+            paragraphs.append(" ".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+class PromptBuilder:
+    """Assembles generation prompts within a per-plan token budget"""
+
+    def __init__(self, budgets: Dict[str, int] = PLAN_TOKEN_BUDGETS):
+        self.budgets = budgets
+        self.counters = {"builds": 0, "input_tokens": 0, "trimmed_tokens": 0, "over_budget": 0,
+                         "digests_rendered": 0}
+
+    def digest(self, profile: Dict[str, Any]) -> Dict[str, Any]:
+        digest = profile.get("digest")
+        if not digest or digest.get("version") != DIGEST_VERSION:
+            # Profile saved before digests existed
+            self.counters["digests_rendered"] += 1
+            digest = render_digest(profile)
+        return digest
+
+    def build(self, generation_type: str, user: Dict[str, Any], profile: Dict[str, Any],
+              application: Dict[str, Any], plan: Optional[str] = None) -> Prompt:
+        """
+        System and user prompts for a generation, fitted to the plan's budget
+
+        Args:
+            generation_type: "cover_letter" or "cv"
+            user: Current user document (name, email)
+            profile: Master profile, with its digest when saved since digests exist
+            application: Application the content is generated for
+            plan: Budget to apply, defaults to the user's plan
+
+        Returns:
+            The prompts with their input token count and the tokens trimmed
+        """
+        budget = self.budgets.get(plan or user.get("subscription_plan", "free"), self.budgets["free"])
+        digest = self.digest(profile)
+        job_title = application.get("job_title", "")
+        raw_description = application.get("job_description") or "Non spécifiée"
+
+        if generation_type == "cover_letter":
+            system, template = COVER_LETTER_SYSTEM_PROMPT, COVER_LETTER_TEMPLATE
+            fields = {"name": user.get('name', 'Le candidat')}
+        else:
+            system, template = CV_SYSTEM_PROMPT, CV_TEMPLATE
+            fields = {"name": user.get('name', ''), "email": user.get('email', ''),
+                      "phone": profile.get('phone', ''), "location": profile.get('location', ''),
+                      "linkedin_url": profile.get('linkedin_url', '')}
+        fields.update(job_title=job_title, company_name=application.get("company_name", ""),
+                      title=profile.get('title', ''), summary=profile.get('summary', ''),
+                      education=digest["education"], skills=digest["skills"])
+
+        def render(description: str, experiences: List[Dict[str, Any]]) -> str:
+            lines = "".join(exp["text"] + "\n" for exp in experiences)
+            return template.format(**fields, job_description=description, experiences=lines)
+
+        fixed = count_tokens(system) + count_tokens(render("", []))
+        description = strip_boilerplate(raw_description) or raw_description
+        description_tokens = count_tokens(description)
+        experiences = list(digest["experiences"])
+        original = fixed + count_tokens(raw_description) + sum(exp["tokens"] for exp in experiences)
+
+        def total() -> int:
+            return fixed + description_tokens + sum(exp["tokens"] for exp in experiences)
+
+        if total() > budget and len(experiences) > MIN_EXPERIENCES:
+            # Least relevant first: fewest terms shared with the offer, past before current
+            wanted = set(tokenize(f"{job_title} {description}"))
+            ranked = sorted(range(len(experiences)), key=lambda i: (
+                len(wanted.intersection(experiences[i]["terms"])), experiences[i]["current"]
+            ))
+            excess = total() - budget
+            dropped = set()
+            for i in ranked[:len(experiences) - MIN_EXPERIENCES]:
+                if excess <= 0:
+                    break
+                dropped.add(i)
+                excess -= experiences[i]["tokens"]
+            experiences = [exp for i, exp in enumerate(experiences) if i not in dropped]
+
+        if total() > budget:
+            # Keep at least a quarter of the budget for the offer itself
+            room = max(budget - (total() - description_tokens), budget // 4)
+            description = truncate_tokens(description, room)
+            description_tokens = count_tokens(description)
+
+        if total() > budget:
+            room = max(budget - fixed - description_tokens, 0) // max(len(experiences), 1)
+            experiences = [{**exp, "text": truncate_tokens(exp["text"], room)} for exp in experiences]
+            self.counters["over_budget"] += 1
+
+        user_prompt = render(description, experiences)
+        input_tokens = count_tokens(system) + count_tokens(user_prompt)
+        trimmed = max(original - input_tokens, 0)
+        self.counters["builds"] += 1
+        self.counters["input_tokens"] += input_tokens
+        self.counters["trimmed_tokens"] += trimmed
+        return Prompt(system, user_prompt, input_tokens, trimmed, budget)
+
+    def stats(self) -> Dict[str, Any]:
+        builds = self.counters["builds"]
+        return {
+            **self.counters,
+            "avg_input_tokens": round(self.counters["input_tokens"] / builds, 1) if builds else 0.0,
+            "tokenizer": "tiktoken" if _encoding() is not None else "estimate",
+            "budgets": self.budgets
+        }
+
+
+# Singleton instance
+prompt_builder = PromptBuilder()
@@ -0,0 +1,338 @@
+"""
+Local offer ranking
+In-process BM25 index over recently fetched France Travail offers (title plus
+description). Postings are kept per term and scored with NumPy, so ranking a
+profile against tens of thousands of offers is a handful of vectorized
+operations. Offers are added and expired incrementally; expired documents are
+tombstoned and the postings compacted once enough of them accumulate.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9+#]*")
+
+# Frequent French and English words that carry no ranking signal
+STOPWORDS = frozenset("""
+a au aux avec ce ces dans de des du elle en et eux il je la le les leur lui ma mais me meme mes moi mon
+ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos votre
+vous c d j l m n s t y ete etre avoir sont est sera nos votre afin ainsi plus tres bien tout tous toute
+toutes cette cet poste profil entreprise equipe h f and the of to in for with on at as is be are our you
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Accent-folded lowercase word tokens without stopwords"""
+    if not text:
+        return []
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class OfferIndex:
+    """
+    Incremental BM25 index of offers, keyed by offer id
+
+    Postings live in two segments: a main segment in CSR layout (term ids
+    sorted, with an offsets array per term) and a pending segment holding the
+    postings of recently added offers. Pending postings are merged into the
+    main segment in batches, and tombstoned offers are dropped from it on
+    compaction, both with vectorized NumPy operations.
+    """
+
+    def __init__(self, max_docs: int = 50000, ttl: float = 24 * 3600, k1: float = 1.2, b: float = 0.75,
+                 merge_threshold: int = 2000):
+        self.max_docs = max_docs
+        self.ttl = ttl
+        self.k1 = k1
+        self.b = b
+        self.merge_threshold = merge_threshold
+        self._vocabulary: Dict[str, int] = {}
+        self._df = np.zeros(4096, dtype=np.int32)
+        # Per-document state, indexed by slot
+        self._slot_of: Dict[str, int] = {}
+        self._offers: List[Optional[Dict[str, Any]]] = []
+        self._doc_terms: List[Optional[np.ndarray]] = []
+        self._departments: Dict[str, int] = {}
+        self._length = np.zeros(1024, dtype=np.float32)
+        self._alive = np.zeros(1024, dtype=bool)
+        self._added_at = np.zeros(1024, dtype=np.float64)
+        self._department = np.full(1024, -1, dtype=np.int32)
+        self._total_length = 0.0
+        self._live = 0
+        # Main segment (CSR over term ids) and pending postings
+        self._terms = np.zeros(0, dtype=np.int32)
+        self._slots = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.float32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._pending: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._pending_docs = 0
+        self._last_sweep = 0.0
+        self.search_latency = LatencyStats()
+        self.counters = {"added": 0, "refreshed": 0, "expired": 0, "evicted": 0,
+                         "merges": 0, "compactions": 0}
+
+    def __len__(self) -> int:
+        return self._live
+
+    @staticmethod
+    def _grown(array: np.ndarray, size: int, fill) -> np.ndarray:
+        if size <= len(array):
+            return array
+        extra = max(size, 2 * len(array)) - len(array)
+        return np.concatenate([array, np.full(extra, fill, dtype=array.dtype)])
+
+    def _department_code(self, department: Optional[str]) -> int:
+        if not department:
+            return -1
+        return self._departments.setdefault(department, len(self._departments))
+
+    def add(self, offers: Iterable[Dict[str, Any]], department: Optional[str] = None) -> int:
+        """
+        Index offers, or refresh the age of offers already indexed
+
+        Args:
+            offers: Normalized offers; offers without an id are skipped
+            department: Department code the offers were searched in
+
+        Returns:
+            Number of newly indexed offers
+        """
+        now = time.time()
+        code = self._department_code(department)
+        vocabulary = self._vocabulary
+        added = 0
+        for offer in offers:
+            offer_id = offer.get("id")
+            if not offer_id:
+                continue
+            slot = self._slot_of.get(offer_id)
+            if slot is not None:
+                self._added_at[slot] = now
+                self.counters["refreshed"] += 1
+                continue
+
+            # The title is counted twice: it is the most specific field
+            title = offer.get("title", "")
+            counts = Counter(tokenize(f"{title} {title} {offer.get('description', '')}"))
+            ids = list(map(vocabulary.get, counts))
+            if None in ids:
+                ids = [vocabulary.setdefault(t, len(vocabulary)) for t in counts]
+            terms = np.array(ids, dtype=np.int32)
+            tfs = np.array(list(counts.values()), dtype=np.float32)
+
+            slot = len(self._offers)
+            self._length = self._grown(self._length, slot + 1, 0)
+            self._alive = self._grown(self._alive, slot + 1, False)
+            self._added_at = self._grown(self._added_at, slot + 1, 0)
+            self._department = self._grown(self._department, slot + 1, -1)
+            self._df = self._grown(self._df, len(vocabulary), 0)
+
+            self._offers.append(dict(offer))
+            self._doc_terms.append(terms)
+            self._slot_of[offer_id] = slot
+            self._df[terms] += 1
+            length = float(tfs.sum())
+            self._length[slot] = length
+            self._alive[slot] = True
+            self._added_at[slot] = now
+            self._department[slot] = code
+            self._total_length += length
+            self._live += 1
+            self._pending.append((terms, np.full(len(terms), slot, dtype=np.int32), tfs))
+            self._pending_docs += 1
+            added += 1
+        self.counters["added"] += added
+
+        if self._live > self.max_docs:
+            self._evict(self._live - self.max_docs)
+        if self._pending_docs >= self.merge_threshold:
+            self._merge()
+        return added
+
+    async def add_in_chunks(self, offers: Iterable[Dict[str, Any]], department: Optional[str] = None,
+                            chunk_size: int = 200) -> int:
+        """
+        add() for large batches (harvest writes, index syncs), yielding to the
+        event loop between chunks so requests are not stalled while tokenizing
+
+        Returns:
+            Number of newly indexed offers
+        """
+        offers = iter(offers)
+        added = 0
+        while True:
+            chunk = list(islice(offers, chunk_size))
+            if not chunk:
+                return added
+            added += self.add(chunk, department)
+            await asyncio.sleep(0)
+
+    def _merge(self) -> None:
+        """Fold pending postings into the main segment"""
+        if not self._pending:
+            return
+        terms = np.concatenate([self._terms] + [p[0] for p in self._pending])
+        slots = np.concatenate([self._slots] + [p[1] for p in self._pending])
+        tfs = np.concatenate([self._tfs] + [p[2] for p in self._pending])
+        self._pending = []
+        self._pending_docs = 0
+        self._rebuild(terms, slots, tfs)
+        self.counters["merges"] += 1
+
+    def _rebuild(self, terms: np.ndarray, slots: np.ndarray, tfs: np.ndarray) -> None:
+        # Stable sort keeps slots ascending within each term
+        order = np.argsort(terms, kind="stable")
+        self._terms, self._slots, self._tfs = terms[order], slots[order], tfs[order]
+        counts = np.bincount(self._terms, minlength=len(self._vocabulary))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def _remove(self, slot: int) -> None:
+        self._df[self._doc_terms[slot]] -= 1
+        self._slot_of.pop(self._offers[slot].get("id"), None)
+        self._total_length -= float(self._length[slot])
+        self._alive[slot] = False
+        self._offers[slot] = None
+        self._doc_terms[slot] = None
+        self._live -= 1
+
+    def _evict(self, count: int) -> None:
+        """Drop the `count` least recently refreshed offers"""
+        used = len(self._offers)
+        ages = np.where(self._alive[:used], self._added_at[:used], np.inf)
+        for slot in np.argpartition(ages, count - 1)[:count]:
+            self._remove(int(slot))
+        self.counters["evicted"] += count
+        self._maybe_compact()
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Tombstone offers not refreshed within the TTL"""
+        now = time.time() if now is None else now
+        used = len(self._offers)
+        expired = np.flatnonzero(self._alive[:used] & (self._added_at[:used] < now - self.ttl))
+        for slot in expired:
+            self._remove(int(slot))
+        self.counters["expired"] += len(expired)
+        self._last_sweep = now
+        self._maybe_compact()
+        return len(expired)
+
+    def _maybe_compact(self) -> None:
+        """Renumber live offers and drop tombstoned postings once they pile up"""
+        used = len(self._offers)
+        if used - self._live < max(1000, self._live // 4):
+            return
+        self._merge()
+        alive = self._alive[:used]
+        keep = np.flatnonzero(alive)
+        renumber = np.cumsum(alive, dtype=np.int32) - 1
+
+        live_postings = alive[self._slots]
+        self._rebuild(self._terms[live_postings], renumber[self._slots[live_postings]], self._tfs[live_postings])
+
+        self._offers = [self._offers[slot] for slot in keep]
+        self._doc_terms = [self._doc_terms[slot] for slot in keep]
+        self._slot_of = {offer.get("id"): slot for slot, offer in enumerate(self._offers)}
+        live = len(keep)
+        for name in ("_length", "_added_at", "_department"):
+            array = getattr(self, name)
+            array[:live] = array[keep]
+        self._alive[:] = False
+        self._alive[:live] = True
+        self.counters["compactions"] += 1
+
+    def _postings(self, term_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(slots, tfs, query position) of every posting of the given terms"""
+        indexed = len(self._offsets) - 1
+        parts = []
+        for position, term in enumerate(term_ids):
+            if term < indexed:
+                start, end = self._offsets[term], self._offsets[term + 1]
+                if end > start:
+                    parts.append((self._slots[start:end], self._tfs[start:end],
+                                  np.full(end - start, position, dtype=np.int32)))
+        for terms, slots, tfs in self._pending:
+            hits = np.flatnonzero(np.isin(terms, term_ids))
+            if len(hits):
+                positions = np.searchsorted(term_ids, terms[hits])
+                parts.append((slots[hits], tfs[hits], positions.astype(np.int32)))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, np.zeros(0, dtype=np.float32), empty
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def search(self, text: str, k: int = 15, department: Optional[str] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Rank indexed offers against a query text with BM25
+
+        Args:
+            text: Query, e.g. a profile's title, skills and summary
+            k: Number of offers to return
+            department: Only rank offers searched in this department
+
+        Returns:
+            Up to k (offer copy, score) pairs, best first, all with a positive score
+        """
+        if time.time() - self._last_sweep > 60:
+            self.expire()
+        with self.search_latency.time():
+            used = len(self._offers)
+            counts = Counter(tokenize(text))
+            known = sorted((self._vocabulary[t], n) for t, n in counts.items() if t in self._vocabulary)
+            if not used or not known or not self._live:
+                return []
+            term_ids = np.array([term for term, _ in known], dtype=np.int32)
+            weights = np.array([n for _, n in known], dtype=np.float32)
+
+            df = self._df[term_ids].astype(np.float32)
+            idf = np.log1p((self._live - df + 0.5) / (df + 0.5))
+            slots, tfs, positions = self._postings(term_ids)
+            if not len(slots):
+                return []
+
+            avg_length = self._total_length / self._live
+            norm = self.k1 * (1 - self.b + self.b * self._length[slots] / avg_length)
+            contribution = (weights * idf)[positions] * tfs * (self.k1 + 1) / (tfs + norm)
+            scores = np.bincount(slots, weights=contribution, minlength=used)
+
+            eligible = self._alive[:used]
+            if department is not None:
+                eligible = eligible & (self._department[:used] == self._departments.get(department, -2))
+            scores[~eligible] = 0
+
+            # Linear-time selection of the k best, then a sort of those k only
+            k = min(k, used)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(dict(self._offers[slot]), float(scores[slot])) for slot in top if scores[slot] > 0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "documents": self._live,
+            "tombstones": len(self._offers) - self._live,
+            "terms": len(self._vocabulary),
+            "postings": len(self._terms),
+            "pending_documents": self._pending_docs,
+            "search": self.search_latency.stats()
+        }
+
+
+# Singleton instance
+offer_index = OfferIndex(
+    max_docs=int(os.environ.get('RANKING_INDEX_MAX_DOCS', 50000)),
+    ttl=float(os.environ.get('RANKING_INDEX_TTL', 24 * 3600))
+)
@@ -0,0 +1,264 @@
+"""
+Precomputed job recommendations
+A background engine periodically ranks France Travail offers for each active
+user's profile and stores the result in db.recommendations, so that
+/api/recommendations is a single indexed read. Profile saves and first views
+mark the feed dirty and wake the engine so it is computed promptly; reads
+never compute. A failed computation keeps the previous feed and leaves it
+dirty, so it is retried once its lease expires.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from .metrics import LatencyStats
+from .offer_harvester import offer_harvester
+from .ranking import offer_index
+from .skill_matcher import get_matcher
+
+logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+class RecommendationEngine:
+    """Background computation of per-user ranked offer feeds"""
+
+    def __init__(self, interval: float = 300, feed_ttl: float = 6 * 3600, active_days: int = 14,
+                 concurrency: int = 4, feed_size: int = 15, lease_seconds: int = 120, max_offers: int = 450):
+        self.interval = interval
+        self.feed_ttl = feed_ttl
+        self.active_days = active_days
+        self.concurrency = concurrency
+        self.feed_size = feed_size
+        self.lease_seconds = lease_seconds
+        self.max_offers = max_offers
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self.compute_latency = LatencyStats()
+        self.counters = {"computed": 0, "failed": 0, "first_views": 0, "reads": 0, "local": 0}
+
+    def configure(self, db) -> None:
+        self._db = db
+
+    async def compute_for(self, user_id: str, profile: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Rank offers for one user's profile and store the feed
+
+        Raises:
+            Exception: if the offers API and its cache both fail; the stored
+                feed is left untouched
+        """
+        from .jobs_api import cached_search, iter_offers, resolve_department
+
+        db = self._db
+        if profile is None:
+            profile = await db.profiles.find_one({"user_id": user_id}, {"_id": 0})
+        if not profile:
+            # Profile gone: drop the feed so the loop stops claiming it
+            await db.recommendations.delete_one({"user_id": user_id, "computed_at": {"$exists": True}})
+            return None
+
+        with self.compute_latency.time():
+            keywords = profile.get("title", "Développeur")
+            location = profile.get("location", "Paris")
+            skills = profile.get("skills") or []
+
+            department = resolve_department(location)
+            matcher = get_matcher(skills)
+
+            offers = []
+            if offer_harvester.covers(department):
+                # Harvested department: candidates come from the local index below
+                self.counters["local"] += 1
+            else:
+                # Score pages as they arrive instead of waiting for the last one
+                try:
+                    async for page in iter_offers(keywords, department, location, max_results=self.max_offers):
+                        offer_index.add(page, department)
+                        for offer, score in zip(page, matcher.score_many([o.get("description", "") for o in page])):
+                            offer["match_score"] = score
+                        offers += page
+                except Exception as e:
+                    # Real offers only: mock data must never be stored as a feed
+                    logger.warning(f"Offer paging failed for {user_id}, using the cached search: {e}")
+                    offers = await cached_search(keywords, location)
+                    for offer, score in zip(offers, matcher.score_many([o.get("description", "") for o in offers])):
+                        offer["match_score"] = score
+
+            # Widen the candidates with recently fetched offers from the same
+            # department that the local BM25 index ranks highest
+            query = " ".join(part for part in [keywords, keywords, *skills, profile.get("summary")] if part)
+            ranked = offer_index.search(query, k=self.feed_size * 3, department=department)
+            relevance = {offer["id"]: score for offer, score in ranked}
+            seen = {offer.get("id") for offer in offers}
+            extra = [offer for offer, _ in ranked if offer["id"] not in seen]
+            for offer, score in zip(extra, matcher.score_many([o.get("description", "") for o in extra])):
+                offer["match_score"] = score
+            offers += extra
+
+            top_relevance = max(relevance.values(), default=0) or 1
+            for offer in offers:
+                offer["relevance"] = round(100 * relevance.get(offer.get("id"), 0) / top_relevance)
+            offers.sort(key=lambda x: x["match_score"] + x["relevance"], reverse=True)
+            offers = offers[:self.feed_size]
+
+            # Keep the first time each offer entered the feed, for delta reads
+            previous = await db.recommendations.find_one(
+                {"user_id": user_id}, {"_id": 0, "offers.id": 1, "offers.feed_added_at": 1}
+            )
+            added_at = {o.get("id"): o.get("feed_added_at") for o in (previous or {}).get("offers", []) if o.get("id")}
+            computed_at = _iso(_now())
+            for offer in offers:
+                offer["feed_added_at"] = added_at.get(offer.get("id")) or computed_at
+
+            feed = await db.recommendations.find_one_and_update(
+                {"user_id": user_id},
+                {"$set": {
+                    "offers": offers,
+                    "computed_at": computed_at,
+                    "dirty": False,
+                    "lease_until": None
+                }, "$setOnInsert": {"last_read_at": computed_at}},
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        self.counters["computed"] += 1
+        return feed
+
+    async def mark_dirty(self, user_id: str) -> None:
+        """Flag a user's feed for recomputation, e.g. after a profile save"""
+        await self._db.recommendations.update_one(
+            {"user_id": user_id},
+            {"$set": {"dirty": True}, "$setOnInsert": {"last_read_at": _iso(_now())}},
+            upsert=True
+        )
+        self._wake.set()
+
+    async def get_feed(self, user_id: str, since: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Read a user's feed; on first view it is queued for the engine and an
+        empty pending feed is returned
+
+        Args:
+            user_id: Owner of the feed
+            since: Cursor from a previous read; only offers that entered the
+                feed after it are returned
+
+        Returns:
+            The feed document, or None if the user has no profile yet
+        """
+        db = self._db
+        self.counters["reads"] += 1
+        feed = await db.recommendations.find_one({"user_id": user_id}, {"_id": 0})
+
+        if not feed or "computed_at" not in feed:
+            if not await db.profiles.find_one({"user_id": user_id}, {"_id": 1}):
+                return None
+            self.counters["first_views"] += 1
+            await self.mark_dirty(user_id)
+            return {"offers": [], "computed_at": None, "pending": True}
+        else:
+            # Activity tracking for the refresh loop, written at most hourly
+            last_read_at = feed.get("last_read_at")
+            now = _now()
+            if not last_read_at or last_read_at < _iso(now - timedelta(hours=1)):
+                await db.recommendations.update_one({"user_id": user_id}, {"$set": {"last_read_at": _iso(now)}})
+            if feed.get("dirty"):
+                self._wake.set()
+
+        if since:
+            feed["offers"] = [o for o in feed.get("offers", []) if o.get("feed_added_at", "") > since]
+        return feed
+
+    async def _claim(self) -> Optional[str]:
+        """Lease the next feed that is dirty, or stale and recently read"""
+        now = _now()
+        due = {"$or": [
+            {"dirty": True},
+            {"computed_at": {"$lt": _iso(now - timedelta(seconds=self.feed_ttl))},
+             "last_read_at": {"$gte": _iso(now - timedelta(days=self.active_days))}}
+        ]}
+        free = {"$or": [{"lease_until": None}, {"lease_until": {"$lt": _iso(now)}}]}
+        doc = await self._db.recommendations.find_one_and_update(
+            {"$and": [due, free]},
+            {"$set": {"lease_until": _iso(now + timedelta(seconds=self.lease_seconds))}},
+            projection={"user_id": 1},
+            sort=[("dirty", -1), ("computed_at", 1)]
+        )
+        return doc["user_id"] if doc else None
+
+    async def _worker(self) -> None:
+        while True:
+            user_id = await self._claim()
+            if user_id is None:
+                return
+            try:
+                await self.compute_for(user_id)
+            except Exception as e:
+                self.counters["failed"] += 1
+                logger.warning(f"Recommendation refresh failed for {user_id}: {e}")
+                # The lease is kept, so the retry waits for it to expire
+                try:
+                    await self._db.recommendations.update_one({"user_id": user_id}, {"$set": {"dirty": True}})
+                except PyMongoError as e:
+                    logger.warning(f"Could not mark the feed of {user_id} dirty: {e}")
+
+    async def run_once(self) -> None:
+        """Refresh every due feed with bounded concurrency"""
+        await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.run_once()
+            except PyMongoError as e:
+                logger.warning(f"Recommendation engine pass failed: {e}")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "running": self._task is not None and not self._task.done(),
+            "compute": self.compute_latency.stats()
+        }
+
+
+# Singleton instance
+recommendation_engine = RecommendationEngine(
+    interval=float(os.environ.get('RECOMMENDATIONS_INTERVAL', 300)),
+    feed_ttl=float(os.environ.get('RECOMMENDATIONS_FEED_TTL', 6 * 3600)),
+    active_days=int(os.environ.get('RECOMMENDATIONS_ACTIVE_DAYS', 14)),
+    concurrency=int(os.environ.get('RECOMMENDATIONS_CONCURRENCY', 4)),
+    max_offers=int(os.environ.get('RECOMMENDATIONS_MAX_OFFERS', 450))
+)
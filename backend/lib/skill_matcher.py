@@ -0,0 +1,262 @@
+"""
+Skill matching for offer scoring
+Compiles a profile's skills, with their synonyms, into one Aho-Corasick
+automaton over accent-folded text, so a batch of offers is scanned in a single
+pass whatever the number of skills. Folded descriptions are cached, as the
+same offers are scored for every profile of a department. Matches respect word boundaries where "+",
+"#" and "." belong to the word (C, C++, C#, Node.js): "C" no longer matches
+every description and "développeur" matches "developpeur".
+"""
+import codecs
+import logging
+import os
+import re
+import string
+import unicodedata
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterator, List, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import ahocorasick
+except ImportError:  # pragma: no cover - optional C extension
+    ahocorasick = None
+    logger.warning("pyahocorasick is not installed, skill matching falls back to a compiled regex")
+
+# Equivalent spellings, written folded; a skill matching any member matches all
+SYNONYM_GROUPS: List[Tuple[str, ...]] = [
+    ("javascript", "js", "ecmascript"),
+    ("typescript", "ts"),
+    ("kubernetes", "k8s"),
+    ("node.js", "nodejs", "node"),
+    ("react", "reactjs", "react.js"),
+    ("vue.js", "vuejs", "vue"),
+    ("angular", "angularjs"),
+    ("postgresql", "postgres"),
+    ("c#", "csharp"),
+    ("c++", "cpp"),
+    ("golang", "go lang"),
+    ("machine learning", "ml", "apprentissage automatique"),
+    ("intelligence artificielle", "ia", "artificial intelligence"),
+    ("ci/cd", "cicd", "integration continue"),
+    ("amazon web services", "aws"),
+    ("google cloud", "gcp"),
+]
+
+
+def _ascii(text: str) -> str:
+    """Diacritics stripped, anything without an ASCII decomposition dropped"""
+    return unicodedata.normalize("NFKD", text.replace("’", "'")).encode("ascii", "ignore").decode()
+
+
+# Byte table for folded text, indexed by Latin-1 byte: lowercase, and
+# punctuation that separates words becomes a space. "+", "#", "." and "_"
+# belong to words (C++, C#, Node.js); the apostrophe is handled in _prepare.
+# Latin-1 letters map to their ASCII decomposition (é -> e), and the bytes
+# in _FOLD_DROPPED have none.
+_FOLD_TABLE = bytearray(range(256))
+for _char in string.punctuation + string.whitespace:
+    if _char not in "+#._'":
+        _FOLD_TABLE[ord(_char)] = ord(" ")
+for _char in string.ascii_uppercase:
+    _FOLD_TABLE[ord(_char)] = ord(_char.lower())
+_FOLD_DROPPED = bytearray()
+for _byte in range(128, 256):
+    _folded = _ascii(chr(_byte))
+    if len(_folded) == 1:
+        _FOLD_TABLE[_byte] = _FOLD_TABLE[ord(_folded)]
+    elif not _folded:
+        _FOLD_DROPPED.append(_byte)
+_FOLD_TABLE = bytes(_FOLD_TABLE)
+_FOLD_DROPPED = bytes(_FOLD_DROPPED)
+# The Latin-1 characters folding to several ASCII characters
+_FOLD_EXPANDED = {chr(byte): _ascii(chr(byte)) for byte in range(128, 256) if len(_ascii(chr(byte))) > 1}
+
+
+@lru_cache(maxsize=4096)
+def _ascii_run(run: str) -> str:
+    return _ascii(run)
+
+
+def _fold_outside_latin1(error: UnicodeEncodeError) -> Tuple[str, int]:
+    """Encoding error handler: characters outside Latin-1 (’, œ, €) folded to ASCII"""
+    return _ascii_run(error.object[error.start:error.end]), error.end
+
+
+codecs.register_error("skill_matcher.fold", _fold_outside_latin1)
+
+_WORD_CHARS = frozenset(string.ascii_lowercase + string.digits + "_+#")
+# Joins offers in score_many; survives folding and is never part of a word
+_OFFER_SEPARATOR = "\x00"
+
+
+def _prepare(text: str) -> str:
+    """
+    Strip diacritics and drop anything without an ASCII decomposition, in C:
+    Latin-1 encode, byte-table translate. The few characters outside Latin-1
+    (’, œ) go through NFKD in the encoding error handler, which is cheaper
+    than normalizing the whole text. Words are separated by exactly one
+    space and the text is padded with spaces, so every word starts after a
+    space and patterns are anchored on it. "l'IA" becomes "l' ia" and
+    matches "IA", while "c'est" still does not match "C".
+    """
+    if text.isascii():
+        raw = text.encode().translate(_FOLD_TABLE)
+    else:
+        for char, folded in _FOLD_EXPANDED.items():
+            if char in text:
+                text = text.replace(char, folded)
+        raw = text.encode("latin-1", "skill_matcher.fold").translate(_FOLD_TABLE, _FOLD_DROPPED)
+    folded = b" " + raw.replace(b"'", b"' ") + b" "
+    while b"  " in folded:
+        folded = folded.replace(b"  ", b" ")
+    return folded.decode()
+
+
+@lru_cache(maxsize=int(os.environ.get('SKILL_MATCHER_CACHE_SIZE', 20000)))
+def _prepared(description: str) -> str:
+    """Prepared description, cached: the same offers are scored for every profile of a department"""
+    return _prepare(description)
+
+
+def _term(text: str) -> str:
+    """Folded skill, as it appears in prepared text"""
+    return _prepare(text).strip()
+
+
+_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    _term(term): tuple(_term(t) for t in group) for group in SYNONYM_GROUPS for term in group
+}
+
+
+def _trie_pattern(terms: Sequence[str]) -> str:
+    """Regex alternation factored as a character trie, used without pyahocorasick"""
+    trie: Dict = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node: Dict) -> str:
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+class SkillMatcher:
+    """Matches one profile's skills against offer descriptions"""
+
+    def __init__(self, skills: Sequence[str]):
+        self.skills: List[str] = []
+        variants: Dict[str, Set[int]] = {}
+        for skill in skills:
+            term = _term(skill or "")
+            if not term or term in self.skills:
+                continue
+            index = len(self.skills)
+            self.skills.append(term)
+            for variant in _SYNONYMS.get(term, (term,)):
+                variants.setdefault(variant, set()).add(index)
+        self._variants: Dict[str, FrozenSet[int]] = {v: frozenset(i) for v, i in variants.items()}
+
+        self._automaton = None
+        self._regex = None
+        if not self._variants:
+            return
+        if ahocorasick is not None:
+            # A word ends before a space, or before a "." that ends a sentence
+            # (checked in _hits); "react.js" and "c'est" do not end at "react", "c"
+            self._automaton = ahocorasick.Automaton()
+            for variant, indices in self._variants.items():
+                self._automaton.add_word(f" {variant} ", (indices, False))
+                self._automaton.add_word(f" {variant}.", (indices, True))
+            self._automaton.make_automaton()
+        else:
+            # Lookahead so that overlapping matches ("machine learning" and
+            # "learning") are all reported, as the automaton does
+            self._regex = re.compile(
+                r"(?<= )(?=(" + _trie_pattern(list(self._variants)) + r")(?![\w+#']|\.\w))"
+            )
+
+    def _hits(self, text: str) -> Iterator[Tuple[int, FrozenSet[int]]]:
+        """(position, skill indices) for every whole-word match in prepared text"""
+        if self._automaton is not None:
+            for end, (indices, dotted) in self._automaton.iter(text):
+                if not dotted or text[end + 1] not in _WORD_CHARS:
+                    yield end, indices
+        elif self._regex is not None:
+            for match in self._regex.finditer(text):
+                yield match.start(), self._variants[match.group(1)]
+
+    def matched(self, description: str) -> Set[str]:
+        """Skills (folded) found in the description"""
+        if not self._variants or not description:
+            return set()
+        found: Set[int] = set()
+        for _, indices in self._hits(_prepared(description)):
+            found |= indices
+        return {self.skills[i] for i in found}
+
+    def _score(self, matches: int) -> int:
+        score = int((matches / len(self.skills)) * 100)
+        return min(max(score, 10), 100)  # Minimum 10%, max 100%
+
+    def score(self, description: str) -> int:
+        """Match score as percentage (10-100), 50 when there is nothing to compare"""
+        if not self._variants or not description:
+            return 50
+        return self._score(len(self.matched(description)))
+
+    def score_many(self, descriptions: Sequence[str]) -> List[int]:
+        """
+        Score a batch of descriptions in a single scan of their concatenation
+
+        Args:
+            descriptions: Offer description texts
+
+        Returns:
+            One score per description, as score() would return it
+        """
+        if not self._variants:
+            return [50] * len(descriptions)
+
+        # Descriptions folded once across profiles, then one automaton pass over the whole batch
+        parts = [_prepared(text) if text else " " for text in descriptions]
+        prepared = _OFFER_SEPARATOR.join(parts)
+        starts = []
+        offset = 0
+        for part in parts:
+            starts.append(offset)
+            offset += len(part) + len(_OFFER_SEPARATOR)
+
+        found: List[Set[int]] = [set() for _ in descriptions]
+        for position, indices in self._hits(prepared):
+            found[bisect_right(starts, position) - 1] |= indices
+
+        return [
+            self._score(len(hits)) if text else 50
+            for text, hits in zip(descriptions, found)
+        ]
+
+
+@lru_cache(maxsize=1024)
+def _cached_matcher(skills: Tuple[str, ...]) -> SkillMatcher:
+    return SkillMatcher(skills)
+
+
+def get_matcher(skills: Sequence[str]) -> SkillMatcher:
+    """Compiled matcher for a skill list, reused across calls"""
+    return _cached_matcher(tuple(skills or ()))
+
+
+def clear_cache() -> None:
+    """Forget compiled matchers and prepared descriptions"""
+    _cached_matcher.cache_clear()
+    _prepared.cache_clear()
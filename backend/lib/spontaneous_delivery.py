@@ -0,0 +1,496 @@
+"""
+Spontaneous application delivery
+POST /spontaneous/send only queues applications; this worker delivers them.
+It claims queued rows of db.spontaneous_applications in batches, renders one
+message per company from the candidate's profile and the company snapshot
+saved when it was found by search_companies, and sends them over a pool of
+persistent SMTP connections, each carrying many messages per session.
+Deliveries are rate limited per recipient domain, transient failures are
+retried with backoff, and each row moves queued -> sending -> sent | failed.
+A failed delivery gives the candidate's credit back.
+
+Delivery is enabled when SMTP_HOST and SMTP_FROM are set; until then
+POST /spontaneous/send is refused.
+"""
+import asyncio
+import logging
+import os
+import random
+import smtplib
+import ssl
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from .credit_ledger import UNLIMITED_PLANS, credit_ledger
+from .metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+SUBJECT_TEMPLATE = "Candidature spontanée - {title}"
+
+BODY_TEMPLATE = """Madame, Monsieur,
+
+{intro} je me permets de vous adresser ma candidature spontanée au sein de {company}{sector}.
+
+{summary}{skills}
+
+Je serais ravi(e) d'échanger avec vous sur les besoins de {company} et sur la manière dont je pourrais y contribuer. Vous pouvez me joindre en répondant directement à ce message{phone}.
+
+Je vous prie d'agréer, Madame, Monsieur, l'expression de mes salutations distinguées.
+
+{name}
+"""
+
+
+class PermanentDeliveryError(Exception):
+    """Delivery cannot succeed by retrying (no address, recipient refused)"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+
+def render_message(user: Dict[str, Any], profile: Optional[Dict[str, Any]],
+                   company: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Subject and plain text body of one application
+
+    Args:
+        user: Candidate user document (name, email)
+        profile: Candidate master profile, if any
+        company: Company snapshot from search_companies
+
+    Returns:
+        (subject, body)
+    """
+    profile = profile or {}
+    title = profile.get("title") or "Candidature"
+    location = profile.get("location")
+    intro = f"{title}{f' basé(e) à {location}' if location else ''},"
+    skills = profile.get("skills") or []
+    body = BODY_TEMPLATE.format(
+        intro=intro,
+        company=company.get("name") or "votre entreprise",
+        sector=f", acteur du secteur {company['sector'].lower()}" if company.get("sector") else "",
+        summary=(profile.get("summary") or "").strip(),
+        skills=f"\n\nMes principales compétences : {', '.join(skills[:8])}." if skills else "",
+        phone=f" ou par téléphone au {profile['phone']}" if profile.get("phone") else "",
+        name=user.get("name") or ""
+    )
+    return SUBJECT_TEMPLATE.format(title=title), body
+
+
+class TokenBucket:
+    """`rate` sends per second with bursts of `burst`"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Wait for a token; returns the seconds waited"""
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            wait = 0.0
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+                self.updated = time.monotonic()
+                self.tokens = 1.0
+            self.tokens -= 1
+            return wait
+
+
+class SMTPPool:
+    """
+    Persistent SMTP sessions shared by the delivery tasks. smtplib is
+    blocking, so each send runs in a thread; a session is reused for many
+    messages and replaced when the server drops it.
+    """
+
+    def __init__(self, host: str, port: int = 587, username: Optional[str] = None,
+                 password: Optional[str] = None, starttls: bool = True, use_ssl: bool = False,
+                 size: int = 4, timeout: float = 30, max_messages: int = 100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.size = size
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+        self.counters = {"connections": 0, "reconnects": 0}
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                    context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls(context=ssl.create_default_context())
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        smtp.messages_sent = 0
+        self.counters["connections"] += 1
+        return smtp
+
+    @staticmethod
+    def _quit(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def _send(self, session: List[Optional[smtplib.SMTP]], message: EmailMessage) -> None:
+        """Send on session[0], opening or replacing it as needed"""
+        if session[0] is None:
+            session[0] = self._connect()
+        try:
+            session[0].send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Idle session closed by the server: one fresh attempt
+            self.counters["reconnects"] += 1
+            session[0].close()
+            session[0] = None
+            session[0] = self._connect()
+            session[0].send_message(message)
+        session[0].messages_sent += 1
+
+    async def send(self, message: EmailMessage) -> None:
+        async with self._slots:
+            session = [None if self._idle.empty() else self._idle.get_nowait()]
+            try:
+                await asyncio.to_thread(self._send, session, message)
+            except smtplib.SMTPResponseException:
+                # Refused by the server, which reset the transaction: the session is still usable
+                if session[0] is not None:
+                    self._idle.put_nowait(session[0])
+                raise
+            except BaseException:
+                if session[0] is not None:
+                    await asyncio.to_thread(session[0].close)
+                raise
+            if session[0].messages_sent >= self.max_messages:
+                await asyncio.to_thread(self._quit, session[0])
+            else:
+                self._idle.put_nowait(session[0])
+
+    async def close(self) -> None:
+        while not self._idle.empty():
+            await asyncio.to_thread(self._quit, self._idle.get_nowait())
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "size": self.size, "idle": self._idle.qsize()}
+
+
+class SpontaneousDelivery:
+    """Batch worker moving spontaneous applications from queued to sent"""
+
+    def __init__(self, pool: Optional[SMTPPool], sender: Optional[str], sender_name: str = "Joboost",
+                 batch_size: int = 50, poll_interval: float = 5, max_attempts: int = 5, backoff: float = 60,
+                 domain_rate: float = 1.0, domain_burst: int = 5, lease_seconds: int = 600):
+        self.pool = pool
+        self.sender = sender
+        self.sender_name = sender_name
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.lease_seconds = lease_seconds
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.send_time = LatencyStats()
+        self.counters = {"batches": 0, "sent": 0, "failed": 0, "retried": 0, "requeued": 0,
+                         "throttled_seconds": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.pool is not None and bool(self.sender)
+
+    def configure(self, db) -> None:
+        self._db = db
+
+    def notify(self) -> None:
+        """New applications were queued"""
+        self._wake.set()
+
+    async def remember_companies(self, companies: Sequence[Dict[str, Any]]) -> None:
+        """Snapshot search results into db.companies so queued applications can be rendered later"""
+        if not companies:
+            return
+        now = _iso(_now())
+        try:
+            await self._db.companies.bulk_write(
+                [UpdateOne({"id": company["id"]}, {"$set": {**company, "seen_at": now}}, upsert=True)
+                 for company in companies if company.get("id")],
+                ordered=False
+            )
+        except PyMongoError as e:
+            logger.warning(f"Company snapshot failed: {e}")
+
+    def _bucket(self, domain: str) -> TokenBucket:
+        if domain not in self._buckets:
+            self._buckets[domain] = TokenBucket(self.domain_rate, self.domain_burst)
+        return self._buckets[domain]
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        """Lease a batch of due applications, oldest first"""
+        db = self._db
+        now = _now()
+        ids = [doc["_id"] async for doc in db.spontaneous_applications.find(
+            {"status": "queued", "available_at": {"$lte": _iso(now)}}, {"_id": 1}
+        ).sort("available_at", 1).limit(self.batch_size)]
+        if not ids:
+            return []
+        claim_id = f"claim_{uuid.uuid4().hex[:12]}"
+        # Rows claimed by another worker in between no longer match status=queued
+        await db.spontaneous_applications.update_many(
+            {"_id": {"$in": ids}, "status": "queued"},
+            {"$set": {"status": "sending", "claim_id": claim_id,
+                      "lease_until": _iso(now + timedelta(seconds=self.lease_seconds))},
+             "$inc": {"attempts": 1}}
+        )
+        return [doc async for doc in db.spontaneous_applications.find({"claim_id": claim_id})]
+
+    async def _requeue_expired(self) -> None:
+        """Rows whose worker died mid-batch go back to the queue, or fail once out of attempts"""
+        db = self._db
+        now = _iso(_now())
+        expired = {"status": "sending", "lease_until": {"$lt": now}}
+        failed = []
+        async for row in db.spontaneous_applications.find(
+            {**expired, "attempts": {"$gte": self.max_attempts}}, {"_id": 1, "user_id": 1}
+        ):
+            # Conditional, so a row reaped concurrently is only failed (and refunded) once
+            result = await db.spontaneous_applications.update_one(
+                {"_id": row["_id"], **expired},
+                {"$set": {"status": "failed", "error": "Échec de l'envoi", "lease_until": None},
+                 "$unset": {"claim_id": ""}}
+            )
+            if result.modified_count:
+                failed.append(row)
+        if failed:
+            self.counters["failed"] += len(failed)
+            logger.error(f"{len(failed)} spontaneous application(s) failed after {self.max_attempts} expired leases")
+            await self._refund(failed)
+        result = await db.spontaneous_applications.update_many(
+            expired,
+            {"$set": {"status": "queued", "available_at": now, "lease_until": None}, "$unset": {"claim_id": ""}}
+        )
+        self.counters["requeued"] += result.modified_count
+
+    async def _refund(self, rows: List[Dict[str, Any]], users: Optional[Dict[str, Any]] = None) -> None:
+        """Give back the credit of each failed row, except to unlimited plans"""
+        if users is None:
+            users = {doc["user_id"]: doc async for doc in self._db.users.find(
+                {"user_id": {"$in": list({row["user_id"] for row in rows})}},
+                {"_id": 0, "user_id": 1, "subscription_plan": 1}
+            )}
+        refunds: Dict[str, int] = {}
+        for row in rows:
+            user = users.get(row["user_id"])
+            if user and user.get("subscription_plan") not in UNLIMITED_PLANS:
+                refunds[row["user_id"]] = refunds.get(row["user_id"], 0) + 1
+        for user_id, count in refunds.items():
+            await credit_ledger.refund(user_id, "spontaneous_credits", count, reason="spontaneous delivery failed")
+
+    async def _context(self, rows: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+        """Users, profiles and companies of a batch, one query each"""
+        db = self._db
+        user_ids = list({row["user_id"] for row in rows})
+        company_ids = list({row["company_id"] for row in rows})
+        users = {doc["user_id"]: doc async for doc in db.users.find(
+            {"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "name": 1, "email": 1, "subscription_plan": 1}
+        )}
+        profiles = {doc["user_id"]: doc async for doc in db.profiles.find(
+            {"user_id": {"$in": user_ids}},
+            {"_id": 0, "user_id": 1, "title": 1, "summary": 1, "skills": 1, "location": 1, "phone": 1}
+        )}
+        companies = {doc["id"]: doc async for doc in db.companies.find(
+            {"id": {"$in": company_ids}}, {"_id": 0}
+        )}
+        return users, profiles, companies
+
+    def _message(self, row: Dict[str, Any], user: Optional[Dict[str, Any]], profile: Optional[Dict[str, Any]],
+                 company: Optional[Dict[str, Any]]) -> EmailMessage:
+        if user is None:
+            raise PermanentDeliveryError("Utilisateur supprimé")
+        if company is None:
+            raise PermanentDeliveryError("Entreprise inconnue")
+        if not company.get("email"):
+            raise PermanentDeliveryError("Aucune adresse email pour cette entreprise")
+        subject, body = render_message(user, profile, company)
+        message = EmailMessage()
+        message["From"] = formataddr((user.get("name") or self.sender_name, self.sender))
+        message["Reply-To"] = formataddr((user.get("name") or "", user["email"]))
+        message["To"] = company["email"]
+        message["Subject"] = subject
+        message["Message-ID"] = make_msgid(domain=self.sender.rsplit("@", 1)[-1])
+        message.set_content(body)
+        return message
+
+    async def _deliver(self, row: Dict[str, Any], message: EmailMessage) -> None:
+        domain = message["To"].rsplit("@", 1)[-1].lower()
+        self.counters["throttled_seconds"] += await self._bucket(domain).acquire()
+        try:
+            with self.send_time.time():
+                await self.pool.send(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            codes = [code for code, _ in e.recipients.values()]
+            if all(code >= 500 for code in codes):
+                raise PermanentDeliveryError(f"Adresse refusée ({codes[0]})")
+            raise
+        except smtplib.SMTPDataError as e:
+            if e.smtp_code >= 500:
+                raise PermanentDeliveryError(f"Message refusé ({e.smtp_code})")
+            raise
+
+    async def run_once(self) -> int:
+        """
+        Deliver one batch
+
+        Returns:
+            Number of applications processed (sent, failed or rescheduled)
+        """
+        rows = await self._claim()
+        if not rows:
+            return 0
+        users, profiles, companies = await self._context(rows)
+
+        async def process(row: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            try:
+                message = self._message(row, users.get(row["user_id"]), profiles.get(row["user_id"]),
+                                        companies.get(row["company_id"]))
+                await self._deliver(row, message)
+            except PermanentDeliveryError as e:
+                return row, {"status": "failed", "error": str(e)}
+            except (smtplib.SMTPException, OSError) as e:
+                attempts = row.get("attempts", 1)
+                if attempts >= self.max_attempts:
+                    return row, {"status": "failed", "error": f"Échec de l'envoi: {e}"}
+                # Exponential backoff with jitter, so a greylisting server is not hit again in lockstep
+                delay = self.backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.5)
+                self.counters["retried"] += 1
+                return row, {"status": "queued", "last_error": str(e),
+                             "available_at": _iso(_now() + timedelta(seconds=delay))}
+            except Exception as e:
+                # e.g. a company email with a line break; one bad row must not lose the batch
+                logger.exception(f"Spontaneous application {row['_id']} could not be delivered")
+                return row, {"status": "failed", "error": f"Échec de l'envoi: {e}"}
+            return row, {"status": "sent", "sent_at": _iso(_now()), "to": message["To"]}
+
+        results = await asyncio.gather(*(process(row) for row in rows))
+        await self._db.spontaneous_applications.bulk_write(
+            [UpdateOne({"_id": row["_id"]}, {"$set": {**update, "lease_until": None}, "$unset": {"claim_id": ""}})
+             for row, update in results],
+            ordered=False
+        )
+
+        failed = [row for row, update in results if update["status"] == "failed"]
+        self.counters["sent"] += sum(1 for _, update in results if update["status"] == "sent")
+        self.counters["failed"] += len(failed)
+        if failed:
+            await self._refund(failed, users)
+        self.counters["batches"] += 1
+        return len(rows)
+
+    async def _loop(self) -> None:
+        last_reap = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_reap > self.lease_seconds / 2:
+                    last_reap = time.monotonic()
+                    await self._requeue_expired()
+                if await self.run_once():
+                    continue
+            except PyMongoError as e:
+                logger.warning(f"Spontaneous delivery pass failed: {e}")
+            except Exception:
+                # Keep the worker alive; leased rows are requeued when their lease expires
+                logger.exception("Spontaneous delivery pass failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self) -> None:
+        if not self.enabled:
+            logger.info("Spontaneous delivery disabled: SMTP_HOST / SMTP_FROM not set")
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.pool is not None:
+            await self.pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "throttled_seconds": round(self.counters["throttled_seconds"], 1),
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "domains": len(self._buckets),
+            "send": self.send_time.stats(),
+            "smtp": self.pool.stats() if self.pool is not None else None
+        }
+
+
+def _pool() -> Optional[SMTPPool]:
+    host = os.environ.get('SMTP_HOST')
+    if not host:
+        return None
+    return SMTPPool(
+        host,
+        port=int(os.environ.get('SMTP_PORT', 587)),
+        username=os.environ.get('SMTP_USERNAME') or None,
+        password=os.environ.get('SMTP_PASSWORD') or None,
+        starttls=os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true',
+        use_ssl=os.environ.get('SMTP_SSL', 'false').lower() == 'true',
+        size=int(os.environ.get('SMTP_POOL_SIZE', 4)),
+        timeout=float(os.environ.get('SMTP_TIMEOUT', 30))
+    )
+
+
+# Singleton instance
+spontaneous_delivery = SpontaneousDelivery(
+    _pool(),
+    sender=os.environ.get('SMTP_FROM'),
+    batch_size=int(os.environ.get('DELIVERY_BATCH_SIZE', 50)),
+    max_attempts=int(os.environ.get('DELIVERY_MAX_ATTEMPTS', 5)),
+    backoff=float(os.environ.get('DELIVERY_BACKOFF', 60)),
+    domain_rate=float(os.environ.get('DELIVERY_DOMAIN_RATE', 1.0)),
+    domain_burst=int(os.environ.get('DELIVERY_DOMAIN_BURST', 5))
+)
@@ -0,0 +1,19 @@
+"""
+Text normalization helpers
+Accent- and case-insensitive folding shared by search keys and matchers
+"""
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip diacritics: "Développeur Île" -> "developpeur ile" """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def normalize_key(text: str) -> str:
+    """Folded text with collapsed whitespace, for use in cache keys"""
+    return _WHITESPACE.sub(" ", fold(text or "")).strip()
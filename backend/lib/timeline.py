@@ -0,0 +1,210 @@
+"""
+Application timeline
+Buckets applications by creation date in MongoDB. Closed days (before today,
+UTC) are served from a per-user daily rollup collection, so a chart refresh
+costs the same whatever the account's age; only today is read from
+db.applications. Status changes of applications on closed days are applied
+to their rollup with $inc.
+"""
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from .application_stats import APPLICATION_STATUSES
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def _day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day)
+
+
+def bucket_start(day: date, granularity: str) -> date:
+    """Python twin of the $dateTrunc used in the rollup pipeline"""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _empty_bucket() -> Dict[str, int]:
+    return {status: 0 for status in APPLICATION_STATUSES}
+
+
+async def count_days(db, user_id: str, created_at: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """Status counts per creation day of the applications created in the `created_at` range"""
+    # created_at is a UTC ISO string, so its first 10 characters are the day
+    pipeline = [
+        {"$match": {"user_id": user_id, "created_at": created_at}},
+        {"$group": {
+            "_id": {"day": {"$substrCP": ["$created_at", 0, 10]}, "status": "$status"},
+            "n": {"$sum": 1}
+        }}
+    ]
+    days: Dict[str, Dict[str, int]] = {}
+    async for row in db.applications.aggregate(pipeline):
+        status = row["_id"].get("status")
+        if status in APPLICATION_STATUSES:
+            days.setdefault(row["_id"]["day"], _empty_bucket())[status] += row["n"]
+    return days
+
+
+async def ensure_rollups(db, user_id: str, attempts: int = 3) -> None:
+    """
+    Roll up every closed day that is not in db.timeline_rollups yet
+
+    Each day first gets a placeholder rollup, so a status change landing
+    while the days are counted bumps its version instead of being lost, and
+    the counts are only stored if the version did not move.
+    """
+    today = _today().isoformat()
+    state = await db.timeline_rollup_state.find_one({"user_id": user_id})
+    through = state.get("through") if state else None
+    if through and through >= today:
+        return
+
+    created_at: Dict[str, Any] = {"$lt": today}
+    if through:
+        created_at["$gte"] = through
+    days = await count_days(db, user_id, created_at)
+    settled = False
+    for _ in range(attempts):
+        if days:
+            await db.timeline_rollups.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "date": day},
+                    {"$setOnInsert": {**_empty_bucket(), "day": _day_start(date.fromisoformat(day)),
+                                      "backfill": True, "version": 0}},
+                    upsert=True
+                )
+                for day in days
+            ], ordered=False)
+        pending = {
+            doc["date"]: doc.get("version", 0)
+            async for doc in db.timeline_rollups.find(
+                {"user_id": user_id, "backfill": True}, {"_id": 0, "date": 1, "version": 1}
+            )
+        }
+        if not pending:
+            settled = True
+            break
+        days = await count_days(db, user_id, created_at)
+        result = await db.timeline_rollups.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "date": day, "backfill": True, "version": version},
+                {"$set": days.get(day, _empty_bucket()), "$unset": {"backfill": ""}}
+            )
+            for day, version in pending.items()
+        ], ordered=False)
+        if result.modified_count == len(pending):
+            settled = True
+            break
+
+    if not settled:
+        # Still racing with writes: store counts exact as of the last count,
+        # the placeholders stay flagged and the next read rolls them up again
+        logger.warning(f"Timeline rollup for {user_id} still racing with writes, retrying on next read")
+        await db.timeline_rollups.bulk_write([
+            UpdateOne({"user_id": user_id, "date": day, "backfill": True}, {"$set": counts})
+            for day, counts in days.items()
+        ], ordered=False)
+        return
+    await db.timeline_rollup_state.update_one(
+        {"user_id": user_id},
+        {"$max": {"through": today}},
+        upsert=True
+    )
+
+
+async def first_day(db, user_id: str) -> Optional[date]:
+    """Creation day of the user's oldest application, None if there is none"""
+    oldest = await db.applications.find_one(
+        {"user_id": user_id}, {"_id": 0, "created_at": 1}, sort=[("created_at", 1)]
+    )
+    if not oldest or not oldest.get("created_at"):
+        return None
+    return date.fromisoformat(oldest["created_at"][:10])
+
+
+async def record_status_change(db, user_id: str, created_at: Optional[str],
+                               old_status: Optional[str], new_status: Optional[str]) -> None:
+    """
+    Keep a closed day's rollup in step when an old application changes status.
+    Days not rolled up yet have no rollup document and are left alone.
+    """
+    if not created_at or old_status == new_status:
+        return
+    deltas = {}
+    if old_status in APPLICATION_STATUSES:
+        deltas[old_status] = -1
+    if new_status in APPLICATION_STATUSES:
+        deltas[new_status] = 1
+    if deltas:
+        # The version tells a rollup in progress that its count is already stale
+        await db.timeline_rollups.update_one(
+            {"user_id": user_id, "date": created_at[:10]},
+            {"$inc": {**deltas, "version": 1}}
+        )
+
+
+async def record_deleted(db, user_id: str, created_at: Optional[str], status: Optional[str]) -> None:
+    await record_status_change(db, user_id, created_at, status, None)
+
+
+async def get_timeline(db, user_id: str, start: date, end: date, granularity: str = "day") -> List[Dict[str, Any]]:
+    """
+    Status counts per bucket for applications created between start and end
+    (inclusive), as [{"date": "YYYY-MM-DD", "todo": n, ...}] sorted by date
+    """
+    today = _today()
+    buckets: Dict[str, Dict[str, int]] = {}
+
+    closed_end = min(end, today - timedelta(days=1))
+    if start <= closed_end:
+        await ensure_rollups(db, user_id)
+        if granularity == "day":
+            group_key: Any = "$day"
+        else:
+            trunc = {"date": "$day", "unit": granularity}
+            if granularity == "week":
+                trunc["startOfWeek"] = "monday"
+            group_key = {"$dateTrunc": trunc}
+        pipeline = [
+            {"$match": {"user_id": user_id, "date": {"$gte": start.isoformat(), "$lte": closed_end.isoformat()}}},
+            {"$group": {"_id": group_key, **{status: {"$sum": f"${status}"} for status in APPLICATION_STATUSES}}}
+        ]
+        async for row in db.timeline_rollups.aggregate(pipeline):
+            buckets[row["_id"].date().isoformat()] = {status: row.get(status, 0) for status in APPLICATION_STATUSES}
+
+    if start <= today <= end:
+        pipeline = [
+            {"$match": {"user_id": user_id, "created_at": {"$gte": today.isoformat()}}},
+            {"$group": {"_id": "$status", "n": {"$sum": 1}}}
+        ]
+        key = bucket_start(today, granularity).isoformat()
+        async for row in db.applications.aggregate(pipeline):
+            if row["_id"] in APPLICATION_STATUSES:
+                buckets.setdefault(key, _empty_bucket())[row["_id"]] += row["n"]
+
+    return [
+        {"date": key, **counts}
+        for key, counts in sorted(buckets.items())
+        if any(counts.values())
+    ]
+
+
+async def reset_rollups(db, user_id: Optional[str] = None) -> None:
+    """Drop rollups so they are recomputed from db.applications on next read"""
+    query = {"user_id": user_id} if user_id else {}
+    await db.timeline_rollups.delete_many(query)
+    await db.timeline_rollup_state.delete_many(query)
+    logger.info("Timeline rollups reset" + (f" for {user_id}" if user_id else ""))
@@ -0,0 +1,619 @@
+"""
+Joboost maintenance commands
+
+Usage:
+    python manage.py indexes            # create missing indexes
+    python manage.py indexes --verify   # also explain every route query, fail on COLLSCAN
+    python manage.py rebuild-stats [--user USER_ID]
+    python manage.py rebuild-timeline [--user USER_ID]
+    python manage.py bench-match [--offers 1000 100000] [--skills 15 60] [--profiles 100] [--feed-offers 300]
+    python manage.py bench-login [--logins 30] [--seconds 3]
+    python manage.py harvest            # run one offer harvest now
+    python manage.py bench-http [--requests 500] [--concurrency 20]
+    python manage.py bench-llm [--requests 500] [--error-rate 0.1] [--hedge-after 1.5]
+    python manage.py release-credits    # give back reservations left open by a crash
+    python manage.py bench-credits [--requests 500] [--credits 100]
+    python manage.py bench-spontaneous [--companies 1000]
+    python manage.py bench-delivery [--messages 1000] [--domains 50]   # needs requirements-dev.txt
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("manage")
+
+
+async def cmd_indexes(db, args) -> int:
+    from lib.indexes import ensure_indexes, verify_query_plans, IndexVerificationError
+
+    failed = await ensure_indexes(db)
+    if not args.verify:
+        return 1 if failed else 0
+
+    try:
+        report = await verify_query_plans(db)
+    except IndexVerificationError as e:
+        logger.error(str(e))
+        return 1
+    for entry in report:
+        logger.info(f"{entry['route']} [{entry['collection']}]: {' <- '.join(entry['stages'])}")
+    return 1 if failed else 0
+
+
+async def run(args) -> int:
+    if not args.needs_db:
+        return await args.handler(None, args)
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        return await args.handler(client[os.environ['DB_NAME']], args)
+    finally:
+        client.close()
+
+
+async def cmd_rebuild_stats(db, args) -> int:
+    from lib.application_stats import rebuild
+
+    await rebuild(db, user_id=args.user)
+    return 0
+
+
+async def cmd_rebuild_timeline(db, args) -> int:
+    from lib.timeline import reset_rollups
+
+    await reset_rollups(db, user_id=args.user)
+    return 0
+
+
+def _percentiles(samples) -> str:
+    ordered = sorted(samples)
+    if not ordered:
+        return "no samples"
+    p50 = ordered[int(len(ordered) * 0.50)]
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return f"p50 {p50:.1f} ms, p99 {p99:.1f} ms ({len(ordered)} requests)"
+
+
+async def cmd_bench_login(db, args) -> int:
+    """p99 of /api/health and /api/applications while a burst of logins runs, in-process"""
+    import uuid
+    import httpx
+    import server
+    from lib.password_hashing import password_hasher
+
+    server.db = db
+    user_id = f"bench_{uuid.uuid4().hex[:8]}"
+    email = f"{user_id}@bench.joboost.fr"
+    password = uuid.uuid4().hex
+    await db.users.insert_one({"user_id": user_id, "email": email, "name": "Bench", "subscription_plan": "free",
+                               "password_hash": await password_hasher.hash(password)})
+    token = server.create_access_token({"user_id": user_id, "email": email})
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench",
+                             timeout=60, headers={"Authorization": f"Bearer {token}"})
+
+    async def probe(latencies, stop: asyncio.Event, due: float) -> None:
+        # Timed from when each request was due, so time the event loop spends blocked counts
+        while True:
+            for path in ("/api/health", "/api/applications"):
+                await http.get(path)
+                now = time.perf_counter()
+                latencies[path].append((now - due) * 1000)
+                due = now
+            # Checked after a round, so a probe starved for the whole burst still reports it
+            if stop.is_set():
+                return
+            due = time.perf_counter() + 0.005
+            await asyncio.sleep(0.005)
+
+    async def phase(label: str, logins: int) -> None:
+        latencies = {"/api/health": [], "/api/applications": []}
+        statuses = {}
+        stop = asyncio.Event()
+        probing = asyncio.create_task(probe(latencies, stop, time.perf_counter()))
+
+        async def login() -> None:
+            response = await http.post("/api/auth/login", json={"email": email, "password": password})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        if logins:
+            await asyncio.gather(*(login() for _ in range(logins)))
+        else:
+            await asyncio.sleep(args.seconds)
+        duration = time.perf_counter() - started
+        stop.set()
+        await probing
+        logger.info(f"{label}: " + (f"{logins} logins in {duration:.2f}s, statuses {statuses}" if logins else "idle"))
+        for path, samples in latencies.items():
+            logger.info(f"    {path}: {_percentiles(samples)}")
+
+    await http.get("/api/applications")  # authenticates once, later reads hit the auth cache
+    submit = password_hasher._submit
+    try:
+        await phase("baseline", 0)
+        await phase(f"login burst on the hashing pool ({password_hasher.workers} workers)", args.logins)
+
+        async def inline(fn, *fn_args):
+            # Previous behaviour: bcrypt on the event loop
+            return fn(*fn_args)
+
+        password_hasher._submit = inline
+        await phase("login burst with bcrypt on the event loop", args.logins)
+    finally:
+        password_hasher._submit = submit
+        await http.aclose()
+        await db.users.delete_one({"user_id": user_id})
+    return 0
+
+
+async def cmd_bench_match(db, args) -> int:
+    from lib.skill_matcher import SkillMatcher, clear_cache
+
+    def substring_score(skills, description):
+        # match_score before the compiled matcher, kept as the baseline
+        description_lower = description.lower()
+        matches = sum(1 for skill in skills if skill.lower() in description_lower)
+        return min(max(int((matches / len(skills)) * 100), 10), 100)
+
+    rng = random.Random(42)
+    skill_pool = ["Python", "Django", "JavaScript", "React", "Kubernetes", "Docker", "PostgreSQL", "C++",
+                  "Machine Learning", "Git", "AWS", "Développeur", "Agile", "Linux", "CI/CD", "Java",
+                  "Spring", "Angular", "TypeScript", "Node.js", "SQL", "MongoDB", "Redis", "Kafka",
+                  "Terraform", "Ansible", "Azure", "GCP", "Scrum", "Jira", "PHP", "Symfony", "Laravel",
+                  "Ruby", "Rails", "Go", "Rust", "Scala", "Spark", "Hadoop", "Pandas", "NumPy",
+                  "TensorFlow", "PyTorch", "Excel", "Power BI", "Tableau", "SAP", "Salesforce", "HTML",
+                  "CSS", "Sass", "Figma", "UX", "SEO", "Comptabilité", "Gestion de projet", "Anglais",
+                  "Management", "Communication"]
+    filler = ("nous recherchons un profil expérimenté pour rejoindre notre équipe produit poste en CDI "
+              "à temps plein avec télétravail partiel vous serez en charge de la conception du "
+              "développement et de la maintenance des applications internes au sein d’une entreprise "
+              "innovante qui accompagne ses clients dans leur transformation numérique rémunération "
+              "selon profil avantages tickets restaurant mutuelle").split()
+
+    def description():
+        # About one word in twenty is a skill, as in real offers
+        return " ".join(
+            rng.choice(skill_pool) if rng.random() < 0.05 else rng.choice(filler) for _ in range(80)
+        )
+
+    for count in args.offers:
+        descriptions = [description() for _ in range(count)]
+        for skill_count in args.skills:
+            skills = skill_pool[:skill_count]
+
+            started = time.perf_counter()
+            for text in descriptions:
+                substring_score(skills, text)
+            baseline = time.perf_counter() - started
+
+            clear_cache()
+            started = time.perf_counter()
+            SkillMatcher(skills).score_many(descriptions)
+            compiled = time.perf_counter() - started
+
+            logger.info(
+                f"{count} offers x {len(skills)} skills, one profile: substring {baseline * 1000:.1f} ms, "
+                f"matcher {compiled * 1000:.1f} ms ({baseline / compiled:.2f}x)"
+            )
+
+    # The recommendation workload: every profile of a department is scored
+    # against the same offers, which the matcher folds only once
+    descriptions = [description() for _ in range(args.feed_offers)]
+    for skill_count in args.skills:
+        profiles = [rng.sample(skill_pool, skill_count) for _ in range(args.profiles)]
+
+        started = time.perf_counter()
+        for skills in profiles:
+            for text in descriptions:
+                substring_score(skills, text)
+        baseline = time.perf_counter() - started
+
+        clear_cache()
+        started = time.perf_counter()
+        for skills in profiles:
+            SkillMatcher(skills).score_many(descriptions)
+        compiled = time.perf_counter() - started
+
+        logger.info(
+            f"{args.feed_offers} offers x {skill_count} skills, {args.profiles} profiles: "
+            f"substring {baseline * 1000 / args.profiles:.2f} ms, "
+            f"matcher {compiled * 1000 / args.profiles:.2f} ms per profile ({baseline / compiled:.2f}x)"
+        )
+    return 0
+
+
+async def cmd_bench_http(db, args) -> int:
+    """Calls to a local stub server: a new client per call (the previous behaviour) vs the shared pool"""
+    import json
+    import httpx
+    from lib.http_clients import HttpClientRegistry
+
+    body = json.dumps({"resultats": [{"id": f"offer_{i}", "intitule": "Développeur Python"} for i in range(20)]}).encode()
+    response = (b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: keep-alive\r\n"
+                b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+    connections = 0
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Minimal keep-alive HTTP/1.1 stub: GET requests only, one response per request
+        nonlocal connections
+        connections += 1
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                if args.delay:
+                    await asyncio.sleep(args.delay / 1000)
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(serve, "127.0.0.1", args.port)
+    url = f"http://127.0.0.1:{args.port}/offres"
+    registry = HttpClientRegistry({"stub": {"timeout": 15.0, "connect_timeout": 5.0,
+                                            "max_connections": args.concurrency}})
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def per_call() -> None:
+        async with httpx.AsyncClient(timeout=15.0) as client:
+            (await client.get(url)).raise_for_status()
+
+    async def pooled() -> None:
+        (await registry.get("stub").get(url)).raise_for_status()
+
+    async def run_mode(call) -> None:
+        latencies = []
+        opened = connections
+
+        async def timed() -> None:
+            async with semaphore:
+                started = time.perf_counter()
+                await call()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(timed() for _ in range(args.requests)))
+        duration = time.perf_counter() - started
+        logger.info(f"{call.__name__}: {args.requests / duration:.0f} requests/s, {_percentiles(latencies)}, "
+                    f"{connections - opened} connections opened")
+
+    try:
+        await run_mode(pooled)  # warm up the pool
+        await run_mode(per_call)
+        await run_mode(pooled)
+        logger.info(f"pool {registry.stats()['clients']['stub']['pool']}")
+    finally:
+        await registry.close()
+        server.close()
+        await server.wait_closed()
+    return 0
+
+
+async def cmd_harvest(db, args) -> int:
+    from lib.http_clients import http_clients
+    from lib.offer_harvester import offer_harvester
+
+    await http_clients.start()
+    try:
+        offer_harvester.configure(db)
+        record = await offer_harvester.run_once()
+    finally:
+        await http_clients.close()
+    logger.info(
+        f"{record['status']}: {record['fetched']} offers from {record['targets']} searches "
+        f"in {record['duration_seconds']}s ({record['offers_per_second']}/s), "
+        f"{record['upserted']} new, {record['modified']} updated, {record['expired']} expired"
+    )
+    return 0 if record["status"] == "completed" else 1
+
+
+async def cmd_bench_llm(db, args) -> int:
+    from lib.llm_gateway import FakeProvider, LLMGateway, LLMTimeout, LLMUnavailable
+
+    provider = FakeProvider(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            stall_rate=args.stall_rate)
+    gateway = LLMGateway(provider, model="fake/primary", hedge_model="fake/secondary" if args.hedge_after else None,
+                         hedge_after=args.hedge_after or 0, timeout=args.timeout,
+                         attempt_timeout=args.attempt_timeout)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    outcomes = {"ok": 0, "timeout": 0, "unavailable": 0}
+
+    async def call(i: int) -> None:
+        async with semaphore:
+            try:
+                await gateway.complete("system", "user", f"bench_{i}")
+                outcomes["ok"] += 1
+            except LLMTimeout:
+                outcomes["timeout"] += 1
+            except LLMUnavailable:
+                outcomes["unavailable"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(args.requests)))
+    duration = time.perf_counter() - started
+    stats = gateway.stats()
+    logger.info(
+        f"{args.requests} calls in {duration:.1f}s: {outcomes['ok']} ok, {outcomes['timeout']} timed out "
+        f"(504), {outcomes['unavailable']} unavailable (503)"
+    )
+    logger.info(f"latency {stats['latency']}")
+    logger.info(f"retries {stats['retries']}, short-circuited {stats['short_circuited']}, "
+                f"hedged {stats['hedged']} (won {stats['hedge_wins']}), breakers {stats['breakers']}")
+    return 0
+
+
+async def cmd_release_credits(db, args) -> int:
+    from lib.credit_ledger import credit_ledger
+
+    credit_ledger.configure(db)
+    released = await credit_ledger.release_stale()
+    logger.info(f"Released {released} stale credit reservations")
+    return 0
+
+
+async def cmd_bench_credits(db, args) -> int:
+    """Parallel paid generations against a throwaway user: no overspend, constant operations"""
+    import uuid
+    from pymongo import monitoring
+    from lib.credit_ledger import credit_ledger, InsufficientCredits
+    from lib.llm_gateway import FakeProvider, LLMGateway
+
+    class CommandCounter(monitoring.CommandListener):
+        count = 0
+
+        def started(self, event):
+            CommandCounter.count += 1
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[CommandCounter()])
+    db = client[os.environ['DB_NAME']]
+    credit_ledger.configure(db)
+    gateway = LLMGateway(FakeProvider(latency=0.05, jitter=0.05, error_rate=args.error_rate),
+                         max_retries=0, breaker_threshold=args.requests + 1)
+    user = {"user_id": f"bench_{uuid.uuid4().hex[:8]}", "subscription_plan": "pro"}
+    await db.users.insert_one({**user, "ai_cv_credits": args.credits, "ai_credits": args.credits})
+    outcomes = {"committed": 0, "released": 0, "rejected": 0}
+
+    async def generate(i: int) -> None:
+        try:
+            reservation = await credit_ledger.reserve(user, "ai_cv_credits", 1, reason="cv", also=("ai_credits",))
+        except InsufficientCredits:
+            outcomes["rejected"] += 1
+            return
+        try:
+            await gateway.complete("system", "user", f"bench_{i}")
+        except Exception:
+            await credit_ledger.release(reservation)
+            outcomes["released"] += 1
+            return
+        await credit_ledger.commit(reservation)
+        outcomes["committed"] += 1
+
+    try:
+        CommandCounter.count = 0
+        started = time.perf_counter()
+        await asyncio.gather(*(generate(i) for i in range(args.requests)))
+        duration = time.perf_counter() - started
+        operations = CommandCounter.count
+        final = await db.users.find_one({"user_id": user["user_id"]})
+        ledger = await db.credit_ledger.count_documents({"user_id": user["user_id"]})
+    finally:
+        await db.users.delete_one({"user_id": user["user_id"]})
+        await db.credit_ledger.delete_many({"user_id": user["user_id"]})
+        client.close()
+
+    overspent = outcomes["committed"] > args.credits or final["ai_cv_credits"] < 0
+    logger.info(
+        f"{args.requests} parallel generations for {args.credits} credits in {duration:.2f}s: "
+        f"{outcomes['committed']} charged, {outcomes['released']} failed and refunded, "
+        f"{outcomes['rejected']} rejected; balance {final['ai_cv_credits']} "
+        f"(expected {args.credits - outcomes['committed']}), {ledger} ledger entries"
+    )
+    logger.info(
+        f"{operations} MongoDB operations, {operations / args.requests:.2f} per request "
+        f"(reserve+commit 3, reserve+release 4, rejected 2)"
+    )
+    consistent = final["ai_cv_credits"] == args.credits - outcomes["committed"]
+    return 1 if overspent or not consistent else 0
+
+
+async def cmd_bench_spontaneous(db, args) -> int:
+    """Insert one send worth of spontaneous applications, one by one and in bulk"""
+    import uuid
+    from pymongo.errors import BulkWriteError
+
+    user_id = f"bench_{uuid.uuid4().hex[:8]}"
+    company_ids = [f"siret_{i:09d}" for i in range(args.companies)]
+
+    def docs(prefix: str):
+        return [{"user_id": f"{user_id}_{prefix}", "company_id": company_id, "status": "sent",
+                 "created_at": "2025-01-01T00:00:00+00:00"} for company_id in company_ids]
+
+    try:
+        started = time.perf_counter()
+        for doc in docs("loop"):
+            await db.spontaneous_applications.insert_one(doc)
+        loop = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await db.spontaneous_applications.insert_many(docs("bulk"), ordered=False)
+        bulk = time.perf_counter() - started
+
+        # Same send again: every insert hits the unique index
+        started = time.perf_counter()
+        try:
+            await db.spontaneous_applications.insert_many(docs("bulk"), ordered=False)
+            duplicates = 0
+        except BulkWriteError as e:
+            duplicates = len(e.details.get("writeErrors", []))
+        resend = time.perf_counter() - started
+    finally:
+        await db.spontaneous_applications.delete_many({"user_id": {"$in": [f"{user_id}_loop", f"{user_id}_bulk"]}})
+
+    logger.info(
+        f"{args.companies} companies: insert_one loop {loop * 1000:.0f} ms "
+        f"({args.companies / loop:.0f}/s), insert_many {bulk * 1000:.0f} ms ({args.companies / bulk:.0f}/s, "
+        f"{loop / bulk:.1f}x), re-send {resend * 1000:.0f} ms with {duplicates} duplicates rejected"
+    )
+    return 0
+
+
+async def cmd_bench_delivery(db, args) -> int:
+    """Send rendered applications to a local aiosmtpd server: one session per message vs the pool"""
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        logger.error("bench-delivery needs aiosmtpd (pip install -r requirements-dev.txt)")
+        return 1
+    from lib.spontaneous_delivery import SMTPPool, SpontaneousDelivery
+
+    class Sink:
+        received = 0
+
+        async def handle_DATA(self, server, session, envelope):
+            Sink.received += 1
+            return "250 OK"
+
+    controller = Controller(Sink(), hostname="127.0.0.1", port=args.port)
+    controller.start()
+    user = {"user_id": "bench", "name": "Camille Martin", "email": "camille@example.org"}
+    profile = {"title": "Développeuse Python", "location": "Lyon", "skills": ["Python", "Django", "SQL"],
+               "summary": "Cinq ans d'expérience en développement backend."}
+    companies = [{"id": f"siret_{i}", "name": f"Entreprise {i}", "sector": "Conseil en informatique",
+                  "email": f"rh@company{i % args.domains}.fr"} for i in range(args.messages)]
+
+    def worker(pool_size: int, max_messages: int) -> SpontaneousDelivery:
+        pool = SMTPPool("127.0.0.1", args.port, starttls=False, size=pool_size, max_messages=max_messages)
+        return SpontaneousDelivery(pool, "candidatures@joboost.fr", domain_rate=args.domain_rate,
+                                   domain_burst=args.domain_burst)
+
+    try:
+        for label, delivery in (("new session per message", worker(args.pool_size, 1)),
+                                ("pooled sessions", worker(args.pool_size, 1000))):
+            messages = [delivery._message({}, user, profile, company) for company in companies]
+            started = time.perf_counter()
+            await asyncio.gather(*(delivery._deliver({}, message) for message in messages))
+            duration = time.perf_counter() - started
+            await delivery.pool.close()
+            stats = delivery.stats()
+            logger.info(
+                f"{label}: {len(messages)} messages to {args.domains} domains in {duration:.2f}s "
+                f"({len(messages) / duration:.0f}/s), {stats['smtp']['connections']} connections, "
+                f"p95 {stats['send']['p95_ms']} ms, throttled {stats['throttled_seconds']}s"
+            )
+    finally:
+        controller.stop()
+    logger.info(f"{Sink.received} messages received by the local server")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Joboost maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes = subparsers.add_parser("indexes", help="Create MongoDB indexes")
+    indexes.add_argument("--verify", action="store_true", help="Fail if any route query falls back to COLLSCAN")
+    indexes.set_defaults(handler=cmd_indexes)
+
+    rebuild_stats = subparsers.add_parser("rebuild-stats", help="Rebuild per-user application counters")
+    rebuild_stats.add_argument("--user", help="Only rebuild this user_id")
+    rebuild_stats.set_defaults(handler=cmd_rebuild_stats)
+
+    rebuild_timeline = subparsers.add_parser(
+        "rebuild-timeline", help="Drop timeline rollups so they are recomputed on next read"
+    )
+    rebuild_timeline.add_argument("--user", help="Only reset this user_id")
+    rebuild_timeline.set_defaults(handler=cmd_rebuild_timeline)
+
+    bench_match = subparsers.add_parser("bench-match", help="Benchmark offer skill matching")
+    bench_match.add_argument("--offers", type=int, nargs="+", default=[1000, 100000],
+                             help="Batch sizes to time")
+    bench_match.add_argument("--skills", type=int, nargs="+", default=[15, 60],
+                             help="Profile sizes to time (at most 60)")
+    bench_match.add_argument("--profiles", type=int, default=100,
+                             help="Profiles scoring the same offers, as in recommendations")
+    bench_match.add_argument("--feed-offers", type=int, default=300,
+                             help="Offers scored per profile in the recommendation workload")
+    bench_match.set_defaults(handler=cmd_bench_match, needs_db=False)
+
+    bench_login = subparsers.add_parser(
+        "bench-login", help="Benchmark read latency during a login burst, hashing pool vs inline bcrypt"
+    )
+    bench_login.add_argument("--logins", type=int, default=30, help="Concurrent logins per burst")
+    bench_login.add_argument("--seconds", type=float, default=3, help="Duration of the idle baseline")
+    bench_login.set_defaults(handler=cmd_bench_login)
+
+    harvest = subparsers.add_parser("harvest", help="Harvest France Travail offers into db.offers")
+    harvest.set_defaults(handler=cmd_harvest)
+
+    bench_http = subparsers.add_parser(
+        "bench-http", help="Benchmark outbound calls to a local stub, new client per call vs shared pool"
+    )
+    bench_http.add_argument("--requests", type=int, default=500)
+    bench_http.add_argument("--concurrency", type=int, default=20)
+    bench_http.add_argument("--delay", type=float, default=0, help="Stub response delay (ms)")
+    bench_http.add_argument("--port", type=int, default=8099)
+    bench_http.set_defaults(handler=cmd_bench_http, needs_db=False)
+
+    bench_llm = subparsers.add_parser("bench-llm", help="Load-test the LLM gateway against the fake provider")
+    bench_llm.add_argument("--requests", type=int, default=500)
+    bench_llm.add_argument("--concurrency", type=int, default=50)
+    bench_llm.add_argument("--latency", type=float, default=1.0, help="Mean fake model latency (s)")
+    bench_llm.add_argument("--jitter", type=float, default=0.5)
+    bench_llm.add_argument("--error-rate", type=float, default=0.05)
+    bench_llm.add_argument("--stall-rate", type=float, default=0.02)
+    bench_llm.add_argument("--hedge-after", type=float, default=0, help="Hedge to a second model after (s), 0 to disable")
+    bench_llm.add_argument("--timeout", type=float, default=10, help="Deadline per call (s)")
+    bench_llm.add_argument("--attempt-timeout", type=float, default=3, help="Deadline per attempt (s)")
+    bench_llm.set_defaults(handler=cmd_bench_llm, needs_db=False)
+
+    release_credits = subparsers.add_parser("release-credits", help="Release stale credit reservations")
+    release_credits.set_defaults(handler=cmd_release_credits)
+
+    bench_credits = subparsers.add_parser("bench-credits", help="Stress-test credit reservations for overspend")
+    bench_credits.add_argument("--requests", type=int, default=500)
+    bench_credits.add_argument("--credits", type=int, default=100)
+    bench_credits.add_argument("--error-rate", type=float, default=0.1, help="Fake model failure rate")
+    bench_credits.set_defaults(handler=cmd_bench_credits, needs_db=False)
+
+    bench_spontaneous = subparsers.add_parser(
+        "bench-spontaneous", help="Benchmark spontaneous application inserts, per row vs bulk"
+    )
+    bench_spontaneous.add_argument("--companies", type=int, default=1000)
+    bench_spontaneous.set_defaults(handler=cmd_bench_spontaneous)
+
+    bench_delivery = subparsers.add_parser("bench-delivery", help="Benchmark SMTP delivery against a local aiosmtpd")
+    bench_delivery.add_argument("--messages", type=int, default=1000)
+    bench_delivery.add_argument("--domains", type=int, default=50)
+    bench_delivery.add_argument("--pool-size", type=int, default=4)
+    bench_delivery.add_argument("--domain-rate", type=float, default=1000, help="Sends per second per domain")
+    bench_delivery.add_argument("--domain-burst", type=int, default=1000)
+    bench_delivery.add_argument("--port", type=int, default=8025)
+    bench_delivery.set_defaults(handler=cmd_bench_delivery, needs_db=False)
+
+    parser.set_defaults(needs_db=True)
+    args = parser.parse_args()
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
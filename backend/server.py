@@ -1,36 +1,99 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError, DuplicateKeyError
 import os
+import hmac
+import asyncio
 import logging
+import time
+import json
+import base64
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone, timedelta
 from jose import jwt, JWTError
 import httpx
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+from lib.auth_cache import auth_cache
+from lib.password_hashing import password_hasher, HashingPoolSaturated
+from lib.http_clients import http_clients
+from lib.francetravail_oauth import auth as francetravail_auth
+from lib.indexes import ensure_indexes, verify_query_plans
+from lib.offer_cache import offer_cache
+from lib import labonneboite
+from lib.recommendations import recommendation_engine
+from lib.offer_harvester import offer_harvester
+from lib.ranking import offer_index
+from lib import application_stats
+from lib.application_stats import APPLICATION_STATUSES
+from lib import timeline as application_timeline
+from lib.llm_gateway import llm_gateway, LLMUnavailable, LLMTimeout
+from lib.credit_ledger import credit_ledger, InsufficientCredits
+from lib.spontaneous_delivery import spontaneous_delivery
+from lib.ai_jobs import generation_queue, JobRejected, TERMINAL_STATUSES
+from lib.generation_cache import generation_cache
+from lib.prompt_builder import prompt_builder, render_digest, load_tokenizer, Prompt
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.environ.get('JWT_SECRET', 'default_secret_key')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24 * 7
 
 security = HTTPBearer(auto_error=False)
 
-app = FastAPI(title="Joboost API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await ensure_indexes(db)
+    except PyMongoError as e:
+        logging.error(f"Index bootstrap skipped, MongoDB unavailable: {e}")
+    if os.environ.get('INDEX_VERIFY_ON_STARTUP', 'false').lower() == 'true':
+        # Raises IndexVerificationError and aborts startup on any COLLSCAN
+        await verify_query_plans(db)
+    await http_clients.start()
+    francetravail_auth.configure(
+        db, shared=os.environ.get('FRANCETRAVAIL_TOKEN_SHARED', 'false').lower() == 'true'
+    )
+    francetravail_auth.start_background_refresh()
+    offer_cache.configure(db)
+    generation_cache.configure(db)
+    credit_ledger.configure(db)
+    await asyncio.to_thread(load_tokenizer)
+    offer_harvester.configure(db)
+    offer_harvester.start()
+    recommendation_engine.configure(db)
+    recommendation_engine.start()
+    generation_queue.configure(db, handler=_run_generation_job)
+    generation_queue.start()
+    spontaneous_delivery.configure(db)
+    spontaneous_delivery.start()
+    yield
+    await spontaneous_delivery.stop()
+    await generation_queue.stop()
+    await recommendation_engine.stop()
+    await offer_harvester.stop()
+    await francetravail_auth.stop_background_refresh()
+    await http_clients.close()
+    password_hasher.shutdown()
+    client.close()
+
+app = FastAPI(title="Joboost API", lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # ============ MODELS ============
@@ -123,6 +186,7 @@ class ApplicationUpdate(BaseModel):
 class AIGenerateRequest(BaseModel):
     application_id: str
     generation_type: str  # "cover_letter" or "cv"
+    force: bool = False  # regenerate even if an identical generation is cached
 
 class CheckoutRequest(BaseModel):
     plan: str
@@ -136,11 +200,24 @@ def create_access_token(data: dict) -> str:
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def _hashing_busy(e: HashingPoolSaturated) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Service momentanément surchargé, veuillez réessayer",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashingPoolSaturated as e:
+        raise _hashing_busy(e)
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except HashingPoolSaturated as e:
+        raise _hashing_busy(e)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), request: Request = None):
     token = None
@@ -157,14 +234,21 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         raise HTTPException(status_code=401, detail="Non authentifié")
     
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = auth_cache.get_claims(token)
+        if payload is None:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            auth_cache.set_claims(token, payload)
+        
         user_id = payload.get("user_id")
         if not user_id:
             raise HTTPException(status_code=401, detail="Token invalide")
         
-        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="Utilisateur non trouvé")
+        user = auth_cache.get_user(user_id)
+        if user is None:
+            user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="Utilisateur non trouvé")
+            auth_cache.set_user(user_id, user)
         
         return user
     except JWTError:
@@ -179,7 +263,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email déjà utilisé")
     
     user_id = f"user_{uuid.uuid4().hex[:12]}"
-    hashed_pwd = hash_password(user_data.password)
+    hashed_pwd = await hash_password(user_data.password)
     
     user_doc = {
         "user_id": user_id,
@@ -221,7 +305,7 @@ async def login(user_data: UserLogin):
     if not user:
         raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
     
-    if not verify_password(user_data.password, user.get("password_hash", "")):
+    if not await verify_password(user_data.password, user.get("password_hash", "")):
         raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
     
     token = create_access_token({"user_id": user["user_id"], "email": user["email"]})
@@ -270,71 +354,72 @@ async def handle_session(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="Session ID manquant")
     
     try:
-        async with httpx.AsyncClient() as client_http:
-            resp = await client_http.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id}
-            )
-            if resp.status_code != 200:
-                raise HTTPException(status_code=401, detail="Session invalide")
-            
-            session_data = resp.json()
-            
-            # Find or create user
-            existing_user = await db.users.find_one({"email": session_data["email"]}, {"_id": 0})
-            
-            if existing_user:
-                user_id = existing_user["user_id"]
-                await db.users.update_one(
-                    {"user_id": user_id},
-                    {"$set": {
-                        "name": session_data.get("name", existing_user.get("name")),
-                        "picture": session_data.get("picture"),
-                        "last_login": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-            else:
-                user_id = f"user_{uuid.uuid4().hex[:12]}"
-                user_doc = {
-                    "user_id": user_id,
-                    "email": session_data["email"],
-                    "name": session_data.get("name", ""),
+        client_http = http_clients.get("emergent_auth")
+        resp = await client_http.get(
+            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
+            headers={"X-Session-ID": session_id}
+        )
+        if resp.status_code != 200:
+            raise HTTPException(status_code=401, detail="Session invalide")
+        
+        session_data = resp.json()
+        
+        # Find or create user
+        existing_user = await db.users.find_one({"email": session_data["email"]}, {"_id": 0})
+        
+        if existing_user:
+            user_id = existing_user["user_id"]
+            await db.users.update_one(
+                {"user_id": user_id},
+                {"$set": {
+                    "name": session_data.get("name", existing_user.get("name")),
                     "picture": session_data.get("picture"),
-                    "subscription_plan": "free",
-                    "ai_credits": 1,
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "onboarding_completed": False
-                }
-                await db.users.insert_one(user_doc)
-            
-            # Create JWT token
-            token = create_access_token({"user_id": user_id, "email": session_data["email"]})
-            
-            # Set cookie
-            response.set_cookie(
-                key="session_token",
-                value=token,
-                httponly=True,
-                secure=True,
-                samesite="none",
-                max_age=JWT_EXPIRATION_HOURS * 3600,
-                path="/"
+                    "last_login": datetime.now(timezone.utc).isoformat()
+                }}
             )
-            
-            user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-            
-            return {
-                "token": token,
-                "user": {
-                    "user_id": user_id,
-                    "email": user["email"],
-                    "name": user.get("name", ""),
-                    "picture": user.get("picture"),
-                    "subscription_plan": user.get("subscription_plan", "free"),
-                    "ai_credits": user.get("ai_credits", 1),
-                    "onboarding_completed": user.get("onboarding_completed", False)
-                }
+            auth_cache.invalidate_user(user_id)
+        else:
+            user_id = f"user_{uuid.uuid4().hex[:12]}"
+            user_doc = {
+                "user_id": user_id,
+                "email": session_data["email"],
+                "name": session_data.get("name", ""),
+                "picture": session_data.get("picture"),
+                "subscription_plan": "free",
+                "ai_credits": 1,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "onboarding_completed": False
+            }
+            await db.users.insert_one(user_doc)
+        
+        # Create JWT token
+        token = create_access_token({"user_id": user_id, "email": session_data["email"]})
+        
+        # Set cookie
+        response.set_cookie(
+            key="session_token",
+            value=token,
+            httponly=True,
+            secure=True,
+            samesite="none",
+            max_age=JWT_EXPIRATION_HOURS * 3600,
+            path="/"
+        )
+        
+        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        
+        return {
+            "token": token,
+            "user": {
+                "user_id": user_id,
+                "email": user["email"],
+                "name": user.get("name", ""),
+                "picture": user.get("picture"),
+                "subscription_plan": user.get("subscription_plan", "free"),
+                "ai_credits": user.get("ai_credits", 1),
+                "onboarding_completed": user.get("onboarding_completed", False)
             }
+        }
     except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Erreur de session: {str(e)}")
 
@@ -342,46 +427,131 @@ async def handle_session(request: Request, response: Response):
 
 @api_router.get("/profile")
 async def get_profile(current_user: dict = Depends(get_current_user)):
-    profile = await db.profiles.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
+    profile = await db.profiles.find_one({"user_id": current_user["user_id"]}, {"_id": 0, "digest": 0})
     if not profile:
         return {"profile": None}
     return {"profile": profile}
 
 @api_router.post("/profile")
 async def create_or_update_profile(profile_data: ProfileCreate, current_user: dict = Depends(get_current_user)):
+    now = datetime.now(timezone.utc).isoformat()
     profile_dict = profile_data.model_dump()
     profile_dict["user_id"] = current_user["user_id"]
-    profile_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    profile_dict["updated_at"] = now
+    # Rendered once here rather than on every generation
+    profile_dict["digest"] = render_digest(profile_dict)
     
-    existing = await db.profiles.find_one({"user_id": current_user["user_id"]})
+    # Upsert in one round trip. The unique index on user_id closes the
+    # check-then-insert race: a concurrent upsert that loses it retries as an update.
+    for attempt in range(2):
+        try:
+            profile = await db.profiles.find_one_and_update(
+                {"user_id": current_user["user_id"]},
+                {"$set": profile_dict, "$setOnInsert": {"created_at": now}},
+                projection={"_id": 0, "digest": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            if attempt:
+                raise
     
-    if existing:
-        await db.profiles.update_one(
+    # Mark onboarding as complete
+    if not current_user.get("onboarding_completed"):
+        await db.users.update_one(
             {"user_id": current_user["user_id"]},
-            {"$set": profile_dict}
+            {"$set": {"onboarding_completed": True}}
         )
-    else:
-        profile_dict["created_at"] = datetime.now(timezone.utc).isoformat()
-        await db.profiles.insert_one(profile_dict)
+        auth_cache.invalidate_user(current_user["user_id"])
     
-    # Mark onboarding as complete
-    await db.users.update_one(
-        {"user_id": current_user["user_id"]},
-        {"$set": {"onboarding_completed": True}}
-    )
+    # Title, location or skills may have changed: recompute the feed
+    await recommendation_engine.mark_dirty(current_user["user_id"])
     
-    profile = await db.profiles.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
     return {"profile": profile, "message": "Profil enregistré avec succès"}
 
 # ============ APPLICATIONS ROUTES ============
 
+APPLICATION_FIELDS = set(ApplicationCreate.model_fields) | {
+    "application_id", "user_id", "created_at", "updated_at", "generated_cover_letter", "generated_cv"
+}
+# Large text fields left out of the Kanban summary view
+APPLICATION_SUMMARY_EXCLUDED = ["generated_cover_letter", "generated_cv", "job_description"]
+APPLICATIONS_PAGE_MAX = 500
+
+def encode_cursor(created_at: str, application_id: str) -> str:
+    raw = json.dumps([created_at, application_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, application_id = json.loads(raw)
+        return str(created_at), str(application_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
 @api_router.get("/applications")
-async def get_applications(current_user: dict = Depends(get_current_user)):
-    applications = await db.applications.find(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(500)
-    return {"applications": applications}
+async def get_applications(
+    limit: int = Query(APPLICATIONS_PAGE_MAX, ge=1, le=APPLICATIONS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = None,
+    status: Optional[str] = None,
+    updated_since: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    List applications newest first, paginated on (created_at, application_id).
+    Pass the returned next_cursor back to fetch the following page.
+    """
+    query: Dict[str, Any] = {"user_id": current_user["user_id"]}
+    
+    if status:
+        query["status"] = {"$in": [s.strip() for s in status.split(",") if s.strip()]}
+    
+    if updated_since:
+        try:
+            since = datetime.fromisoformat(updated_since.replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Date updated_since invalide")
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # Timestamps are stored as UTC ISO strings, which sort chronologically
+        query["updated_at"] = {"$gte": since.astimezone(timezone.utc).isoformat()}
+    
+    if cursor:
+        created_at, application_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "application_id": {"$lt": application_id}}
+        ]
+    
+    if fields:
+        requested = {f.strip() for f in fields.split(",") if f.strip()}
+        unknown = requested - APPLICATION_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Champs inconnus: {', '.join(sorted(unknown))}")
+        # The cursor fields are always returned
+        projection = {f: 1 for f in requested | {"application_id", "created_at"}}
+        projection["_id"] = 0
+    elif view == "summary":
+        projection = {f: 0 for f in APPLICATION_SUMMARY_EXCLUDED}
+        projection["_id"] = 0
+    else:
+        projection = {"_id": 0}
+    
+    applications = await db.applications.find(query, projection).sort(
+        [("created_at", -1), ("application_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(applications) > limit:
+        applications = applications[:limit]
+        last = applications[-1]
+        next_cursor = encode_cursor(last["created_at"], last["application_id"])
+    
+    return {"applications": applications, "next_cursor": next_cursor}
 
 @api_router.post("/applications")
 async def create_application(app_data: ApplicationCreate, current_user: dict = Depends(get_current_user)):
@@ -396,9 +566,11 @@ async def create_application(app_data: ApplicationCreate, current_user: dict = D
     app_dict["generated_cv"] = None
     
     await db.applications.insert_one(app_dict)
+    # insert_one adds the ObjectId to app_dict; the stored document is otherwise identical
+    app_dict.pop("_id", None)
+    await application_stats.record_created(db, current_user["user_id"], app_dict["status"])
     
-    application = await db.applications.find_one({"application_id": app_id}, {"_id": 0})
-    return {"application": application, "message": "Candidature créée avec succès"}
+    return {"application": app_dict, "message": "Candidature créée avec succès"}
 
 @api_router.get("/applications/{application_id}")
 async def get_application(application_id: str, current_user: dict = Depends(get_current_user)):
@@ -412,61 +584,100 @@ async def get_application(application_id: str, current_user: dict = Depends(get_
 
 @api_router.put("/applications/{application_id}")
 async def update_application(application_id: str, app_data: ApplicationUpdate, current_user: dict = Depends(get_current_user)):
-    existing = await db.applications.find_one(
-        {"application_id": application_id, "user_id": current_user["user_id"]}
-    )
-    if not existing:
-        raise HTTPException(status_code=404, detail="Candidature non trouvée")
-    
     update_dict = {k: v for k, v in app_data.model_dump().items() if v is not None}
     update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    await db.applications.update_one(
-        {"application_id": application_id},
-        {"$set": update_dict}
+    # The previous status is needed for the stats counters; the updated
+    # document is the old one with the $set fields applied
+    previous = await db.applications.find_one_and_update(
+        {"application_id": application_id, "user_id": current_user["user_id"]},
+        {"$set": update_dict},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
+    if not previous:
+        raise HTTPException(status_code=404, detail="Candidature non trouvée")
+    
+    application = {**previous, **update_dict}
+    if "status" in update_dict:
+        await application_stats.record_status_change(
+            db, current_user["user_id"], previous.get("status"), update_dict["status"]
+        )
+        await application_timeline.record_status_change(
+            db, current_user["user_id"], previous.get("created_at"), previous.get("status"), update_dict["status"]
+        )
     
-    application = await db.applications.find_one({"application_id": application_id}, {"_id": 0})
     return {"application": application, "message": "Candidature mise à jour"}
 
 @api_router.delete("/applications/{application_id}")
 async def delete_application(application_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.applications.delete_one(
-        {"application_id": application_id, "user_id": current_user["user_id"]}
+    deleted = await db.applications.find_one_and_delete(
+        {"application_id": application_id, "user_id": current_user["user_id"]},
+        projection={"_id": 0, "status": 1, "created_at": 1}
     )
-    if result.deleted_count == 0:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Candidature non trouvée")
+    await application_stats.record_deleted(db, current_user["user_id"], deleted.get("status"))
+    await application_timeline.record_deleted(
+        db, current_user["user_id"], deleted.get("created_at"), deleted.get("status")
+    )
     return {"message": "Candidature supprimée"}
 
 @api_router.patch("/applications/{application_id}/status")
 async def update_application_status(application_id: str, status: str, current_user: dict = Depends(get_current_user)):
-    valid_statuses = ["todo", "applied", "interview", "offer", "rejected"]
-    if status not in valid_statuses:
+    if status not in APPLICATION_STATUSES:
         raise HTTPException(status_code=400, detail="Statut invalide")
     
-    result = await db.applications.update_one(
+    update = {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}
+    previous = await db.applications.find_one_and_update(
         {"application_id": application_id, "user_id": current_user["user_id"]},
-        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": update},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if not previous:
         raise HTTPException(status_code=404, detail="Candidature non trouvée")
     
-    application = await db.applications.find_one({"application_id": application_id}, {"_id": 0})
-    return {"application": application}
+    await application_stats.record_status_change(db, current_user["user_id"], previous.get("status"), status)
+    await application_timeline.record_status_change(
+        db, current_user["user_id"], previous.get("created_at"), previous.get("status"), status
+    )
+    return {"application": {**previous, **update}}
 
 # ============ AI GENERATION ROUTES ============
 
-@api_router.post("/ai/generate")
-async def generate_ai_content(request: AIGenerateRequest, current_user: dict = Depends(get_current_user)):
-    # Determine which credit to check
-    credit_field = "ai_letter_credits" if request.generation_type == "cover_letter" else "ai_cv_credits"
-    current_credits = current_user.get(credit_field, 0)
-    
-    # Check credits (ultra plan has 99999)
-    if current_user.get("subscription_plan") not in ["pro", "ultra"] and current_credits <= 0:
+def _credit_field(generation_type: str) -> str:
+    return "ai_letter_credits" if generation_type == "cover_letter" else "ai_cv_credits"
+
+async def _reserve_generation(request: AIGenerateRequest, current_user: dict, ref: Optional[str] = None):
+    """Reserve the credit of a new generation, 403 if spent (cache hits are free, ultra is unlimited)"""
+    try:
+        return await credit_ledger.reserve(
+            current_user, _credit_field(request.generation_type), 1,
+            reason=request.generation_type, ref=ref or request.application_id, also=("ai_credits",)
+        )
+    except InsufficientCredits:
         raise HTTPException(status_code=403, detail=f"Crédits {request.generation_type} épuisés. Passez au plan Pro pour plus de générations.")
-    
+
+async def _generate_paid(request: AIGenerateRequest, current_user: dict, prompt: Prompt, latency: dict,
+                         ref: Optional[str] = None) -> str:
+    """Model call paid by a credit reservation: committed on success, released on failure"""
+    reservation = await _reserve_generation(request, current_user, ref)
+    started = time.perf_counter()
+    try:
+        content = await llm_gateway.complete(
+            prompt.system, prompt.user, f"joboost_{current_user['user_id']}_{request.application_id}"
+        )
+    except BaseException:
+        await asyncio.shield(credit_ledger.release(reservation, reason="generation failed"))
+        raise
+    latency["ms"] = (time.perf_counter() - started) * 1000
+    await credit_ledger.commit(reservation)
+    return content
+
+async def _prepare_generation(request: AIGenerateRequest, current_user: dict) -> Prompt:
+    """Load the application and profile, and build the prompts within the plan's token budget"""
     # Get application
     application = await db.applications.find_one(
         {"application_id": request.application_id, "user_id": current_user["user_id"]},
@@ -480,123 +691,233 @@ async def generate_ai_content(request: AIGenerateRequest, current_user: dict = D
     if not profile:
         raise HTTPException(status_code=400, detail="Veuillez d'abord compléter votre profil maître")
     
-    # Prepare prompt
-    job_description = application.get("job_description", "Non spécifiée")
-    company_name = application.get("company_name", "")
-    job_title = application.get("job_title", "")
-    
-    # Format profile data
-    experiences_text = ""
-    for exp in profile.get("experiences", []):
-        experiences_text += f"- {exp['title']} chez {exp['company']} ({exp['start_date']} - {exp.get('end_date', 'Présent')}): {exp['description']}\n"
-    
-    education_text = ""
-    for edu in profile.get("education", []):
-        education_text += f"- {edu['degree']} à {edu['institution']} ({edu['start_date']} - {edu.get('end_date', '')})\n"
-    
-    skills_text = ", ".join(profile.get("skills", []))
-    
-    if request.generation_type == "cover_letter":
-        system_prompt = """Tu es un expert RH français spécialisé dans la rédaction de lettres de motivation professionnelles et convaincantes.
-Tu dois rédiger une lettre de motivation en français, parfaitement structurée, qui:
-- Fait le pont entre le parcours du candidat et le poste visé
-- Met en avant les expériences et compétences les plus pertinentes
-- Est professionnelle mais authentique
-- Respecte le format standard français (objet, formules de politesse)
-- Fait environ 300-400 mots"""
-
-        user_prompt = f"""Rédige une lettre de motivation pour le poste suivant:
+    return prompt_builder.build(request.generation_type, current_user, profile, application)
 
-POSTE: {job_title}
-ENTREPRISE: {company_name}
-DESCRIPTION DU POSTE:
-{job_description}
-
-PROFIL DU CANDIDAT:
-Nom: {current_user.get('name', 'Le candidat')}
-Titre: {profile.get('title', '')}
-Résumé: {profile.get('summary', '')}
-
-EXPÉRIENCES PROFESSIONNELLES:
-{experiences_text}
-
-FORMATION:
-{education_text}
-
-COMPÉTENCES: {skills_text}
-
-Rédige maintenant une lettre de motivation percutante et personnalisée."""
-
-    else:  # CV
-        system_prompt = """Tu es un expert RH français spécialisé dans l'optimisation de CV.
-Tu dois créer un CV structuré en texte qui:
-- Met en avant les éléments les plus pertinents pour le poste
-- Est clair et bien organisé
-- Utilise des verbes d'action
-- Quantifie les réalisations quand possible"""
-
-        user_prompt = f"""Crée un CV optimisé pour le poste suivant:
-
-POSTE VISÉ: {job_title} chez {company_name}
-
-INFORMATIONS DU CANDIDAT:
-Nom: {current_user.get('name', '')}
-Email: {current_user.get('email', '')}
-Téléphone: {profile.get('phone', '')}
-Localisation: {profile.get('location', '')}
-LinkedIn: {profile.get('linkedin_url', '')}
-
-Titre professionnel: {profile.get('title', '')}
-Résumé: {profile.get('summary', '')}
-
-EXPÉRIENCES:
-{experiences_text}
-
-FORMATION:
-{education_text}
-
-COMPÉTENCES: {skills_text}
+async def _log_generation(request: AIGenerateRequest, current_user: dict, prompt: Prompt, cached: bool,
+                          latency_ms: Optional[float]) -> None:
+    """Record the input size of a generation next to its model latency (None for cache hits)"""
+    try:
+        await db.generation_log.insert_one({
+            "user_id": current_user["user_id"],
+            "application_id": request.application_id,
+            "generation_type": request.generation_type,
+            "plan": current_user.get("subscription_plan", "free"),
+            "input_tokens": prompt.input_tokens,
+            "trimmed_tokens": prompt.trimmed_tokens,
+            "budget": prompt.budget,
+            "cached": cached,
+            "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+    except PyMongoError as e:
+        logging.warning(f"Generation log write failed: {e}")
 
-Génère un CV structuré et optimisé pour cette candidature."""
+async def _save_generation(request: AIGenerateRequest, generated_content: str) -> None:
+    """Store the generated text on the application"""
+    field_name = "generated_cover_letter" if request.generation_type == "cover_letter" else "generated_cv"
+    await db.applications.update_one(
+        {"application_id": request.application_id},
+        {"$set": {field_name: generated_content, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
 
+@api_router.post("/ai/generate")
+async def generate_ai_content(request: AIGenerateRequest, current_user: dict = Depends(get_current_user)):
+    prompt = await _prepare_generation(request, current_user)
+    latency = {}
+    
+    async def generate() -> str:
+        return await _generate_paid(request, current_user, prompt, latency)
+    
     try:
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=f"joboost_{current_user['user_id']}_{request.application_id}",
-            system_message=system_prompt
-        )
-        chat.with_model("openai", "gpt-4o")
-        
-        user_message = UserMessage(text=user_prompt)
-        generated_content = await chat.send_message(user_message)
-        
-        # Save generated content
-        field_name = "generated_cover_letter" if request.generation_type == "cover_letter" else "generated_cv"
-        await db.applications.update_one(
-            {"application_id": request.application_id},
-            {"$set": {field_name: generated_content, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        generated_content, cached = await generation_cache.get_or_generate(
+            generation_cache.key(prompt.system, prompt.user, llm_gateway.model), generate, force=request.force
         )
-        
-        # Deduct specific credit if not Ultra
-        if current_user.get("subscription_plan") != "ultra":
-            credit_field = "ai_letter_credits" if request.generation_type == "cover_letter" else "ai_cv_credits"
-            await db.users.update_one(
-                {"user_id": current_user["user_id"]},
-                {"$inc": {credit_field: -1, "ai_credits": -1}}
-            )
+        await _save_generation(request, generated_content)
+        await _log_generation(request, current_user, prompt, cached, latency.get("ms"))
         
         return {
             "content": generated_content,
             "type": request.generation_type,
+            "cached": cached,
+            "input_tokens": prompt.input_tokens,
             "message": "Contenu généré avec succès"
         }
         
+    except HTTPException:
+        raise
+    except LLMTimeout:
+        raise HTTPException(status_code=504, detail="La génération a pris trop de temps, veuillez réessayer")
+    except LLMUnavailable as e:
+        logging.error(f"AI Generation unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=503, detail="Service de génération momentanément indisponible, veuillez réessayer",
+            headers={"Retry-After": str(e.retry_after or 30)}
+        )
     except Exception as e:
         logging.error(f"AI Generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération: {str(e)}")
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@api_router.post("/ai/generate/stream")
+async def generate_ai_content_stream(request: AIGenerateRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Same as /ai/generate, streamed as Server-Sent Events: `token` events
+    carry text chunks as the model produces them, then a single `done`
+    (content saved, credit deducted) or `error` event. Validation errors are
+    returned as plain HTTP errors before the stream starts. A client
+    disconnect cancels the upstream call, nothing is saved and the credit
+    reservation is released.
+    """
+    prompt = await _prepare_generation(request, current_user)
+    session_id = f"joboost_{current_user['user_id']}_{request.application_id}"
+    cache_key = generation_cache.key(prompt.system, prompt.user, llm_gateway.model)
+    cached_content = None if request.force else await generation_cache.get(cache_key)
+    reservation = None
+    if cached_content is None:
+        breaker = llm_gateway.breaker(llm_gateway.model)
+        if breaker.state == "open":
+            raise HTTPException(
+                status_code=503, detail="Service de génération momentanément indisponible, veuillez réessayer",
+                headers={"Retry-After": str(breaker.retry_after())}
+            )
+        reservation = await _reserve_generation(request, current_user)
+    
+    async def events():
+        # Flush headers and a first byte before the model answers
+        yield _sse("start", {"type": request.generation_type, "cached": cached_content is not None,
+                             "input_tokens": prompt.input_tokens})
+        if cached_content is not None:
+            yield _sse("token", {"text": cached_content})
+            await asyncio.shield(asyncio.gather(
+                _save_generation(request, cached_content),
+                _log_generation(request, current_user, prompt, True, None)
+            ))
+            yield _sse("done", {"type": request.generation_type, "cached": True,
+                                "message": "Contenu généré avec succès"})
+            return
+        
+        chunks = []
+        started = time.perf_counter()
+        settled = False
+        try:
+            try:
+                async for text in llm_gateway.stream(prompt.system, prompt.user, session_id):
+                    chunks.append(text)
+                    yield _sse("token", {"text": text})
+            except LLMTimeout:
+                yield _sse("error", {"status": 504, "detail": "La génération a pris trop de temps, veuillez réessayer"})
+                return
+            except LLMUnavailable as e:
+                logging.error(f"AI Generation unavailable: {str(e)}")
+                yield _sse("error", {"status": 503,
+                                     "detail": "Service de génération momentanément indisponible, veuillez réessayer"})
+                return
+            except Exception as e:
+                logging.error(f"AI Generation stream error: {str(e)}")
+                yield _sse("error", {"detail": f"Erreur lors de la génération: {str(e)}"})
+                return
+            
+            # The completion is whole: save and charge even if the client leaves now
+            generated_content = "".join(chunks)
+            latency_ms = (time.perf_counter() - started) * 1000
+            settled = True
+            await asyncio.shield(asyncio.gather(
+                credit_ledger.commit(reservation),
+                generation_cache.set(cache_key, generated_content),
+                _save_generation(request, generated_content),
+                _log_generation(request, current_user, prompt, False, latency_ms)
+            ))
+            yield _sse("done", {"type": request.generation_type, "cached": False,
+                                "message": "Contenu généré avec succès"})
+        finally:
+            if not settled:
+                await asyncio.shield(credit_ledger.release(reservation, reason="generation failed"))
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _run_generation_job(job: dict) -> dict:
+    """Generation queue handler: same checks, cache and charging as /ai/generate, at run time"""
+    current_user = await db.users.find_one({"user_id": job["user_id"]}, {"_id": 0, "password_hash": 0})
+    if not current_user:
+        raise JobRejected("Utilisateur non trouvé")
+    request = AIGenerateRequest(application_id=job["application_id"], generation_type=job["generation_type"],
+                                force=job.get("force", False))
+    try:
+        prompt = await _prepare_generation(request, current_user)
+    except HTTPException as e:
+        raise JobRejected(e.detail)
+    latency = {}
+    
+    async def generate() -> str:
+        try:
+            # Reserved against the job, so the queue can release it if the job is abandoned
+            return await _generate_paid(request, current_user, prompt, latency, ref=job["job_id"])
+        except HTTPException as e:
+            raise JobRejected(e.detail)
+    
+    generated_content, cached = await generation_cache.get_or_generate(
+        generation_cache.key(prompt.system, prompt.user, llm_gateway.model), generate, force=request.force
+    )
+    await _save_generation(request, generated_content)
+    await _log_generation(request, current_user, prompt, cached, latency.get("ms"))
+    return {"content": generated_content, "cached": cached, "input_tokens": prompt.input_tokens}
+
+@api_router.post("/ai/jobs", status_code=202)
+async def enqueue_ai_generation(request: AIGenerateRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Queue a generation and return its job id at once. Paying plans are served
+    first; poll GET /ai/jobs/{job_id} or subscribe to /ai/jobs/{job_id}/events.
+    """
+    # Fail fast on missing application or profile; credits are checked when
+    # the job runs, since an identical cached generation costs none
+    await _prepare_generation(request, current_user)
+    try:
+        job = await generation_queue.enqueue(
+            current_user, request.application_id, request.generation_type, force=request.force
+        )
+    except JobRejected as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+@api_router.get("/ai/jobs/{job_id}")
+async def get_ai_generation_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await generation_queue.get(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Génération non trouvée")
+    return job
+
+@api_router.get("/ai/jobs/{job_id}/events")
+async def stream_ai_generation_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Server-Sent Events: a `status` event on every change, ending with the final job"""
+    job = await generation_queue.get(job_id, current_user["user_id"])
+    if not job:
+        raise HTTPException(status_code=404, detail="Génération non trouvée")
+    
+    async def events():
+        current = job
+        last = None
+        while True:
+            state = (current["status"], current.get("position"), current.get("attempts"))
+            if state != last:
+                last = state
+                yield _sse("status", current)
+            if current["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(generation_queue.poll_interval)
+            current = await generation_queue.get(job_id, current_user["user_id"])
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ============ PAYMENT ROUTES ============
 
 # 3 Plans with separate credits
@@ -638,6 +959,14 @@ PLANS = {
     }
 }
 
+def _plan_balances(plan_credits: dict) -> dict:
+    return {
+        "ai_credits": plan_credits.get("ai_cv_credits", 100),
+        "ai_cv_credits": plan_credits.get("ai_cv_credits", 100),
+        "ai_letter_credits": plan_credits.get("ai_letter_credits", 100),
+        "spontaneous_credits": plan_credits.get("spontaneous_credits", 500)
+    }
+
 @api_router.post("/payments/checkout")
 async def create_checkout(checkout_data: CheckoutRequest, request: Request, current_user: dict = Depends(get_current_user)):
     if checkout_data.plan not in PLANS:
@@ -719,15 +1048,9 @@ async def get_payment_status(session_id: str, current_user: dict = Depends(get_c
                 plan_id = transaction.get("plan", "pro_monthly") if transaction else "pro_monthly"
                 plan_credits = PLANS.get(plan_id, PLANS["pro_monthly"])
                 
-                await db.users.update_one(
-                    {"user_id": current_user["user_id"]},
-                    {"$set": {
-                        "subscription_plan": "ultra" if "ultra" in plan_id else "pro",
-                        "ai_credits": plan_credits.get("ai_cv_credits", 100),
-                        "ai_cv_credits": plan_credits.get("ai_cv_credits", 100),
-                        "ai_letter_credits": plan_credits.get("ai_letter_credits", 100),
-                        "spontaneous_credits": plan_credits.get("spontaneous_credits", 500)
-                    }}
+                await credit_ledger.grant(
+                    current_user["user_id"], _plan_balances(plan_credits), reason=f"plan {plan_id}",
+                    ref=session_id, plan="ultra" if "ultra" in plan_id else "pro"
                 )
         
         return {
@@ -763,15 +1086,9 @@ async def stripe_webhook(request: Request):
                 # Get plan credits
                 plan_credits = PLANS.get(plan_id, PLANS["pro_monthly"])
                 
-                await db.users.update_one(
-                    {"user_id": user_id},
-                    {"$set": {
-                        "subscription_plan": "ultra" if "ultra" in plan_id else "pro",
-                        "ai_credits": plan_credits.get("ai_cv_credits", 100),
-                        "ai_cv_credits": plan_credits.get("ai_cv_credits", 100),
-                        "ai_letter_credits": plan_credits.get("ai_letter_credits", 100),
-                        "spontaneous_credits": plan_credits.get("spontaneous_credits", 500)
-                    }}
+                await credit_ledger.grant(
+                    user_id, _plan_balances(plan_credits), reason=f"plan {plan_id}",
+                    ref=webhook_response.session_id, plan="ultra" if "ultra" in plan_id else "pro"
                 )
                 
                 await db.payment_transactions.update_one(
@@ -793,42 +1110,29 @@ async def stripe_webhook(request: Request):
 
 @api_router.get("/stats")
 async def get_stats(current_user: dict = Depends(get_current_user)):
-    applications = await db.applications.find(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0, "status": 1}
-    ).to_list(1000)
-    
-    stats = {
-        "total": len(applications),
-        "todo": sum(1 for a in applications if a.get("status") == "todo"),
-        "applied": sum(1 for a in applications if a.get("status") == "applied"),
-        "interview": sum(1 for a in applications if a.get("status") == "interview"),
-        "offer": sum(1 for a in applications if a.get("status") == "offer"),
-        "rejected": sum(1 for a in applications if a.get("status") == "rejected")
-    }
-    
+    stats = await application_stats.get(db, current_user["user_id"])
     return {"stats": stats}
 
 @api_router.get("/stats/timeline")
-async def get_timeline(current_user: dict = Depends(get_current_user)):
-    """Get timeline data for progress chart"""
-    from collections import defaultdict
-    
-    applications = await db.applications.find(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0, "status": 1, "created_at": 1, "updated_at": 1}
-    ).to_list(1000)
-    
-    weekly = defaultdict(lambda: {"applied": 0, "interview": 0, "offer": 0, "todo": 0, "rejected": 0})
-    
-    for app in applications:
-        date_str = app.get("created_at", "")[:10]  # Get YYYY-MM-DD
-        if date_str:
-            status = app.get("status", "todo")
-            weekly[date_str][status] += 1
+async def get_timeline(
+    from_date: Optional[str] = Query(None, alias="from"),
+    to_date: Optional[str] = Query(None, alias="to"),
+    granularity: str = Query("day", pattern="^(day|week|month)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get timeline data for progress chart (defaults to the whole history, from the first application)"""
+    try:
+        end = date.fromisoformat(to_date) if to_date else datetime.now(timezone.utc).date()
+        start = date.fromisoformat(from_date) if from_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates invalides, format attendu: AAAA-MM-JJ")
+    if start is None:
+        start = min(await application_timeline.first_day(db, current_user["user_id"]) or end, end)
+    if start > end:
+        raise HTTPException(status_code=400, detail="La date de début doit précéder la date de fin")
     
-    timeline = [{"date": k, **v} for k, v in sorted(weekly.items())]
-    return {"timeline": timeline}
+    timeline = await application_timeline.get_timeline(db, current_user["user_id"], start, end, granularity)
+    return {"timeline": timeline, "from": start.isoformat(), "to": end.isoformat(), "granularity": granularity}
 
 # ============ SPONTANEOUS APPLICATIONS ROUTES ============
 
@@ -838,61 +1142,110 @@ async def search_spontaneous_companies(request: SpontaneousSearchRequest, curren
     from lib.labonneboite import search_companies
     
     result = await search_companies(request.location, request.rome, request.radius)
+    # Delivery renders the messages later from this snapshot
+    await spontaneous_delivery.remember_companies(result.get("companies", []))
     return result
 
 @api_router.post("/spontaneous/send")
 async def send_spontaneous_applications(request: SpontaneousSendRequest, current_user: dict = Depends(get_current_user)):
-    """Send spontaneous applications (deducts credits)"""
-    credits_needed = len(request.company_ids)
-    current_credits = current_user.get("spontaneous_credits", 0)
-    
-    if current_credits < credits_needed:
-        raise HTTPException(status_code=403, detail=f"Crédits insuffisants. Vous avez {current_credits} crédits, il vous en faut {credits_needed}.")
+    """
+    Queue spontaneous applications, once per company: companies already
+    applied to are reported as duplicates and only new ones are charged. The
+    delivery worker sends them and refunds the ones that fail.
+    """
+    if not spontaneous_delivery.enabled:
+        # Nothing would deliver them: refuse rather than charge for applications that stay queued
+        raise HTTPException(status_code=503, detail="L'envoi de candidatures spontanées est temporairement indisponible")
     
-    # Deduct credits
-    await db.users.update_one(
-        {"user_id": current_user["user_id"]},
-        {"$inc": {"spontaneous_credits": -credits_needed}}
-    )
+    user_id = current_user["user_id"]
+    company_ids = list(dict.fromkeys(filter(None, request.company_ids)))
+    already_sent = {
+        doc["company_id"] async for doc in db.spontaneous_applications.find(
+            {"user_id": user_id, "company_id": {"$in": company_ids}}, {"_id": 0, "company_id": 1}
+        )
+    }
+    new_ids = [company_id for company_id in company_ids if company_id not in already_sent]
+    duplicates = len(request.company_ids) - len(new_ids)
     
-    # Log the spontaneous applications
-    for company_id in request.company_ids:
-        await db.spontaneous_applications.insert_one({
-            "user_id": current_user["user_id"],
-            "company_id": company_id,
-            "status": "sent",
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    sent = failed = 0
+    credits_remaining = current_user.get("spontaneous_credits", 0)
+    if new_ids:
+        try:
+            reservation = await credit_ledger.reserve(
+                current_user, "spontaneous_credits", len(new_ids), reason="spontaneous"
+            )
+        except InsufficientCredits as e:
+            raise HTTPException(status_code=403, detail=f"Crédits insuffisants. Vous avez {e.balance} crédits, il vous en faut {len(new_ids)}.")
+        
+        now = datetime.now(timezone.utc).isoformat()
+        # Unordered: a company sent concurrently (unique index) does not stop the rest
+        try:
+            result = await db.spontaneous_applications.insert_many(
+                [{"user_id": user_id, "company_id": company_id, "status": "queued", "attempts": 0,
+                  "created_at": now, "available_at": now}
+                 for company_id in new_ids],
+                ordered=False
+            )
+            sent = len(result.inserted_ids)
+        except BulkWriteError as e:
+            sent = e.details.get("nInserted", 0)
+            errors = e.details.get("writeErrors", [])
+            raced = sum(1 for error in errors if error.get("code") == 11000)
+            duplicates += raced
+            failed = len(errors) - raced
+            if failed:
+                logging.error(f"Spontaneous send: {failed} of {len(new_ids)} inserts failed")
+        except BaseException:
+            await asyncio.shield(credit_ledger.release(reservation, reason="spontaneous send failed"))
+            raise
+        balance = await credit_ledger.commit(reservation, used=sent)
+        if not reservation.unlimited:
+            credits_remaining = balance
+        if sent:
+            spontaneous_delivery.notify()
     
-    return {"message": f"{credits_needed} candidature(s) spontanée(s) envoyée(s) avec succès", "credits_remaining": current_credits - credits_needed}
+    return {
+        "message": f"{sent} candidature(s) spontanée(s) en cours d'envoi"
+                   + (f", {duplicates} déjà envoyée(s)" if duplicates else ""),
+        "sent": sent,
+        "duplicates": duplicates,
+        "failed": failed,
+        "credits_remaining": credits_remaining
+    }
 
 # ============ JOB RECOMMENDATIONS ROUTES ============
 
 @api_router.get("/recommendations")
-async def get_job_recommendations(current_user: dict = Depends(get_current_user)):
-    """Get personalized job recommendations from France Travail based on user profile"""
-    from lib.jobs_api import fetch_francetravail, match_score
+async def get_job_recommendations(
+    since: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get personalized job recommendations from France Travail based on user profile.
+    Feeds are precomputed by the recommendation engine; pass the returned
+    `cursor` as `since` to receive only offers added to the feed since then.
+    """
+    feed = await recommendation_engine.get_feed(current_user["user_id"], since=since)
     
-    profile = await db.profiles.find_one({"user_id": current_user["user_id"]}, {"_id": 0})
-    
-    if not profile:
+    if feed is None:
         return {"offers": [], "message": "Complétez votre profil pour recevoir des recommandations personnalisées"}
     
-    keywords = profile.get("title", "Développeur")
-    location = profile.get("location", "Paris")
-    skills = profile.get("skills", [])
+    if feed.get("pending"):
+        return {"offers": [], "pending": True, "message": "Vos recommandations sont en cours de préparation"}
     
-    # Fetch real offers from France Travail
-    offers = await fetch_francetravail(keywords, location)
-    
-    # Calculate match score for each offer
-    for offer in offers:
-        offer["match_score"] = match_score(skills, offer.get("description", ""))
-    
-    # Sort by match score
-    offers.sort(key=lambda x: x["match_score"], reverse=True)
-    
-    return {"offers": offers[:15]}
+    return {
+        "offers": feed.get("offers", []),
+        "computed_at": feed.get("computed_at"),
+        "cursor": feed.get("computed_at")
+    }
+
+@api_router.get("/offers/{offer_id}")
+async def get_offer(offer_id: str, current_user: dict = Depends(get_current_user)):
+    """Full offer from the harvested offers collection"""
+    offer = await db.offers.find_one({"id": offer_id}, {"_id": 0, "run_id": 0})
+    if not offer:
+        raise HTTPException(status_code=404, detail="Offre non trouvée")
+    return offer
 
 # ============ HEALTH CHECK ============
 
@@ -904,6 +1257,39 @@ async def root():
 async def health():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+def require_metrics_token(request: Request) -> None:
+    """
+    Internal counters are only served with the METRICS_TOKEN bearer token;
+    without METRICS_TOKEN configured the endpoint does not exist
+    """
+    expected = os.environ.get('METRICS_TOKEN')
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Non autorisé", headers={"WWW-Authenticate": "Bearer"})
+
+@api_router.get("/metrics", dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    """In-process cache and pool counters for this worker (Authorization: Bearer $METRICS_TOKEN)"""
+    return {
+        "auth_cache": auth_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "http_clients": http_clients.stats(),
+        "francetravail_token": francetravail_auth.stats(),
+        "offer_cache": offer_cache.stats(),
+        "labonneboite_cache": labonneboite.cache_stats(),
+        "recommendations": recommendation_engine.stats(),
+        "offer_harvester": offer_harvester.stats(),
+        "offer_index": offer_index.stats(),
+        "ai_jobs": await generation_queue.stats(),
+        "generation_cache": generation_cache.stats(),
+        "prompt_builder": prompt_builder.stats(),
+        "llm_gateway": llm_gateway.stats(),
+        "credit_ledger": credit_ledger.stats(),
+        "spontaneous_delivery": spontaneous_delivery.stats()
+    }
+
 # Include router
 app.include_router(api_router)
 
@@ -920,7 +1306,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,100 @@
+"""
+Shared fixtures: the FastAPI app on an in-memory MongoDB (mongomock-motor),
+and a counter of the MongoDB operations issued while a request runs.
+"""
+import os
+import sys
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:1")
+os.environ.setdefault("DB_NAME", "joboost_test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+from mongomock.collection import Collection
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+from lib.credit_ledger import credit_ledger
+from lib.recommendations import recommendation_engine
+
+# Collection methods that are one command (one round trip) on a real server
+COMMANDS = (
+    "insert_one", "insert_many", "find_one", "find", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "find_one_and_update", "find_one_and_delete", "find_one_and_replace",
+    "count_documents", "aggregate", "bulk_write", "distinct",
+)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()[f"joboost_test_{uuid.uuid4().hex[:8]}"]
+    monkeypatch.setattr(server, "db", database)
+    credit_ledger.configure(database)
+    recommendation_engine.configure(database)
+    return database
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    """
+    Counter of (collection, command) issued inside `with commands.recording():`
+
+    mongomock implements some methods on top of others (find_one calls
+    find); only the outermost call is counted, as a driver would send one
+    command for it.
+    """
+    counts = Counter()
+    state = {"recording": False, "depth": 0}
+
+    def counting(name, method):
+        def wrapper(self, *args, **kwargs):
+            outermost = state["depth"] == 0
+            if outermost and state["recording"]:
+                counts[(self.name, name)] += 1
+            state["depth"] += 1
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                state["depth"] -= 1
+        return wrapper
+
+    for name in COMMANDS:
+        monkeypatch.setattr(Collection, name, counting(name, getattr(Collection, name)))
+
+    @contextmanager
+    def recording():
+        counts.clear()
+        state["recording"] = True
+        try:
+            yield counts
+        finally:
+            state["recording"] = False
+
+    counts.recording = recording
+    return counts
+
+
+@pytest.fixture
+async def client(db):
+    """Authenticated client of a new free-plan user, with its user id"""
+    user_id = f"user_{uuid.uuid4().hex[:12]}"
+    email = f"{user_id}@example.org"
+    await db.users.insert_one({
+        "user_id": user_id, "email": email, "name": "Camille Martin", "subscription_plan": "free",
+        "ai_credits": 3, "ai_cv_credits": 3, "ai_letter_credits": 3, "spontaneous_credits": 5,
+        "onboarding_completed": False, "created_at": "2025-01-01T00:00:00+00:00"
+    })
+    token = server.create_access_token({"user_id": user_id, "email": email})
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test",
+                                 headers={"Authorization": f"Bearer {token}"}) as http:
+        http.user_id = user_id
+        yield http
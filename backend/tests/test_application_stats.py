@@ -0,0 +1,37 @@
+"""Counters backfill racing with application writes"""
+import pytest
+
+from lib import application_stats
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_backfill_counts_existing_applications(db):
+    await db.applications.insert_many([
+        {"user_id": "user_a", "application_id": "app_1", "status": "todo"},
+        {"user_id": "user_a", "application_id": "app_2", "status": "applied"},
+    ])
+    assert await application_stats.get(db, "user_a") == {
+        "total": 2, "todo": 1, "applied": 1, "interview": 0, "offer": 0, "rejected": 0
+    }
+
+
+async def test_increment_during_backfill_is_not_lost(db, monkeypatch):
+    compute = application_stats.compute
+    raced = []
+
+    async def compute_with_concurrent_write(db, user_id):
+        counts = await compute(db, user_id)
+        if not raced:
+            # Created after the aggregation ran, before the counters are stored
+            raced.append(True)
+            await db.applications.insert_one({"user_id": user_id, "application_id": "app_late", "status": "todo"})
+            await application_stats.record_created(db, user_id, "todo")
+        return counts
+
+    monkeypatch.setattr(application_stats, "compute", compute_with_concurrent_write)
+    counts = await application_stats.get(db, "user_b")
+    assert counts["total"] == 1 and counts["todo"] == 1
+
+    monkeypatch.setattr(application_stats, "compute", compute)
+    assert await application_stats.get(db, "user_b") == counts
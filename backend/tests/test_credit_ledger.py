@@ -0,0 +1,126 @@
+"""Credit reservations under concurrent requests, and release of abandoned reservations"""
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from lib import credit_ledger as ledger_module
+from lib.credit_ledger import credit_ledger
+from lib.prompt_builder import Prompt
+
+pytestmark = pytest.mark.anyio
+
+USER = {"user_id": "user_a", "subscription_plan": "free"}
+PROMPT = Prompt(system="system", user="user", input_tokens=2, trimmed_tokens=0, budget=1000)
+
+
+async def _balance(db):
+    return (await db.users.find_one({"user_id": "user_a"}))["ai_cv_credits"]
+
+
+@pytest.fixture
+async def user(db):
+    await db.users.insert_one({"user_id": "user_a", "subscription_plan": "free", "ai_cv_credits": 5, "ai_credits": 5})
+    return USER
+
+
+async def _entries(db):
+    """Ledger entry types per reservation"""
+    types = {}
+    async for entry in db.credit_ledger.find({"reservation_id": {"$ne": None}}).sort("created_at", 1):
+        types.setdefault(entry["reservation_id"], []).append(entry["type"])
+    return types
+
+
+async def test_concurrent_generations_never_overspend(db, user, monkeypatch):
+    async def complete(system_prompt, user_prompt, session_id):
+        await asyncio.sleep(0.01)
+        if session_id.endswith(("_app_0", "_app_3")):
+            raise RuntimeError("model error")
+        return "content"
+
+    monkeypatch.setattr(server.llm_gateway, "complete", complete)
+
+    async def generate(i):
+        request = server.AIGenerateRequest(application_id=f"app_{i}", generation_type="cv")
+        try:
+            return await server._generate_paid(request, user, PROMPT, {})
+        except HTTPException as e:
+            return e.status_code
+        except RuntimeError:
+            return "failed"
+
+    outcomes = await asyncio.gather(*(generate(i) for i in range(20)))
+    assert outcomes.count("content") == 3
+    assert outcomes.count("failed") == 2
+    assert outcomes.count(403) == 15
+    user_doc = await db.users.find_one({"user_id": "user_a"})
+    assert (user_doc["ai_cv_credits"], user_doc["ai_credits"]) == (2, 2)
+    # Every reservation was settled exactly once
+    assert sorted(map(tuple, (await _entries(db)).values())) == [("reserve", "commit")] * 3 + [("reserve", "release")] * 2
+
+
+async def test_cancelled_generation_is_released(db, user, monkeypatch):
+    started = asyncio.Event()
+
+    async def complete(system_prompt, user_prompt, session_id):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(server.llm_gateway, "complete", complete)
+    request = server.AIGenerateRequest(application_id="app_1", generation_type="cv")
+    task = asyncio.ensure_future(server._generate_paid(request, user, PROMPT, {}))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await asyncio.sleep(0)
+    assert await _balance(db) == 5
+    assert list((await _entries(db)).values()) == [["reserve", "release"]]
+
+
+async def test_unlimited_plan_is_not_charged(db):
+    await db.users.insert_one({"user_id": "user_u", "subscription_plan": "ultra", "ai_cv_credits": 0})
+    reservation = await credit_ledger.reserve({"user_id": "user_u", "subscription_plan": "ultra"},
+                                              "ai_cv_credits", 1, "cv")
+    assert await credit_ledger.commit(reservation) == 0
+    assert await db.credit_ledger.count_documents({}) == 0
+
+
+async def test_commit_gives_back_unused_credits(db, user):
+    reservation = await credit_ledger.reserve(user, "ai_cv_credits", 3, "batch")
+    assert await credit_ledger.commit(reservation, used=1) == 4
+    assert await _balance(db) == 4
+    assert list((await _entries(db)).values()) == [["reserve", "release", "commit"]]
+
+
+async def test_release_stale_only_releases_old_open_reservations(db, user, monkeypatch):
+    now = ledger_module._now()
+    monkeypatch.setattr(ledger_module, "_now", lambda: now - timedelta(seconds=credit_ledger.stale_after * 2))
+    await credit_ledger.reserve(user, "ai_cv_credits", 1, "cv")
+    settled = await credit_ledger.reserve(user, "ai_cv_credits", 1, "cv")
+    await credit_ledger.commit(settled)
+    monkeypatch.setattr(ledger_module, "_now", lambda: now)
+    await credit_ledger.reserve(user, "ai_cv_credits", 1, "cv")
+    assert await _balance(db) == 2
+
+    assert await credit_ledger.release_stale() == 1
+    assert await _balance(db) == 3
+    assert await credit_ledger.release_stale() == 0
+
+
+async def test_release_ref_skips_settled_reservations(db, user):
+    released = await credit_ledger.reserve(user, "ai_cv_credits", 1, "cv", ref="job1")
+    await credit_ledger.release(released)
+    committed = await credit_ledger.reserve(user, "ai_cv_credits", 1, "cv", ref="job1")
+    await credit_ledger.commit(committed)
+    await credit_ledger.reserve(user, "ai_cv_credits", 1, "cv", ref="job1")
+    assert await _balance(db) == 3
+
+    # Only the last attempt's reservation is still open
+    assert await credit_ledger.release_ref("job1", "generation job abandoned") == 1
+    assert await _balance(db) == 4
+    assert await credit_ledger.release_ref("job1", "generation job abandoned") == 0
+    assert await _balance(db) == 4
@@ -0,0 +1,26 @@
+"""/api/metrics is only served with the METRICS_TOKEN bearer token"""
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def _get(headers=None):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as http:
+        return await http.get("/api/metrics", headers=headers or {})
+
+
+async def test_metrics_disabled_without_token(db, monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    assert (await _get({"Authorization": "Bearer anything"})).status_code == 404
+
+
+async def test_metrics_require_token(db, monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "s3cret")
+    assert (await _get()).status_code == 401
+    assert (await _get({"Authorization": "Bearer wrong"})).status_code == 401
+    response = await _get({"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert "auth_cache" in response.json()
@@ -0,0 +1,110 @@
+"""Delivery worker against a local aiosmtpd server"""
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from lib import spontaneous_delivery as delivery_module
+from lib.spontaneous_delivery import SMTPPool, SpontaneousDelivery
+
+pytestmark = pytest.mark.anyio
+
+
+class Server:
+    """Accepts every recipient except those of the domains given a reply code"""
+
+    def __init__(self):
+        self.replies = {}
+        self.received = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        reply = self.replies.get(address.rsplit("@", 1)[-1])
+        if reply:
+            return reply
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received.extend(envelope.rcpt_tos)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    handler = Server()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    handler.port = port
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+async def worker(db, smtp):
+    delivery = SpontaneousDelivery(SMTPPool("127.0.0.1", smtp.port, starttls=False, size=2),
+                                   "candidatures@joboost.fr", max_attempts=2, backoff=60)
+    delivery.configure(db)
+    await db.users.insert_one({"user_id": "user_a", "name": "Camille Martin", "email": "camille@example.org",
+                               "subscription_plan": "free", "spontaneous_credits": 0})
+    await db.companies.insert_many([
+        {"id": name, "name": f"Entreprise {name}", "email": f"rh@{name}.fr"} for name in ("ok", "busy", "gone")
+    ])
+    now = delivery_module._iso(delivery_module._now())
+    await db.spontaneous_applications.insert_many([
+        {"user_id": "user_a", "company_id": name, "status": "queued", "attempts": 0, "created_at": now,
+         "available_at": now}
+        for name in ("ok", "busy", "gone")
+    ])
+    yield delivery
+    await delivery.pool.close()
+
+
+async def _rows(db):
+    return {row["company_id"]: row async for row in db.spontaneous_applications.find({})}
+
+
+async def _credits(db):
+    return (await db.users.find_one({"user_id": "user_a"}))["spontaneous_credits"]
+
+
+async def test_sent_retried_and_failed(db, smtp, worker):
+    smtp.replies = {"busy.fr": "451 4.7.1 Greylisted, try again later", "gone.fr": "550 5.1.1 No such user"}
+    before = delivery_module._now()
+    assert await worker.run_once() == 3
+
+    rows = await _rows(db)
+    assert rows["ok"]["status"] == "sent" and rows["ok"]["to"] == "rh@ok.fr"
+    assert smtp.received == ["rh@ok.fr"]
+    # 4xx: back in the queue after the first backoff step (60s, ±50% jitter)
+    busy = rows["busy"]
+    assert busy["status"] == "queued" and busy["attempts"] == 1 and "451" in busy["last_error"]
+    delay = (datetime.fromisoformat(busy["available_at"]) - before).total_seconds()
+    assert 30 <= delay <= 91
+    # 5xx: failed for good, credit given back
+    assert rows["gone"]["status"] == "failed" and "550" in rows["gone"]["error"]
+    assert await _credits(db) == 1
+    assert all(row.get("claim_id") is None and row["lease_until"] is None for row in rows.values())
+
+    # Not due yet
+    assert await worker.run_once() == 0
+
+
+async def test_retry_succeeds_then_exhausted_retries_fail(db, smtp, worker):
+    smtp.replies = {"busy.fr": "451 4.7.1 Greylisted, try again later", "gone.fr": "421 4.3.2 Service not available"}
+    await worker.run_once()
+    smtp.replies = {"gone.fr": "421 4.3.2 Service not available"}
+    due = delivery_module._iso(delivery_module._now() - timedelta(seconds=1))
+    await db.spontaneous_applications.update_many({"status": "queued"}, {"$set": {"available_at": due}})
+    assert await worker.run_once() == 2
+
+    rows = await _rows(db)
+    assert rows["busy"]["status"] == "sent" and rows["busy"]["attempts"] == 2
+    # Second transient failure with max_attempts=2: failed and refunded
+    assert rows["gone"]["status"] == "failed" and rows["gone"]["attempts"] == 2
+    assert await _credits(db) == 1
+    assert sorted(smtp.received) == ["rh@busy.fr", "rh@ok.fr"]
+    assert worker.counters["sent"] == 2 and worker.counters["failed"] == 1 and worker.counters["retried"] == 2
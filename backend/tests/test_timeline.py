@@ -0,0 +1,65 @@
+"""Timeline rollups racing with status changes"""
+from datetime import timedelta
+
+import pytest
+
+from lib import timeline
+
+pytestmark = pytest.mark.anyio
+
+
+async def _count_days(db, user_id, created_at):
+    # mongomock has no $substrCP: same counts as the pipeline, in Python
+    days = {}
+    async for doc in db.applications.find({"user_id": user_id, "created_at": created_at}):
+        if doc["status"] in timeline.APPLICATION_STATUSES:
+            days.setdefault(doc["created_at"][:10], timeline._empty_bucket())[doc["status"]] += 1
+    return days
+
+
+async def _move(db, application_id, status):
+    app = await db.applications.find_one_and_update({"application_id": application_id}, {"$set": {"status": status}})
+    await timeline.record_status_change(db, app["user_id"], app["created_at"], app["status"], status)
+
+
+async def _rollup(db, user_id):
+    return await db.timeline_rollups.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0, "day": 0})
+
+
+@pytest.fixture
+async def yesterday(db):
+    day = (timeline._today() - timedelta(days=1)).isoformat()
+    await db.applications.insert_many([
+        {"user_id": "user_a", "application_id": "app_1", "status": "todo", "created_at": f"{day}T09:00:00+00:00"},
+        {"user_id": "user_a", "application_id": "app_2", "status": "todo", "created_at": f"{day}T10:00:00+00:00"},
+    ])
+    return day
+
+
+async def test_status_changes_during_rollup_are_not_lost(db, yesterday, monkeypatch):
+    moves = [("app_1", "applied"), ("app_2", "interview")]
+
+    async def count_with_concurrent_write(db, user_id, created_at):
+        days = await _count_days(db, user_id, created_at)
+        if moves:
+            # Committed after the count ran, before the rollup is stored
+            await _move(db, *moves.pop(0))
+        return days
+
+    monkeypatch.setattr(timeline, "count_days", count_with_concurrent_write)
+    await timeline.ensure_rollups(db, "user_a")
+
+    rollup = await _rollup(db, "user_a")
+    assert rollup["date"] == yesterday and "backfill" not in rollup
+    assert {status: rollup[status] for status in ("todo", "applied", "interview")} == {
+        "todo": 0, "applied": 1, "interview": 1
+    }
+    assert (await db.timeline_rollup_state.find_one({"user_id": "user_a"}))["through"] == timeline._today().isoformat()
+
+
+async def test_status_change_after_rollup_is_applied(db, yesterday, monkeypatch):
+    monkeypatch.setattr(timeline, "count_days", _count_days)
+    await timeline.ensure_rollups(db, "user_a")
+    await _move(db, "app_1", "rejected")
+    rollup = await _rollup(db, "user_a")
+    assert (rollup["todo"], rollup["rejected"]) == (1, 1)
@@ -0,0 +1,89 @@
+"""
+MongoDB commands per write path
+
+Each write to the primary document is a single command (insert, upsert or
+find_one_and_update with the needed projection), never a read-modify-read
+sequence. Derived writes (stats counters, timeline rollups, feed
+invalidation) are counted too, so that any extra round trip shows up here.
+"""
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def _create(client) -> str:
+    response = await client.post("/api/applications", json={"company_name": "Acme", "job_title": "Développeur"})
+    assert response.status_code == 200
+    return response.json()["application"]["application_id"]
+
+
+async def test_create_application(client, commands):
+    await client.get("/api/applications")  # authenticates, so the user is cached
+    with commands.recording() as counts:
+        await _create(client)
+    assert counts == {
+        ("applications", "insert_one"): 1,
+        ("application_stats", "update_one"): 1,
+    }
+
+
+async def test_update_application(client, commands):
+    application_id = await _create(client)
+    with commands.recording() as counts:
+        response = await client.put(f"/api/applications/{application_id}", json={"notes": "Relancer lundi"})
+    assert response.json()["application"]["notes"] == "Relancer lundi"
+    assert counts == {("applications", "find_one_and_update"): 1}
+
+
+async def test_update_application_with_status(client, commands):
+    application_id = await _create(client)
+    with commands.recording() as counts:
+        response = await client.put(f"/api/applications/{application_id}", json={"status": "applied"})
+    assert response.json()["application"]["status"] == "applied"
+    assert counts == {
+        ("applications", "find_one_and_update"): 1,
+        ("application_stats", "update_one"): 1,
+        ("timeline_rollups", "update_one"): 1,
+    }
+
+
+async def test_update_application_status(client, commands):
+    application_id = await _create(client)
+    with commands.recording() as counts:
+        response = await client.patch(f"/api/applications/{application_id}/status", params={"status": "interview"})
+    assert response.json()["application"]["status"] == "interview"
+    assert counts == {
+        ("applications", "find_one_and_update"): 1,
+        ("application_stats", "update_one"): 1,
+        ("timeline_rollups", "update_one"): 1,
+    }
+
+
+async def test_update_missing_application(client, commands):
+    await client.get("/api/applications")
+    with commands.recording() as counts:
+        response = await client.put("/api/applications/app_missing", json={"notes": "x"})
+    assert response.status_code == 404
+    assert counts == {("applications", "find_one_and_update"): 1}
+
+
+async def test_save_profile(client, commands):
+    profile = {"user_id": client.user_id, "title": "Développeuse Python", "skills": ["Python", "SQL"]}
+    await client.get("/api/applications")
+    with commands.recording() as counts:
+        response = await client.post("/api/profile", json=profile)
+    assert response.json()["profile"]["title"] == "Développeuse Python"
+    # First save: the user's onboarding flag is set as well
+    assert counts == {
+        ("profiles", "find_one_and_update"): 1,
+        ("users", "update_one"): 1,
+        ("recommendations", "update_one"): 1,
+    }
+
+    await client.get("/api/applications")  # the onboarding update invalidated the cached user
+    with commands.recording() as counts:
+        await client.post("/api/profile", json={**profile, "title": "Lead développeuse"})
+    assert counts == {
+        ("profiles", "find_one_and_update"): 1,
+        ("recommendations", "update_one"): 1,
+    }
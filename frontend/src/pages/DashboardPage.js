@@ -209,7 +209,7 @@ const DashboardPage = () => {
     }
   };
 
-  const fetchOffers = async () => {
+  const fetchOffers = async (attempt = 0) => {
     setOffersLoading(true);
     try {
       const token = localStorage.getItem('joboost_token');
@@ -219,6 +219,10 @@ const DashboardPage = () => {
       if (response.ok) {
         const data = await response.json();
         setOffers(data.offers || []);
+        // First view: the feed is being computed in the background
+        if (data.pending && attempt < 5) {
+          setTimeout(() => fetchOffers(attempt + 1), 3000);
+        }
       }
     } catch (error) {
       console.error('Offers error:', error);
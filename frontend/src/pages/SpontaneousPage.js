@@ -106,12 +106,12 @@ const SpontaneousPage = () => {
         body: JSON.stringify({ company_ids: selectedCompanies })
       });
 
+      const data = await response.json();
       if (!response.ok) {
-        const data = await response.json();
         throw new Error(data.detail || 'Erreur lors de l\'envoi');
       }
 
-      toast.success(`${selectedCompanies.length} candidature(s) spontanée(s) envoyée(s) !`);
+      toast.success(data.message || `${data.sent} candidature(s) spontanée(s) envoyée(s) !`);
       setSelectedCompanies([]);
     } catch (error) {
       console.error('Send error:', error);